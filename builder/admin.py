@@ -1,9 +1,35 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.utils import timezone
 from .models import RuleSet, SizeOption, BaseOption
 
 @admin.register(RuleSet)
 class RuleSetAdmin(admin.ModelAdmin):
-    list_display = ("name", "free_sauces", "max_sauces_total", "max_meat_items", "updated_at")
+    list_display = ("name", "version", "is_active", "effective_from", "effective_to",
+                    "free_sauces", "max_sauces_total", "max_meat_items", "updated_at")
+    list_filter = ("is_active",)
+    readonly_fields = ("version", "updated_at")
+    actions = ("create_new_version",)
+
+    def get_readonly_fields(self, request, obj=None):
+        # по вступившему в силу набору уже считались цены — менять его задним числом нельзя,
+        # можно только закрыть окно (effective_to) или выключить
+        if obj is not None and obj.is_in_effect():
+            return self.readonly_fields + ("name", "effective_from") + RuleSet.PRICING_FIELDS
+        return self.readonly_fields
+
+    @admin.action(description="Создать новую версию (черновик)")
+    def create_new_version(self, request, queryset):
+        for rs in queryset:
+            RuleSet.objects.create(
+                name=rs.name,
+                free_sauces=rs.free_sauces,
+                max_sauces_total=rs.max_sauces_total,
+                max_meat_items=rs.max_meat_items,
+                is_active=False,
+                effective_from=timezone.now(),
+            )
+        self.message_user(request, f"Создано черновиков: {queryset.count()}. Проверьте даты и включите is_active.",
+                          messages.SUCCESS)
 
 @admin.register(SizeOption)
 class SizeOptionAdmin(admin.ModelAdmin):
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def assign_versions(apps, schema_editor):
+    # раньше действовал последний измененный набор — сохраняем этот порядок
+    RuleSet = apps.get_model("builder", "RuleSet")
+    for version, rs in enumerate(RuleSet.objects.order_by("updated_at", "id"), start=1):
+        rs.version = version
+        rs.effective_from = rs.updated_at
+        rs.save(update_fields=["version", "effective_from"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('builder', '0003_delete_productoption'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='ruleset',
+            options={'ordering': ['-effective_from', '-version']},
+        ),
+        migrations.AddField(
+            model_name='ruleset',
+            name='effective_from',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='ruleset',
+            name='effective_to',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ruleset',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='ruleset',
+            name='version',
+            field=models.PositiveIntegerField(editable=False, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='ruleset',
+            index=models.Index(fields=['is_active', 'effective_from'], name='ruleset_active_from_idx'),
+        ),
+        migrations.RunPython(assign_versions, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,43 @@
 from django.db import models
+from django.utils import timezone
 
 class RuleSet(models.Model):
-    """Базовые правила конструктора."""
+    """Базовые правила конструктора.
+
+    Правила версионируются: действует активный набор с самым поздним
+    effective_from, у которого еще не наступил effective_to. Вступивший
+    в силу набор не редактируется — для изменений создается новая версия.
+    """
     name = models.CharField(max_length=80, default="Default")
+    version = models.PositiveIntegerField(unique=True, null=True, editable=False)  # попадает в snapshot сборки
     free_sauces = models.PositiveIntegerField(default=2)          # сколько соусов бесплатно
     max_sauces_total = models.PositiveIntegerField(default=4)     # максимум соусов можно выбрать
     max_meat_items = models.PositiveIntegerField(default=2)       # максимум мясных ингредиентов (с учетом повторов)
+    is_active = models.BooleanField(default=True)
+    effective_from = models.DateTimeField(default=timezone.now)
+    effective_to = models.DateTimeField(null=True, blank=True)    # не включительно; пусто — бессрочно
     updated_at = models.DateTimeField(auto_now=True)
 
+    # поля, от которых зависит цена сборки
+    PRICING_FIELDS = ("free_sauces", "max_sauces_total", "max_meat_items")
+
+    class Meta:
+        ordering = ["-effective_from", "-version"]
+        indexes = [models.Index(fields=["is_active", "effective_from"], name="ruleset_active_from_idx")]
+
+    def save(self, *args, **kwargs):
+        if self.version is None:
+            last = RuleSet.objects.aggregate(models.Max("version"))["version__max"]
+            self.version = (last or 0) + 1
+        super().save(*args, **kwargs)
+
+    def is_in_effect(self, at=None) -> bool:
+        """Набор уже действовал (или действует) — по нему могли считаться цены."""
+        at = at or timezone.now()
+        return self.pk is not None and self.is_active and self.effective_from <= at
+
     def __str__(self):
-        return self.name
+        return f"{self.name} v{self.version}" if self.version else self.name
 
 class SizeOption(models.Model):
     code = models.CharField(max_length=8, unique=True)  # S/M/L
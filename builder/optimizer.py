@@ -0,0 +1,524 @@
+# builder/optimizer.py
+"""Подбор сборок под бюджет / калории ("удиви меня", "уложись в бюджет").
+
+Ограниченный рюкзак (каждый ингредиент 0..max_qty раз) динамикой по
+состояниям (мясо, соусы, очки) — плюс число позиций, если клиент задал
+max_items. В каждом состоянии храним не одно решение, а K-Парето-набор по
+(стоимость, калории): запись выкидываем, только если ее не хуже по обоим
+параметрам уже K других — значит, в итоговый top-K она попасть не может.
+
+Пространство состояний держат в узде:
+- соусы и мясо идут первыми; когда они кончились, их счетчики больше ничего
+  не ограничивают, и состояния склеиваются — дальше ключ только очки;
+- ингредиенты, которых заведомо больше, чем влезет в сборку, конкурентов не
+  хуже их по всем параметрам, выкидываются до динамики;
+- записи, которым даже в лучшем случае не догнать K-ю известную сборку,
+  отсекаются. Лучший случай — дробный рюкзак по оставшимся ингредиентам,
+  K-я сборка на старте — из жадного подбора (а при лимите калорий или
+  max_items — из предварительного прохода с парой записей на состояние),
+  потом — из найденных динамикой.
+
+Соусы идут первыми и по убыванию цены, поэтому бесплатная квота достается
+самым дорогим из них — ровно так calculate_build и посчитает сборку, если
+передать ингредиенты в этом порядке.
+"""
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+from bisect import bisect_right, insort
+from fractions import Fraction
+from itertools import accumulate
+
+from catalog.models import Ingredient
+from core.money import MINOR_PER_UNIT
+from .pricing import get_catalog
+from .services import MAX_INGREDIENT_QTY, _price_build, _to_int
+
+OBJECTIVES = ("count", "portions", "popularity")
+MAX_TOP_K = 10
+BEAM_WIDTH = 2  # записей на состояние в предварительном проходе
+# смеси (доля бюджета, доля калорий, доля max_items) для оценок сверху; берутся те,
+# где есть только заданные ограничения
+RESOURCE_MIXES = (
+    (1, 0, 0), (0, 1, 0), (0, 0, 1),
+    (1, 1, 0), (1, 3, 0), (3, 1, 0), (1, 0, 1), (1, 0, 3), (3, 0, 1), (0, 1, 1), (1, 1, 1),
+)
+
+POPULARITY_TTL = 300  # сек
+POPULARITY_ORDERS = 1000  # сколько последних позиций заказов учитывать
+_popularity_lock = threading.Lock()
+_popularity = (0.0, {})
+
+
+def _popularity_weights() -> dict:
+    """Вес ингредиента 1..10 по частоте в последних заказах (кэш на процесс)."""
+    global _popularity
+
+    loaded_at, weights = _popularity
+    if time.monotonic() - loaded_at < POPULARITY_TTL:
+        return weights
+
+    from orders.models import OrderItem  # orders зависит от builder через cart
+
+    with _popularity_lock:
+        # пока ждали блокировку, веса мог пересчитать другой поток
+        loaded_at, weights = _popularity
+        if time.monotonic() - loaded_at < POPULARITY_TTL:
+            return weights
+        counts = {}
+        snapshots = OrderItem.objects.order_by("-id").values_list("snapshot_json", flat=True)[:POPULARITY_ORDERS]
+        for snap in snapshots:
+            for item in (snap or {}).get("items") or ():
+                ing_id = item.get("id")
+                if ing_id is not None:
+                    counts[ing_id] = counts.get(ing_id, 0) + 1
+        top = max(counts.values(), default=0)
+        weights = {ing_id: 1 + round(9 * c / top) for ing_id, c in counts.items()} if top else {}
+        _popularity = (time.monotonic(), weights)
+    return weights
+
+
+def _prune(entries: list, k: int, by_calories: bool) -> list:
+    entries.sort(key=lambda e: (e[0], e[1]))
+    if not by_calories:
+        return entries[:k]
+    kept, kept_calories = [], []
+    for entry in entries:
+        # все kept не дороже entry; если K из них еще и не калорийнее — entry лишняя
+        if bisect_right(kept_calories, entry[1]) < k:
+            kept.append(entry)
+            insort(kept_calories, entry[1])
+    return kept
+
+
+def _drop_dominated(group: list, unit_value, keep_after: int) -> list:
+    """Убирает ингредиенты, у которых >= keep_after конкурентов своей группы
+    не дороже, не калорийнее и не менее ценны: в любой сборке такой ингредиент
+    можно заменить свободным конкурентом без потерь, так что top-K не страдает."""
+    if keep_after >= len(group):
+        return group  # столько конкурентов ни у кого нет
+    kept = []
+    for ing in group:
+        dominators = 0
+        for other in group:
+            if other is not ing and other.price_minor <= ing.price_minor and other.calories <= ing.calories \
+                    and unit_value(other) >= unit_value(ing):
+                dominators += 1
+                if dominators >= keep_after:
+                    break
+        if dominators < keep_after:
+            kept.append(ing)
+    return kept
+
+
+def _fit_count(values, limit: int) -> int:
+    """Сколько самых маленьких из values умещается в сумму limit."""
+    values = sorted(values)
+    total = 0
+    for n, v in enumerate(values):
+        total += v
+        if total > limit:
+            return n
+    return len(values)
+
+
+def _suffix_max(values: list) -> list:
+    out = [0] * (len(values) + 1)
+    for idx in range(len(values) - 1, -1, -1):
+        out[idx] = max(values[idx], out[idx + 1])
+    return out
+
+
+def _greedy_builds(items: list, rs, budget: int, max_calories, max_items, max_qty: int, unit_value,
+                   portions: bool) -> list:
+    """[((очки, -стоимость), состав)] жадной сборки и всех сборок «она же без одного
+    ингредиента»; состав — frozenset пар (id, qty).
+
+    Жадная сборка — ингредиенты по порядку items, каждый с наибольшим qty, который
+    еще влезает. Все это настоящие сборки, поэтому K-я по рангу из разных составов —
+    нижняя граница для K-го места ответа. Бесплатные соусы считаем в порядке выбора,
+    а без соуса стоимость не уменьшаем: так она выходит не ниже настоящей."""
+    picked = []  # (ингредиент, qty, очки, стоимость) каждого выбранного
+    meat = sauce = cost = calories = value = 0
+    for ing in items:
+        if max_items is not None and len(picked) >= max_items:
+            break
+        is_sauce = ing.type == Ingredient.Type.SAUCE
+        is_meat = ing.type == Ingredient.Type.MEAT
+        for qty in range(max_qty, 0, -1):
+            if is_meat and meat + qty > rs.max_meat_items or is_sauce and sauce + qty > rs.max_sauces_total:
+                continue
+            free_now = min(max(rs.free_sauces - sauce, 0), qty) if is_sauce else 0
+            add_cost = ing.price_minor * (qty - free_now)
+            if cost + add_cost > budget:
+                continue
+            if max_calories is not None and calories + ing.calories * qty > max_calories:
+                continue
+            gain = unit_value(ing) * qty if portions else unit_value(ing)
+            meat += qty if is_meat else 0
+            sauce += qty if is_sauce else 0
+            cost += add_cost
+            calories += ing.calories * qty
+            value += gain
+            picked.append((ing.id, qty, gain, 0 if is_sauce else add_cost))
+            break
+    if not picked:
+        return []
+    full = frozenset((ing_id, qty) for ing_id, qty, _, _ in picked)
+    return [((value, -cost), full)] + [
+        ((value - gain, add_cost - cost), full - {(ing_id, qty)}) for ing_id, qty, gain, add_cost in picked
+    ]
+
+
+def _by_density(unit_value, weight):
+    # больше очков на единицу weight(ing) — раньше; невесомые — самые первые
+    def key(ing):
+        w = weight(ing)
+        return (w > 0, -Fraction(unit_value(ing), w or 1), w, ing.id)
+    return key
+
+
+def _fractional(weights: list, values: list, start: int, room: int) -> int:
+    """Дробный рюкзак по ингредиентам с номера start (weights, values — префиксные
+    суммы по убыванию очков на единицу веса): сколько очков влезает в room, если
+    последний ингредиент можно взять частично. Это оценка сверху для целых сборок."""
+    limit = weights[start] + room
+    end = bisect_right(weights, limit) - 1
+    value = values[end] - values[start]
+    if end + 1 < len(weights):
+        value += (limit - weights[end]) * (values[end + 1] - values[end]) // (weights[end + 1] - weights[end])
+    return value
+
+
+def _prefixes(items: list, unit_value, qty_factor: int, weight) -> tuple:
+    return (
+        list(accumulate((weight(i) for i in items), initial=0)),
+        list(accumulate((unit_value(i) * qty_factor for i in items), initial=0)),
+    )
+
+
+def _tail_prefixes(others: list, unit_value, qty_factor: int, weight) -> list:
+    """Для каждого start — префиксные суммы (вес, очки) others[start:] по убыванию очков на вес."""
+    order = sorted(others, key=_by_density(unit_value, weight))
+    position = {ing.id: n for n, ing in enumerate(others)}
+    return [
+        _prefixes([i for i in order if position[i.id] >= start], unit_value, qty_factor, weight)
+        for start in range(len(others) + 1)
+    ]
+
+
+def _mix(mix: tuple, budget: int, max_calories, max_items, qty_factor: int) -> tuple:
+    """(вес ингредиента, остаток(стоимость, калории, позиций)) для смеси ограничений
+    mix = (a, b, c): a долей бюджета + b долей лимита калорий + c долей max_items.
+    Вес — за ингредиент целиком, qty_factor штук. Сумма ограничений — тоже
+    ограничение, так что дробный рюкзак по любой смеси — оценка сверху."""
+    a, b, c = mix
+    budget_scale, calorie_scale, items_scale = max(budget, 1), max_calories or 1, max_items or 1
+
+    def weight(ing):
+        return (a * ing.price_minor * qty_factor * calorie_scale * items_scale
+                + b * ing.calories * qty_factor * budget_scale * items_scale
+                + c * budget_scale * calorie_scale)
+
+    def room(cost, calories, count):
+        total = a * (budget - cost) * calorie_scale * items_scale
+        if b:
+            total += b * (max_calories - calories) * budget_scale * items_scale
+        if c:
+            total += c * (max_items - count) * budget_scale * calorie_scale
+        return total
+
+    return weight, room
+
+
+def _reach_fn(sauces: list, meats: list, others: list, unit_value, qty_factor: int, rs, budget: int, max_items,
+              mixes: list):
+    """reaches(idx, мясо, соусы, позиций, очки, стоимость, калории, threshold) — может ли
+    сборка из состояния перед items[idx] (items = sauces + meats + others) хотя бы в лучшем
+    случае дотянуть по (очки, -стоимость) до threshold.
+
+    Лучший случай оцениваем сверху: мясо и соусы — по самому ценному из оставшихся на
+    каждое свободное место; others — дробный рюкзак по каждой смеси (вес, остаток) из
+    mixes, годится самая низкая из оценок. others уже идут по убыванию очков на вес
+    первой смеси, для остальных у каждого хвоста свой порядок."""
+    first_other = len(sauces) + len(meats)
+    weight, room = mixes[0]
+    prefixes = _prefixes(others, unit_value, qty_factor, weight)
+    tails = [(_tail_prefixes(others, unit_value, qty_factor, w), r) for w, r in mixes[1:]]
+    sauce_max = _suffix_max([unit_value(i) for i in sauces])
+    meat_max = _suffix_max([unit_value(i) for i in meats])
+    item_max = _suffix_max([unit_value(i) * qty_factor for i in sauces + meats + others])
+
+    def at_least(idx, meat, sauce, count, value, cost, calories, need) -> bool:
+        if max_items is not None and value + (max_items - count) * item_max[idx] < need:
+            return False
+        if idx < first_other:
+            value += (rs.max_sauces_total - sauce) * sauce_max[min(idx, len(sauces))] \
+                + (rs.max_meat_items - meat) * meat_max[max(idx - len(sauces), 0)]
+        start = max(idx - first_other, 0)
+        if value + _fractional(*prefixes, start, room(cost, calories, count)) < need:
+            return False
+        for tail_prefixes, tail_room in tails:
+            if value + _fractional(*tail_prefixes[start], 0, tail_room(cost, calories, count)) < need:
+                return False
+        return True
+
+    def reaches(idx, meat, sauce, count, value, cost, calories, threshold) -> bool:
+        # догнать (очки, -стоимость) = threshold: столько же очков, уложившись в стоимость
+        # K-й сборки (остаток бюджета считаем от нее), — или больше очков в пределах бюджета
+        top_value, top_cost = threshold[0], -threshold[1]
+        if cost <= top_cost and at_least(idx, meat, sauce, count, value, cost + budget - top_cost, calories,
+                                         top_value):
+            return True
+        return at_least(idx, meat, sauce, count, value, cost, calories, top_value + 1)
+
+    return reaches
+
+
+def _search(items: list, first_other: int, rs, budget: int, max_calories, max_items, max_qty: int, portions: bool,
+            unit_value, top_k: int, floor, reaches, keep) -> tuple:
+    """Динамика по items (сначала соусы и мясо, others — с номера first_other): (dp, best).
+
+    keep(записи) — какие записи состояния оставить, по возрастанию стоимости: K-Парето
+    для точного ответа или несколько штук для быстрого предварительного прохода."""
+    # K лучших (очки, -стоимость) среди уже найденных сборок (min-heap) — порог отсечения
+    best = []
+
+    # (мясо, соусы, позиций, очки) → [(стоимость, калории, узел)] по возрастанию стоимости,
+    # узел = (индекс, qty, родитель); позиции считаем, только если задан max_items
+    dp = {(0, 0, 0, 0): [(0, 0, None)]}
+    for idx, ing in enumerate(items):
+        if idx == first_other:
+            # мясо и соусы кончились, их счетчики больше ничего не ограничивают — склеиваем состояния
+            merged = {}
+            for (_, _, count, value), entries in dp.items():
+                merged.setdefault((0, 0, count, value), []).extend(entries)
+            dp = {key: keep(entries) for key, entries in merged.items()}
+
+        is_sauce = ing.type == Ingredient.Type.SAUCE
+        is_meat = ing.type == Ingredient.Type.MEAT
+        ing_value = unit_value(ing)
+        threshold = best[0] if len(best) == top_k else None
+        if floor is not None and (threshold is None or floor > threshold):
+            threshold = floor
+
+        additions, dead = {}, []
+        for key, entries in dp.items():
+            meat, sauce, count, value = key
+            if threshold is not None:
+                # записи, которые даже в лучшем случае не обгонят K-е решение, выкидываем;
+                # сначала одна проверка на всё состояние — с самыми низкими стоимостью и калориями
+                if len(entries) > 1 and not reaches(
+                    idx, meat, sauce, count, value, entries[0][0], min(e[1] for e in entries), threshold,
+                ):
+                    dead.append(key)
+                    continue
+                alive = [e for e in entries if reaches(idx, meat, sauce, count, value, e[0], e[1], threshold)]
+                if not alive:
+                    dead.append(key)
+                    continue
+                if len(alive) < len(entries):
+                    entries = dp[key] = alive
+            if max_items is not None and count >= max_items:
+                continue
+            new_count = count + 1 if max_items is not None else 0
+            for qty in range(1, max_qty + 1):
+                new_meat = meat + qty if is_meat else meat
+                new_sauce = sauce + qty if is_sauce else sauce
+                if new_meat > rs.max_meat_items or new_sauce > rs.max_sauces_total:
+                    break
+                if is_sauce:
+                    free_now = min(max(rs.free_sauces - sauce, 0), qty)
+                    add_cost = ing.price_minor * (qty - free_now)
+                else:
+                    add_cost = ing.price_minor * qty
+                add_calories = ing.calories * qty
+                new_value = value + (ing_value * qty if portions else ing_value)
+
+                bucket = None
+                for cost, calories, node in entries:
+                    cost += add_cost
+                    if cost > budget:
+                        continue
+                    calories += add_calories
+                    if max_calories is not None and calories > max_calories:
+                        continue
+                    if bucket is None:
+                        bucket = additions.setdefault((new_meat, new_sauce, new_count, new_value), [])
+                    bucket.append((cost, calories, (idx, qty, node)))
+
+        for key in dead:
+            del dp[key]
+        for key, new_entries in additions.items():
+            for cost, _, _ in new_entries:
+                rank = (key[3], -cost)
+                if len(best) < top_k:
+                    heapq.heappush(best, rank)
+                elif rank > best[0]:
+                    heapq.heapreplace(best, rank)
+            dp[key] = keep(dp.get(key, []) + new_entries)
+
+    return dp, best
+
+
+def suggest_builds(payload: dict) -> dict:
+    """Top-K сборок, которые укладываются в max_price (и max_calories)."""
+    cat = get_catalog()
+    rs = cat.rules
+
+    product = cat.products.get(_to_int(payload.get("product_id"), None))
+    if not product:
+        return {"ok": False, "error": "product_id is invalid"}
+    size = cat.sizes.get(_to_int(payload.get("size_id"), None))
+    if not size:
+        return {"ok": False, "error": "size_id is required/invalid"}
+    base = cat.bases.get(_to_int(payload.get("base_id"), None))
+    if not base:
+        return {"ok": False, "error": "base_id is required/invalid"}
+
+    max_price = _to_int(payload.get("max_price"), None)
+    if max_price is None or max_price <= 0:
+        return {"ok": False, "error": "max_price is required"}
+    max_calories = _to_int(payload.get("max_calories"), None)
+
+    objective = payload.get("objective") or "count"
+    if objective not in OBJECTIVES:
+        return {"ok": False, "error": f"objective must be one of {', '.join(OBJECTIVES)}"}
+    portions = objective == "portions"
+    top_k = max(1, min(_to_int(payload.get("top_k"), 3), MAX_TOP_K))
+    max_qty = max(1, min(_to_int(payload.get("max_qty"), 1), MAX_INGREDIENT_QTY))
+    # необязательное ограничение клиента на число разных ингредиентов; по умолчанию его нет
+    max_items = _to_int(payload.get("max_items"), None)
+    if max_items is not None:
+        max_items = max(1, max_items)
+    exclude = payload.get("exclude_allergens") or ()
+    if isinstance(exclude, str):
+        exclude = exclude.split(",")  # как в ?exclude_allergens= у опций
+    exclude_mask = cat.allergen_mask_for(exclude)
+
+    # бюджет на ингредиенты в тиынах: product * mult + base + ингредиенты <= max_price
+    scale = 10 ** size.mult_exp
+    budget = (max_price * MINOR_PER_UNIT * scale - product.price_minor * size.mult_num) // scale - base.price_minor
+    if budget < 0:
+        return {"ok": False, "error": "max_price is below the price of the empty build"}
+
+    weights = _popularity_weights() if objective == "popularity" else {}
+
+    def unit_value(ing):
+        return weights.get(ing.id, 1) if objective == "popularity" else 1
+
+    sauces, meats, others = [], [], []
+    for ing in cat.ingredients.values():
+        if ing.allergen_mask & exclude_mask:
+            continue
+        if max_calories is not None and ing.calories > max_calories:
+            continue
+        if ing.type == Ingredient.Type.SAUCE:
+            sauces.append(ing)
+        elif ing.type == Ingredient.Type.MEAT:
+            meats.append(ing)
+        else:
+            others.append(ing)
+
+    def group_cap(group, cap, priced=True):
+        # больше стольких ингредиентов группы в одну сборку не поместится
+        if priced:  # соусы бывают бесплатными, по цене их не ограничить
+            cap = min(cap, _fit_count((i.price_minor for i in group), budget))
+        if max_calories is not None:
+            cap = min(cap, _fit_count((i.calories for i in group), max_calories))
+        return cap if max_items is None else min(cap, max_items)
+
+    sauces = _drop_dominated(sauces, unit_value, group_cap(sauces, rs.max_sauces_total, priced=False) + top_k - 1)
+    meats = _drop_dominated(meats, unit_value, group_cap(meats, rs.max_meat_items) + top_k - 1)
+    others = _drop_dominated(others, unit_value, group_cap(others, len(others)) + top_k - 1)
+    sauces.sort(key=lambda i: (-i.price_minor, i.id))
+    meats.sort(key=lambda i: (-unit_value(i), i.price_minor, i.id))
+    qty_factor = max_qty if portions else 1
+
+    # others идут по убыванию очков на вес той смеси ограничений, что дает самую точную
+    # оценку сверху: где держит лимит калорий — почти калории, где бюджет — цена
+    active = (True, max_calories is not None, max_items is not None)
+    mixes = [
+        _mix(m, budget, max_calories, max_items, qty_factor)
+        for m in RESOURCE_MIXES if all(on or not share for on, share in zip(active, m))
+    ]
+    singles = mixes[:sum(active)]  # (1, 0, 0) и т. п. идут в RESOURCE_MIXES первыми
+
+    def root_bound(mix):
+        weight, room = mix
+        return _fractional(*_prefixes(sorted(others, key=_by_density(unit_value, weight)), unit_value,
+                                      qty_factor, weight), 0, room(0, 0, 0))
+
+    main_mix = min(mixes, key=root_bound) if len(mixes) > 1 else mixes[0]
+    others.sort(key=_by_density(unit_value, main_mix[0]))
+    # плюс каждое ограничение по отдельности — у них свои порядки
+    bound_args = (unit_value, qty_factor, rs, budget, max_items, [main_mix] + [m for m in singles if m is not main_mix])
+    reaches = _reach_fn(sauces, meats, others, *bound_args)
+
+    # K-я из жадных сборок (по каждому порядку, разные составы) — порог отсечения,
+    # пока сама динамика не нашла K сборок лучше
+    greedy = {}
+    for weight, _ in mixes:
+        ordered = sorted(sauces + meats + others, key=_by_density(unit_value, weight))
+        for rank, build in _greedy_builds(ordered, rs, budget, max_calories, max_items, qty_factor, unit_value,
+                                          portions):
+            greedy[build] = max(rank, greedy.get(build, rank))
+    ranks = sorted(greedy.values(), reverse=True)
+    floor = ranks[top_k - 1] if len(ranks) >= top_k and ranks[top_k - 1][0] > 0 else None
+
+    if max_calories is not None or max_items is not None:
+        # при втором ограничении кроме бюджета жадный порог слабый; быстрый проход той же
+        # динамикой, где в состоянии остается BEAM_WIDTH записей (меньше всего долей бюджета
+        # и калорий), находит сборки почти лучшие — их K-я становится порогом для точного
+        budget_scale, calorie_scale = max(budget, 1), max_calories or 1
+
+        def beam(entries):
+            entries = heapq.nsmallest(BEAM_WIDTH, entries, key=lambda e: e[0] * calorie_scale + e[1] * budget_scale)
+            entries.sort()
+            return entries
+
+        _, found = _search(sauces + meats + others, len(sauces) + len(meats), rs, budget, max_calories, max_items,
+                           max_qty, portions, unit_value, top_k, floor, reaches, beam)
+        if len(found) == top_k and (floor is None or found[0] > floor):
+            floor = found[0]
+
+    if floor is not None:
+        # ингредиент, с которым даже оценка сверху не дотягивает до порога, в top-K не попадет
+        def promising(ing):
+            cost = 0 if ing.type == Ingredient.Type.SAUCE else ing.price_minor
+            return cost <= budget and reaches(0, 0, 0, 1, unit_value(ing) * qty_factor, cost, ing.calories, floor)
+
+        sauces, meats, others = ([i for i in group if promising(i)] for group in (sauces, meats, others))
+        reaches = _reach_fn(sauces, meats, others, *bound_args)
+    items = sauces + meats + others
+    first_other = len(sauces) + len(meats)
+
+    dp, _ = _search(items, first_other, rs, budget, max_calories, max_items, max_qty, portions, unit_value, top_k,
+                    floor, reaches, lambda entries: _prune(entries, top_k, max_calories is not None))
+
+    ranked = sorted(
+        ((value, cost, calories, node)
+         for (_, _, _, value), entries in dp.items() if value > 0
+         for cost, calories, node in entries),
+        key=lambda r: (-r[0], r[1], r[2]),
+    )[:top_k]
+
+    builds = []
+    for value, _, _, node in ranked:
+        chosen = []
+        while node is not None:
+            idx, qty, node = node
+            chosen.append((idx, qty))
+        chosen.sort()
+        build = {
+            "product_id": product.id,
+            "size_id": size.id,
+            "base_id": base.id,
+            "ingredient_ids": [items[idx].id for idx, _ in chosen],
+            "quantities": {str(items[idx].id): qty for idx, qty in chosen},
+        }
+        builds.append({"score": value, "payload": build, **_price_build(cat, build)})
+
+    return {"ok": True, "objective": objective, "builds": builds}
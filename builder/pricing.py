@@ -0,0 +1,335 @@
+# builder/pricing.py
+"""Скомпилированный in-memory каталог для расчета цены конструктора.
+
+Каталог — неизменяемый снимок правил, размеров, основ, ингредиентов и товаров.
+Он собирается одним проходом по БД и переиспользуется, пока не изменится
+общая версия каталога (счетчик в кэше Django, его бампают сигналы из
+builder/signals.py). Так calculate_build работает без запросов к БД, а все
+воркеры узнают об изменениях через общий кэш.
+
+Правила конструктора компилируются вместе с расписанием (effective_from /
+effective_to), поэтому смена действующей версии по времени не требует
+похода в БД.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime
+from decimal import Decimal
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from core.money import to_minor, to_scaled
+from catalog.models import Allergen, Ingredient, IngredientCategory, Product
+from .models import RuleSet, SizeOption, BaseOption
+
+VERSION_CACHE_KEY = "builder:catalog_version"
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    id: int | None
+    version: int  # 0 — правил в БД нет, действуют значения по умолчанию
+    name: str
+    free_sauces: int
+    max_sauces_total: int
+    max_meat_items: int
+    effective_from: datetime | None
+    effective_to: datetime | None
+
+    def is_effective(self, at: datetime) -> bool:
+        return (self.effective_from is None or self.effective_from <= at) and \
+            (self.effective_to is None or at < self.effective_to)
+
+
+DEFAULT_RULES_VERSION = 0
+
+
+@dataclass(frozen=True)
+class CompiledProduct:
+    id: int
+    name: str
+    price: Decimal
+    price_minor: int
+
+
+@dataclass(frozen=True)
+class CompiledSize:
+    id: int
+    code: str
+    name: str
+    base_price: Decimal
+    # множитель цены из code, посчитанный один раз: mult = mult_num * 10**-mult_exp
+    mult_num: int
+    mult_exp: int
+
+
+@dataclass(frozen=True)
+class CompiledBase:
+    id: int
+    name: str
+    price: Decimal
+    price_minor: int
+
+
+@dataclass(frozen=True)
+class CompiledIngredient:
+    id: int
+    name: str
+    type: str
+    price: Decimal
+    price_minor: int
+    calories: int
+    allergen_mask: int
+    allergens: tuple  # коды аллергенов, раскодированные из allergen_mask
+    category_id: int
+    grams: int
+    is_spicy: bool
+    image_url: str | None
+
+
+@dataclass(frozen=True)
+class CompiledCategory:
+    id: int
+    name: str
+    sort_order: int
+
+
+@dataclass(frozen=True)
+class CompiledAllergen:
+    id: int
+    code: str
+    name: str
+    bit: int
+
+
+@dataclass(frozen=True)
+class PricingCatalog:
+    version: int
+    rules: CompiledRules  # действующие сейчас; до rules_until (unix time) не меняются
+    rules_until: float
+    rule_schedule: tuple  # все активные наборы, еще не истекшие на момент компиляции
+    products: MappingProxyType
+    sizes: MappingProxyType
+    bases: MappingProxyType
+    ingredients: MappingProxyType
+    categories: MappingProxyType
+    allergens: MappingProxyType
+    allergen_codes: MappingProxyType  # bit → code
+
+    @property
+    def pricing_key(self) -> tuple:
+        """Версия каталога вместе с версией правил — ключ для кэшей результатов."""
+        return self.version, self.rules.version
+
+    def with_rules_at(self, at: datetime) -> "PricingCatalog":
+        """Тот же каталог с правилами, действующими в момент at."""
+        rules, until = _select_rules(self.rule_schedule, at)
+        if rules == self.rules and until == self.rules_until:
+            return self
+        return replace(self, rules=rules, rules_until=until)
+
+    def decode_allergens(self, mask: int) -> list:
+        """Маска аллергенов → отсортированный список кодов."""
+        codes = []
+        while mask:
+            low = mask & -mask
+            code = self.allergen_codes.get(low.bit_length() - 1)
+            if code is not None:
+                codes.append(code)
+            mask ^= low
+        codes.sort()
+        return codes
+
+    def allergen_mask_for(self, codes) -> int:
+        """Коды аллергенов → маска; регистр не важен, неизвестные коды игнорируются.
+
+        Allergen.code в админке пишут как угодно ("nuts", "Lactose"), а клиент
+        может прислать любой регистр — сравниваем оба в верхнем."""
+        by_code = {}
+        for bit, code in self.allergen_codes.items():
+            key = code.upper()
+            by_code[key] = by_code.get(key, 0) | 1 << bit
+        mask = 0
+        for code in codes:
+            mask |= by_code.get(str(code).strip().upper(), 0)
+        return mask
+
+
+def _size_mult(code) -> Decimal:
+    # size.code ожидается "1.0" / "1.5" / "2.0"
+    try:
+        mult = Decimal(str(code))
+    except Exception:
+        return Decimal("1.0")
+    if not mult.is_finite():
+        return Decimal("1.0")
+    return mult
+
+
+def _compile_rule(rs: RuleSet) -> CompiledRules:
+    return CompiledRules(
+        id=rs.id,
+        version=rs.version or DEFAULT_RULES_VERSION,
+        name=rs.name,
+        free_sauces=rs.free_sauces,
+        max_sauces_total=rs.max_sauces_total,
+        max_meat_items=rs.max_meat_items,
+        effective_from=rs.effective_from if rs.id else None,
+        effective_to=rs.effective_to if rs.id else None,
+    )
+
+
+def _compile_rule_schedule(at: datetime) -> tuple:
+    """Активные наборы правил, которые действуют сейчас или вступят в силу позже."""
+    qs = RuleSet.objects.filter(is_active=True).filter(Q(effective_to__isnull=True) | Q(effective_to__gt=at))
+    return tuple(_compile_rule(rs) for rs in qs.order_by("-effective_from", "-version"))
+
+
+def _select_rules(schedule: tuple, at: datetime) -> tuple:
+    """(действующие правила, unix time ближайшей смены правил или inf).
+
+    Действует набор с самым поздним effective_from (при равенстве — старшая
+    версия), окно которого содержит at. Правил нет — значения модели по умолчанию.
+    """
+    current = next((r for r in schedule if r.is_effective(at)), None)
+    if current is None:
+        current = _compile_rule(RuleSet())
+    boundaries = [
+        moment.timestamp()
+        for r in schedule
+        for moment in (r.effective_from, r.effective_to)
+        if moment is not None and moment > at
+    ]
+    return current, min(boundaries, default=float("inf"))
+
+
+def compile_catalog(version: int) -> PricingCatalog:
+    """Читает из БД все, что нужно для расчета цены и опций, и замораживает.
+
+    Словари сохраняют порядок Meta.ordering моделей — в нем же отдаются опции.
+    """
+    products = {
+        p.id: CompiledProduct(id=p.id, name=p.name, price=p.price, price_minor=to_minor(p.price))
+        for p in Product.objects.filter(is_available=True).only("id", "name", "price")
+    }
+    sizes = {}
+    for s in SizeOption.objects.all():
+        mult_num, mult_exp = to_scaled(_size_mult(s.code))
+        sizes[s.id] = CompiledSize(
+            id=s.id, code=str(s.code), name=s.name, base_price=s.base_price, mult_num=mult_num, mult_exp=mult_exp,
+        )
+    bases = {
+        b.id: CompiledBase(id=b.id, name=b.name, price=b.price, price_minor=to_minor(b.price))
+        for b in BaseOption.objects.filter(is_available=True)
+    }
+    allergens = {
+        a.id: CompiledAllergen(id=a.id, code=a.code, name=a.name, bit=a.bit)
+        for a in Allergen.objects.order_by("name")
+    }
+    allergen_codes = {a.bit: a.code for a in allergens.values() if a.bit is not None}
+
+    ingredients = {}
+    for i in Ingredient.objects.filter(is_available=True):
+        codes = []
+        mask = i.allergen_mask
+        for bit, code in allergen_codes.items():
+            if mask & (1 << bit):
+                codes.append(code)
+        ingredients[i.id] = CompiledIngredient(
+            id=i.id,
+            name=i.name,
+            type=str(i.type),
+            price=i.price,
+            price_minor=to_minor(i.price),
+            calories=i.calories or 0,
+            allergen_mask=mask,
+            allergens=tuple(sorted(codes)),
+            category_id=i.category_id,
+            grams=i.grams,
+            is_spicy=i.is_spicy,
+            image_url=i.image_url.url if i.image_url else None,
+        )
+    now = timezone.now()
+    rule_schedule = _compile_rule_schedule(now)
+    rules, rules_until = _select_rules(rule_schedule, now)
+
+    categories = {
+        c.id: CompiledCategory(id=c.id, name=c.name, sort_order=c.sort_order)
+        for c in IngredientCategory.objects.all()
+    }
+    return PricingCatalog(
+        version=version,
+        rules=rules,
+        rules_until=rules_until,
+        rule_schedule=rule_schedule,
+        products=MappingProxyType(products),
+        sizes=MappingProxyType(sizes),
+        bases=MappingProxyType(bases),
+        ingredients=MappingProxyType(ingredients),
+        categories=MappingProxyType(categories),
+        allergens=MappingProxyType(allergens),
+        allergen_codes=MappingProxyType(allergen_codes),
+    )
+
+
+# --- per-process состояние ---
+_lock = threading.Lock()
+_catalog: PricingCatalog | None = None
+_checked_at = 0.0
+
+
+def _check_interval() -> float:
+    # как часто (сек) сверяться с общей версией; локальные изменения видны сразу
+    return float(getattr(settings, "PRICING_CATALOG_CHECK_INTERVAL", 1.0))
+
+
+def _shared_version() -> int:
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_CACHE_KEY, 0)
+    return version
+
+
+def get_catalog() -> PricingCatalog:
+    """Текущий каталог; пересобирается, только если сменилась версия.
+
+    Когда истекает окно действующих правил, каталог не пересобирается —
+    подменяется на копию с правилами из уже загруженного расписания.
+    """
+    global _catalog, _checked_at
+
+    now = time.monotonic()
+    cat = _catalog
+    if cat is not None and time.time() >= cat.rules_until:
+        with _lock:
+            cat = _catalog
+            if cat is not None and time.time() >= cat.rules_until:
+                cat = cat.with_rules_at(timezone.now())
+                _catalog = cat
+    if cat is not None and now - _checked_at < _check_interval():
+        return cat
+
+    version = _shared_version()
+    if cat is None or cat.version != version:
+        with _lock:
+            cat = _catalog
+            if cat is None or cat.version != version:
+                cat = compile_catalog(version)
+                _catalog = cat
+    _checked_at = now
+    return cat
+
+
+def bump_catalog_version() -> None:
+    """Инвалидирует каталог во всех процессах (через общий кэш) и в текущем."""
+    global _catalog
+    cache.set(VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+    _catalog = None
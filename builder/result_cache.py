@@ -0,0 +1,71 @@
+# builder/result_cache.py
+"""Ограниченный LRU-кэш результатов calculate_build.
+
+Ключ — каноническая сборка (product, size, base, ингредиенты с уже
+обрезанными количествами) вместе с версией каталога и правил, поэтому при смене цен
+старые записи просто перестают находиться.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+
+class BuildResultCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _sync_version(self, version) -> None:
+        # каталог сменился — все старые ключи мертвые, держать их в LRU незачем
+        if version != self._version:
+            if self._data:
+                self.invalidations += 1
+                self._data.clear()
+            self._version = version
+
+    def get(self, version, key):
+        with self._lock:
+            self._sync_version(version)
+            result = self._data.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, version, key, result) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._sync_version(version)
+            self._data[key] = result
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def info(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -1,6 +1,14 @@
-from decimal import Decimal
-from catalog.models import Ingredient, Product
-from .models import RuleSet, SizeOption, BaseOption
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.money import MINOR_PER_UNIT, div_round_half_even, format_minor
+from catalog.models import Ingredient
+from .pricing import PricingCatalog, get_catalog
+from .result_cache import BuildResultCache
 
 def _to_int(val, default=0):
     try:
@@ -8,51 +16,91 @@ def _to_int(val, default=0):
     except (TypeError, ValueError):
         return default
 
+MAX_BATCH_BUILDS = 100
+MAX_INGREDIENT_QTY = 5
+
+# Результаты расчета популярных сборок; 0 — кэш выключен
+_result_cache = BuildResultCache(getattr(settings, "BUILD_PRICE_CACHE_SIZE", 2048))
+
+
+def price_cache_info() -> dict:
+    """Счетчики LRU-кэша результатов (hits/misses/evictions) текущего процесса."""
+    return _result_cache.info()
+
+
 def calculate_build(payload: dict) -> dict:
-    """Считает цену и проверяет ограничения. Сервер — источник истины."""
-    rs = RuleSet.objects.order_by("-updated_at").first()
+    """Считает цену и проверяет ограничения. Сервер — источник истины.
+
+    Все данные берутся из скомпилированного каталога (builder.pricing),
+    поэтому расчет не делает запросов к БД. Повторные сборки отдаются из
+    LRU-кэша; вложенные структуры результата общие — не мутировать.
+    """
+    return _price_build(get_catalog(), payload)
+
+
+def calculate_builds(payloads: list) -> list:
+    """Считает пачку сборок по одному снимку каталога.
+
+    Результат по каждой сборке — того же вида, что у calculate_build.
+    """
+    cat = get_catalog()
+    results = []
+    for payload in payloads:
+        if not isinstance(payload, dict):
+            results.append({"ok": False, "error": "payload must be an object"})
+            continue
+        results.append(_price_build(cat, payload))
+    return results
+
 
+def _price_build(cat: PricingCatalog, payload: dict) -> dict:
     # --- product ---
-    product_id = payload.get("product_id")
-    product = None
-    if product_id:
-        product = Product.objects.filter(id=product_id, is_available=True).first()
+    product = cat.products.get(_to_int(payload.get("product_id"), None))
     if not product:
         return {"ok": False, "error": "product_id is invalid"}
 
     # --- options ---
-    size_id = payload.get("size_id")
-    base_id = payload.get("base_id")
     ingredient_ids = payload.get("ingredient_ids") or []
     quantities = payload.get("quantities") or {}  # {"30": 2}
 
-    size = SizeOption.objects.filter(id=size_id).first()
-    base = BaseOption.objects.filter(id=base_id, is_available=True).first()
+    size = cat.sizes.get(_to_int(payload.get("size_id"), None))
+    base = cat.bases.get(_to_int(payload.get("base_id"), None))
 
     if not size:
         return {"ok": False, "error": "size_id is required/invalid"}
     if not base:
         return {"ok": False, "error": "base_id is required/invalid"}
 
-    # --- load ingredients ---
-    ings = list(
-        Ingredient.objects
-        .prefetch_related("allergens")
-        .select_related("category")
-        .filter(id__in=ingredient_ids, is_available=True)
-    )
-    ing_map = {i.id: i for i in ings}
-
     # --- normalize quantities ---
     normalized = []
     for ing_id in ingredient_ids:
-        ing = ing_map.get(int(ing_id))
+        ing = cat.ingredients.get(_to_int(ing_id, None))
         if not ing:
             continue
         qty = _to_int(quantities.get(str(ing.id), 1), 1)
-        qty = max(1, min(qty, 5))
+        qty = max(1, min(qty, MAX_INGREDIENT_QTY))
         normalized.append((ing, qty))
 
+    # Порядок ингредиентов не сортируем: от него зависит, какие соусы
+    # попадут в бесплатные, и порядок items в snapshot.
+    key = (product.id, size.id, base.id, tuple((ing.id, qty) for ing, qty in normalized))
+    result = _result_cache.get(cat.pricing_key, key)
+    if result is None:
+        result = _evaluate_build(cat, product, size, base, normalized)
+        _result_cache.put(cat.pricing_key, key, result)
+    return dict(result)
+
+
+def _round_to_units(product_minor: int, size, rest_minor: int) -> int:
+    # product * mult + rest, округленное до целых тенге (как quantize(Decimal("1")))
+    scale = 10 ** size.mult_exp
+    total_scaled = product_minor * size.mult_num + rest_minor * scale
+    return div_round_half_even(total_scaled, MINOR_PER_UNIT * scale)
+
+
+def _evaluate_build(cat: PricingCatalog, product, size, base, normalized: list) -> dict:
+    rs = cat.rules
+
     # --- rules ---
     warnings, errors = [], []
 
@@ -67,50 +115,40 @@ def calculate_build(payload: dict) -> dict:
     if errors:
         return {"ok": False, "errors": errors, "warnings": warnings}
 
-    # --- pricing ---
-    total = Decimal("0")
-
-    # size.code ожидается "1.0" / "1.5" / "2.0"
-    try:
-        mult = Decimal(str(size.code))
-    except Exception:
-        mult = Decimal("1.0")
-
-    total += Decimal(str(product.price)) * mult
-    total += Decimal(str(base.price))
+    # --- pricing (целые тиыны) ---
+    ingredients_minor = base.price_minor
 
     free_sauces_left = rs.free_sauces
     calories = 0
-    allergens = set()
+    allergen_mask = 0
 
     items_snapshot = []
     for ing, qty in normalized:
         calories += (ing.calories or 0) * qty
 
-        for a in ing.allergens.all():
-            allergens.add(a.code)
-
-        unit = Decimal(str(ing.price))
-        added = Decimal("0")
+        allergen_mask |= ing.allergen_mask
 
         if ing.type == Ingredient.Type.SAUCE:
             free_now = min(free_sauces_left, qty)
             paid_now = qty - free_now
             free_sauces_left -= free_now
-            if paid_now > 0:
-                added = unit * Decimal(paid_now)
         else:
-            added = unit * Decimal(qty)
+            paid_now = qty
 
-        total += added
+        if paid_now > 0:
+            added_minor = ing.price_minor * paid_now
+            ingredients_minor += added_minor
+            added = format_minor(added_minor)
+        else:
+            added = "0"  # бесплатный соус — раньше это был Decimal("0")
 
         items_snapshot.append({
             "id": ing.id,
             "name": ing.name,
             "type": ing.type,
             "qty": qty,
-            "unit_price": str(unit),
-            "added_price": str(added),
+            "unit_price": str(ing.price),
+            "added_price": added,
         })
 
     if rs.free_sauces < sauce_count:
@@ -123,13 +161,97 @@ def calculate_build(payload: dict) -> dict:
         "size": {"id": size.id, "code": str(size.code), "name": size.name, "base_price": str(size.base_price)},
         "base": {"id": base.id, "name": base.name, "price": str(base.price)},
         "items": items_snapshot,
+        "rules": {"id": rs.id, "version": rs.version},
     }
 
     return {
         "ok": True,
-        "subtotal": str(total.quantize(Decimal("1"))),
+        "subtotal": str(_round_to_units(product.price_minor, size, ingredients_minor)),
         "warnings": warnings,
         "calories": calories,
-        "allergens": sorted(allergens),
+        "allergens": cat.decode_allergens(allergen_mask),
         "snapshot": snapshot,
     }
+
+
+def builder_options(cat: PricingCatalog, exclude_mask: int = 0) -> dict:
+    """Полный каталог для конструктора: размеры, основы, ингредиенты по категориям, правила.
+
+    exclude_mask — маска аллергенов: ингредиенты с любым из них не попадут в ответ.
+    """
+    rs = cat.rules
+
+    grouped = {}
+    for ing in cat.ingredients.values():
+        if ing.allergen_mask & exclude_mask:
+            continue
+        grouped.setdefault(ing.category_id, []).append({
+            "id": ing.id,
+            "name": ing.name,
+            "type": ing.type,
+            "price": str(ing.price),
+            "grams": ing.grams,
+            "calories": ing.calories,
+            "is_spicy": ing.is_spicy,
+            "allergens": list(ing.allergens),
+            "image_url": ing.image_url,
+        })
+
+    return {
+        "ok": True,
+        "version": str(cat.version),
+        "rules": {
+            "version": rs.version,
+            "free_sauces": rs.free_sauces,
+            "max_sauces_total": rs.max_sauces_total,
+            "max_meat_items": rs.max_meat_items,
+            "max_qty": MAX_INGREDIENT_QTY,
+        },
+        "sizes": [
+            {"id": s.id, "code": s.code, "name": s.name, "base_price": str(s.base_price)}
+            for s in cat.sizes.values()
+        ],
+        "bases": [
+            {"id": b.id, "name": b.name, "price": str(b.price)}
+            for b in cat.bases.values()
+        ],
+        "categories": [
+            {"id": c.id, "name": c.name, "sort_order": c.sort_order, "ingredients": grouped[c.id]}
+            for c in cat.categories.values()
+            if c.id in grouped
+        ],
+        "allergens": [
+            {"code": a.code, "name": a.name}
+            for a in cat.allergens.values()
+        ],
+        "excluded_allergens": cat.decode_allergens(exclude_mask),
+    }
+
+
+# (catalog pricing_key, {exclude_mask: (body, etag)}) — сериализуем опции один раз на версию каталога
+_options_lock = threading.Lock()
+_options_cache = (None, {})
+MAX_OPTIONS_VARIANTS = 64
+
+
+def get_builder_options(exclude_allergens=()) -> tuple:
+    """Готовое JSON-тело опций и его strong ETag для текущей версии каталога."""
+    global _options_cache
+
+    cat = get_catalog()
+    exclude_mask = cat.allergen_mask_for(exclude_allergens)
+
+    version, variants = _options_cache
+    if version == cat.pricing_key and exclude_mask in variants:
+        return variants[exclude_mask]
+
+    with _options_lock:
+        version, variants = _options_cache
+        if version != cat.pricing_key or len(variants) >= MAX_OPTIONS_VARIANTS:
+            variants = {}
+        if exclude_mask not in variants:
+            body = json.dumps(builder_options(cat, exclude_mask), cls=DjangoJSONEncoder).encode("utf-8")
+            etag = '"%s"' % hashlib.sha256(body).hexdigest()
+            variants = {**variants, exclude_mask: (body, etag)}
+            _options_cache = (cat.pricing_key, variants)
+    return variants[exclude_mask]
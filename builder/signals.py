@@ -0,0 +1,22 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from catalog.models import Allergen, Ingredient, IngredientCategory, Product, ProductCategory
+from .models import RuleSet, SizeOption, BaseOption
+from .pricing import bump_catalog_version
+
+# Любое изменение этих моделей меняет каталог цен.
+# NB: QuerySet.update() сигналов не шлет — после массовых апдейтов вызывай bump_catalog_version() сам.
+CATALOG_MODELS = (RuleSet, SizeOption, BaseOption, Ingredient, Allergen, IngredientCategory, Product, ProductCategory)
+
+
+def invalidate_pricing_catalog(sender, **kwargs):
+    # бампаем после коммита, чтобы другие воркеры не собрали каталог из незакоммиченных данных
+    transaction.on_commit(bump_catalog_version)
+
+
+for _model in CATALOG_MODELS:
+    post_save.connect(invalidate_pricing_catalog, sender=_model, dispatch_uid=f"pricing_save_{_model.__name__}")
+    post_delete.connect(invalidate_pricing_catalog, sender=_model, dispatch_uid=f"pricing_delete_{_model.__name__}")
+
+m2m_changed.connect(invalidate_pricing_catalog, sender=Ingredient.allergens.through, dispatch_uid="pricing_allergens_m2m")
@@ -0,0 +1,235 @@
+import io
+import random
+import threading
+import time
+from decimal import Decimal
+from itertools import product as cartesian
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from builder import optimizer
+from builder.models import BaseOption, RuleSet, SizeOption
+from builder.optimizer import suggest_builds
+from builder.pricing import bump_catalog_version
+from catalog.models import Allergen, Ingredient, IngredientCategory, Product, ProductCategory
+from orders.models import OrderItem
+
+TYPES = (Ingredient.Type.MEAT, Ingredient.Type.VEG, Ingredient.Type.SAUCE, Ingredient.Type.EXTRA)
+PRODUCT_PRICE = 1000
+
+
+def make_catalog(n_ingredients: int, seed: int) -> dict:
+    """Каталог как у bench_pricing: размер 1.0 и основа за 0, так что бюджет на
+    ингредиенты — ровно max_price - PRODUCT_PRICE. Возвращает ids для payload."""
+    rng = random.Random(seed)
+    RuleSet.objects.create(name="Test", free_sauces=2, max_sauces_total=4, max_meat_items=2)
+    size = SizeOption.objects.create(code="1.0", name="Small", base_price=990)
+    base = BaseOption.objects.create(name="Лаваш", price=0)
+    categories = IngredientCategory.objects.bulk_create([
+        IngredientCategory(name=f"Категория {t.label}", sort_order=10 * (i + 1)) for i, t in enumerate(TYPES)
+    ])
+    Ingredient.objects.bulk_create([
+        Ingredient(
+            name=f"Ингредиент {i}",
+            category=categories[i % len(TYPES)],
+            type=TYPES[i % len(TYPES)],
+            price=f"{rng.randrange(0, 500)}.{rng.choice(['00', '50', '90'])}",
+            grams=rng.randrange(10, 150),
+            calories=rng.randrange(0, 400),
+        )
+        for i in range(n_ingredients)
+    ])
+    product = Product.objects.create(
+        name="Шаурма", category=ProductCategory.objects.create(name="Test"), price=PRODUCT_PRICE,
+    )
+    bump_catalog_version()  # bulk_create сигналов не шлет
+    return {"product_id": product.id, "size_id": size.id, "base_id": base.id}
+
+
+def popularity(ingredient_ids) -> dict:
+    return {ing_id: 1 + ing_id * 7 % 10 for ing_id in ingredient_ids}
+
+
+def minor(value) -> int:
+    return int(Decimal(value) * 100)
+
+
+class SuggestExactTests(TestCase):
+    """suggest_builds находит ровно те (очки, стоимость) top-K, что и полный перебор."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = make_catalog(9, seed=7)
+        cls.addClassCleanup(bump_catalog_version)  # после отката собранный каталог устарел
+        cls.ingredients = list(Ingredient.objects.order_by("id"))
+        cls.weights = popularity(i.id for i in cls.ingredients)
+
+    def _brute_force(self, payload: dict) -> list:
+        rules = RuleSet.objects.get()
+        budget = (payload["max_price"] - PRODUCT_PRICE) * 100
+        max_calories, max_items = payload.get("max_calories"), payload.get("max_items")
+        ranked = []
+        for qtys in cartesian(range(payload["max_qty"] + 1), repeat=len(self.ingredients)):
+            chosen = [(ing, qty) for ing, qty in zip(self.ingredients, qtys) if qty]
+            if not chosen or max_items is not None and len(chosen) > max_items:
+                continue
+            sauces = sorted((minor(ing.price) for ing, qty in chosen if ing.type == Ingredient.Type.SAUCE
+                             for _ in range(qty)), reverse=True)
+            meat = sum(qty for ing, qty in chosen if ing.type == Ingredient.Type.MEAT)
+            if len(sauces) > rules.max_sauces_total or meat > rules.max_meat_items:
+                continue
+            # бесплатная квота — самым дорогим соусам
+            cost = sum(sauces[rules.free_sauces:]) + sum(
+                minor(ing.price) * qty for ing, qty in chosen if ing.type != Ingredient.Type.SAUCE
+            )
+            calories = sum(ing.calories * qty for ing, qty in chosen)
+            if cost > budget or max_calories is not None and calories > max_calories:
+                continue
+            if payload["objective"] == "portions":
+                value = sum(qty for _, qty in chosen)
+            elif payload["objective"] == "popularity":
+                value = sum(self.weights[ing.id] for ing, _ in chosen)
+            else:
+                value = len(chosen)
+            ranked.append((-value, cost, calories))
+        ranked.sort()
+        return [(-value, cost) for value, cost, _ in ranked[:payload["top_k"]]]
+
+    def test_matches_brute_force(self):
+        cases = [
+            {"max_price": 1600},
+            {"max_price": 1600, "max_calories": 900},
+            {"max_price": 2500, "max_calories": 700, "max_items": 3},
+            {"max_price": 1300, "top_k": 5},
+            {"max_price": 3000, "max_items": 4},
+        ]
+        with patch("builder.optimizer._popularity_weights", return_value=self.weights):
+            for case, objective, max_qty in cartesian(cases, ("count", "portions", "popularity"), (1, 2)):
+                payload = {**self.ids, "top_k": 3, "objective": objective, "max_qty": max_qty, **case}
+                with self.subTest(payload=payload):
+                    result = suggest_builds(payload)
+                    self.assertTrue(result["ok"], result)
+                    got = [
+                        (b["score"], sum(minor(i["added_price"]) for i in b["snapshot"]["items"]))
+                        for b in result["builds"]
+                    ]
+                    self.assertEqual(got, self._brute_force(payload))
+                    for build in result["builds"]:
+                        self.assertTrue(build["ok"])
+                        self.assertLessEqual(Decimal(build["subtotal"]), payload["max_price"])
+                        if "max_calories" in payload:
+                            self.assertLessEqual(build["calories"], payload["max_calories"])
+
+
+class SuggestScaleTests(TestCase):
+    """Без max_items сборка не ограничена по числу позиций, и на 300 ингредиентах
+    подбор все равно укладывается в доли секунды: прежний перебор без предела
+    позиций считал такие запросы десятки секунд."""
+
+    TIME_LIMIT = 1.5  # сек на запрос; на момент написания — до 0.35
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = make_catalog(300, seed=1)
+        cls.addClassCleanup(bump_catalog_version)
+        cls.weights = popularity(Ingredient.objects.values_list("id", flat=True))
+
+    def test_large_catalog_without_item_cap(self):
+        cases = [
+            {"max_price": 9000},
+            {"max_price": 9000, "max_calories": 1500},
+            {"max_price": 4000, "max_qty": 2, "max_calories": 3000},
+        ]
+        with patch("builder.optimizer._popularity_weights", return_value=self.weights):
+            for case, objective in cartesian(cases, ("count", "portions", "popularity")):
+                payload = {**self.ids, "objective": objective, **case}
+                with self.subTest(payload=payload):
+                    started = time.perf_counter()
+                    result = suggest_builds(payload)
+                    elapsed = time.perf_counter() - started
+                    self.assertTrue(result["ok"], result)
+                    self.assertEqual(len(result["builds"]), 3)
+                    self.assertLess(elapsed, self.TIME_LIMIT)
+
+    def test_build_size_is_not_capped(self):
+        result = suggest_builds({**self.ids, "max_price": 9000})
+        # прежний предел был 10 (не больше 20) разных ингредиентов
+        self.assertGreater(len(result["builds"][0]["payload"]["ingredient_ids"]), 20)
+
+
+class PopularityCacheTests(TestCase):
+    """Потоки, дождавшиеся блокировки, берут уже пересчитанные веса, а не считают заново."""
+
+    def test_recomputed_once_under_contention(self):
+        queries = []
+
+        def order_by(*args):
+            queries.append(args)
+            return OrderItem.objects.none()
+
+        results = []
+        with patch.object(optimizer, "_popularity", (0.0, {})), \
+                patch.object(OrderItem.objects, "order_by", side_effect=order_by):
+            with optimizer._popularity_lock:
+                # все потоки прошли проверку TTL снаружи и ждут блокировку
+                threads = [threading.Thread(target=lambda: results.append(optimizer._popularity_weights()))
+                           for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                time.sleep(0.1)
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(results, [{}] * 4)
+
+
+class AllergenExcludeTests(TestCase):
+    """Коды аллергенов из админки бывают в любом регистре — исключаются все равно."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("seed_demo", stdout=io.StringIO())
+        cls.nuts_ing, cls.sesame_ing = Ingredient.objects.order_by("id")[:2]
+        cls.nuts_ing.allergens.add(Allergen.objects.create(code="nuts", name="Орехи"))
+        cls.sesame_ing.allergens.add(Allergen.objects.create(code="Sesame", name="Кунжут"))
+        bump_catalog_version()  # в тесте on_commit из сигналов не срабатывает
+        cls.addClassCleanup(bump_catalog_version)
+
+    def _options(self, exclude: str) -> dict:
+        response = self.client.get(reverse("api_builder_options"), {"exclude_allergens": exclude})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_options_exclude_any_case(self):
+        for exclude in ("nuts,Sesame", "NUTS,sesame", " Nuts , SESAME "):
+            with self.subTest(exclude=exclude):
+                data = self._options(exclude)
+                ids = {i["id"] for c in data["categories"] for i in c["ingredients"]}
+                self.assertNotIn(self.nuts_ing.id, ids)
+                self.assertNotIn(self.sesame_ing.id, ids)
+                self.assertEqual(data["excluded_allergens"], ["Sesame", "nuts"])
+
+    def test_suggest_never_uses_excluded_allergen(self):
+        # орехи — в самом дешевом и легком, без исключения он точно попадет в сборку
+        cheapest = Ingredient.objects.exclude(type=Ingredient.Type.SAUCE).order_by("price", "calories").first()
+        cheapest.allergens.add(Allergen.objects.get(code="nuts"))
+        bump_catalog_version()
+        ids = {
+            "product_id": Product.objects.order_by("id").first().id,
+            "size_id": SizeOption.objects.order_by("id").first().id,
+            "base_id": BaseOption.objects.order_by("id").first().id,
+        }
+        plain = suggest_builds({**ids, "max_price": 5000})
+        self.assertIn("nuts", plain["builds"][0]["allergens"])
+
+        for exclude in (["NUTS", "sesame"], "Nuts,Sesame"):
+            with self.subTest(exclude=exclude):
+                result = suggest_builds({**ids, "max_price": 5000, "top_k": 5, "exclude_allergens": exclude})
+                self.assertTrue(result["builds"])
+                for build in result["builds"]:
+                    self.assertFalse({"nuts", "Sesame"} & set(build["allergens"]))
+                    used = set(build["payload"]["ingredient_ids"])
+                    self.assertFalse({cheapest.id, self.nuts_ing.id, self.sesame_ing.id} & used)
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Cart, CartItem
+from .services import recalc_cart_totals
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
@@ -8,6 +9,12 @@ class CartItemInline(admin.TabularInline):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ("id", "session_key", "user", "updated_at")
+    list_display = ("id", "session_key", "user", "item_count", "subtotal", "updated_at")
     search_fields = ("session_key", "user__username", "user__email")
+    readonly_fields = ("subtotal", "item_count", "version")
     inlines = [CartItemInline]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # строки правились в обход cart.services — итоги пересчитываем целиком
+        recalc_cart_totals(form.instance)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class CartConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "cart"
+
+    def ready(self):
+        from . import signals  # noqa
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from cart.models import Cart
+from cart.services import compute_cart_totals, recalc_cart_totals
+
+
+class Command(BaseCommand):
+    help = "Compare denormalized Cart.subtotal / item_count with the sum of cart lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="пересчитать расходящиеся корзины")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options["chunk_size"])
+        checked = mismatched = 0
+        last_id = 0
+
+        while True:
+            carts = list(
+                Cart.objects.filter(id__gt=last_id).order_by("id").only("id", "subtotal", "item_count")[:chunk_size]
+            )
+            if not carts:
+                break
+            last_id = carts[-1].id
+            expected = compute_cart_totals([c.id for c in carts])
+
+            for cart in carts:
+                checked += 1
+                subtotal, item_count = expected.get(cart.id, (0, 0))
+                if cart.subtotal == subtotal and cart.item_count == item_count:
+                    continue
+                mismatched += 1
+                self.stdout.write(
+                    f"cart {cart.id}: stored {cart.subtotal} / {cart.item_count}, lines {subtotal} / {item_count}"
+                )
+                if options["fix"]:
+                    recalc_cart_totals(cart)
+
+        style = self.style.SUCCESS if not mismatched else self.style.WARNING
+        action = "fixed" if options["fix"] else "found"
+        self.stdout.write(style(f"Checked {checked} carts, {action} {mismatched} mismatches."))
+        if mismatched and not options["fix"]:
+            # ненулевой код — удобно для cron/CI
+            raise SystemExit(1)
@@ -0,0 +1,121 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+
+DB_SESSION_ENGINES = ("django.contrib.sessions.backends.db", "django.contrib.sessions.backends.cached_db")
+
+
+class Command(BaseCommand):
+    help = "Delete carts untouched for N days (and expired sessions) in short chunked transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30, help="сколько дней корзину не меняли")
+        parser.add_argument("--chunk-size", type=int, default=500, help="корзин / сессий на транзакцию")
+        parser.add_argument("--sleep", type=float, default=0.0, help="пауза между пачками, сек")
+        parser.add_argument("--dry-run", action="store_true", help="только посчитать, ничего не удалять")
+        parser.add_argument("--sessions", action="store_true", help="еще удалить истекшие django_session")
+
+    def handle(self, *args, **options):
+        if options["days"] < 1:
+            raise CommandError("--days must be >= 1")
+        self.chunk_size = max(1, options["chunk_size"])
+        self.pause = max(0.0, options["sleep"])
+        self.dry_run = options["dry_run"]
+
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        verb = "Would delete" if self.dry_run else "Deleted"
+        self.stdout.write(f"Carts untouched since {cutoff:%Y-%m-%d %H:%M}{' (dry run)' if self.dry_run else ''}")
+
+        carts, items, elapsed = self._purge_carts(cutoff)
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {carts} carts, {items} lines in {elapsed:.2f}s ({_rate(carts + items, elapsed)} rows/s)."
+        ))
+
+        if options["sessions"]:
+            if settings.SESSION_ENGINE not in DB_SESSION_ENGINES:
+                self.stdout.write(f"SESSION_ENGINE={settings.SESSION_ENGINE} keeps no rows in django_session, skipped.")
+                return
+            sessions, elapsed = self._purge_sessions(timezone.now())
+            self.stdout.write(self.style.SUCCESS(
+                f"{verb} {sessions} expired sessions in {elapsed:.2f}s ({_rate(sessions, elapsed)} rows/s)."
+            ))
+
+    def _report(self, kind: str, chunk: int, rows: str, total_rows: int, started: float) -> None:
+        took = time.perf_counter() - started
+        self.stdout.write(f"  {kind} chunk {chunk}: {rows} in {took * 1000:.1f} ms ({_rate(total_rows, took)} rows/s)")
+
+    def _purge_carts(self, cutoff) -> tuple:
+        # идем по id вперед (keyset): каждая пачка — одна короткая транзакция,
+        # блокировка записи не держится дольше, чем нужно на chunk_size корзин
+        total_carts = total_items = chunk = 0
+        last_id = 0
+        run_started = time.perf_counter()
+        stale = Cart.objects.filter(updated_at__lt=cutoff)
+
+        while True:
+            ids = list(stale.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:self.chunk_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            chunk += 1
+            started = time.perf_counter()
+
+            if self.dry_run:
+                carts = len(ids)
+                items = CartItem.objects.filter(cart_id__in=ids).count()
+            else:
+                with transaction.atomic():
+                    # корзину могли изменить между выборкой и удалением — проверяем еще раз
+                    ids = list(stale.select_for_update().filter(id__in=ids).values_list("id", flat=True))
+                    # строки отдельным DELETE, чтобы каскад у Cart.delete() был пустым
+                    items, _ = CartItem.objects.filter(cart_id__in=ids).delete()
+                    carts, _ = Cart.objects.filter(id__in=ids).delete()
+
+            total_carts += carts
+            total_items += items
+            self._report("carts", chunk, f"{carts} carts, {items} lines", carts + items, started)
+            if self.pause:
+                time.sleep(self.pause)
+
+        return total_carts, total_items, time.perf_counter() - run_started
+
+    def _purge_sessions(self, now) -> tuple:
+        total = chunk = 0
+        last_key = ""
+        run_started = time.perf_counter()
+        expired = Session.objects.filter(expire_date__lt=now)
+
+        while True:
+            keys = list(
+                expired.filter(session_key__gt=last_key)
+                .order_by("session_key").values_list("session_key", flat=True)[:self.chunk_size]
+            )
+            if not keys:
+                break
+            last_key = keys[-1]
+            chunk += 1
+            started = time.perf_counter()
+
+            if self.dry_run:
+                deleted = len(keys)
+            else:
+                with transaction.atomic():
+                    deleted, _ = expired.filter(session_key__in=keys).delete()
+
+            total += deleted
+            self._report("sessions", chunk, f"{deleted} sessions", deleted, started)
+            if self.pause:
+                time.sleep(self.pause)
+
+        return total, time.perf_counter() - run_started
+
+
+def _rate(rows: int, seconds: float) -> str:
+    return f"{rows / seconds:.0f}" if seconds > 0 else "-"
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:50
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_totals(apps, schema_editor):
+    Cart = apps.get_model("cart", "Cart")
+    CartItem = apps.get_model("cart", "CartItem")
+    rows = CartItem.objects.values("cart_id").annotate(subtotal=Sum("total_price"), item_count=Sum("quantity"))
+    for row in rows:
+        Cart.objects.filter(id=row["cart_id"]).update(subtotal=row["subtotal"], item_count=row["item_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:52
+
+import hashlib
+import json
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def line_content_hash(item_type, snapshot, unit_price):
+    # замороженная копия cart.models.line_content_hash на момент миграции:
+    # рантайм-функция может поменяться, а миграция должна считать так же всегда
+    snapshot = snapshot or {}
+    if item_type == "BUILDER":
+        key = [
+            (snapshot.get("product") or {}).get("id"),
+            (snapshot.get("size") or {}).get("id"),
+            (snapshot.get("base") or {}).get("id"),
+            [[i.get("id"), i.get("qty")] for i in snapshot.get("items") or ()],
+        ]
+    else:
+        key = snapshot.get("product_id")
+    price = unit_price if isinstance(unit_price, Decimal) else Decimal(str(unit_price))
+    canonical = json.dumps([item_type, key, int(price * 100)], separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def fill_content_hash(apps, schema_editor):
+    # старые дубликаты не сливаем — просто начнут находиться при следующем добавлении
+    CartItem = apps.get_model("cart", "CartItem")
+    items = list(CartItem.objects.only("id", "item_type", "snapshot_json", "unit_price"))
+    for item in items:
+        item.content_hash = line_content_hash(item.item_type, item.snapshot_json, item.unit_price)
+    CartItem.objects.bulk_update(items, ["content_hash"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_cart_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['cart', 'content_hash'], name='cartitem_cart_hash_idx'),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
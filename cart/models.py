@@ -1,12 +1,25 @@
+import hashlib
+import json
+
 from django.db import models
 from django.conf import settings
 
+from core.money import to_minor
+
 class Cart(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="carts")
     session_key = models.CharField(max_length=64, db_index=True)
+    # денормализованные итоги; меняются только через cart.services в одной транзакции со строками
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)  # сумма quantity по строкам
+    version = models.PositiveIntegerField(default=0)     # растет на каждое изменение корзины
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # purge_stale_carts ищет брошенные корзины по updated_at
+        indexes = [models.Index(fields=["updated_at"], name="cart_updated_at_idx")]
+
     def __str__(self):
         return f"Cart {self.id}"
 
@@ -22,10 +35,42 @@ class CartItem(models.Model):
     snapshot_json = models.JSONField(default=dict, blank=True)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # одинаковые позиции (тот же товар/сборка по той же цене) складываются в одну строку
+    content_hash = models.CharField(max_length=64, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [models.Index(fields=["cart", "content_hash"], name="cartitem_cart_hash_idx")]
+
+    MAX_QTY = 20
 
     def recalc(self):
         self.total_price = self.unit_price * self.quantity
+
+    def add_quantity(self, qty: int) -> tuple:
+        """Добавляет qty с потолком MAX_QTY; (сдвиг суммы, сдвиг количества)."""
+        old_qty, old_total = self.quantity, self.total_price
+        self.quantity = min(old_qty + qty, self.MAX_QTY)
+        self.recalc()
+        return self.total_price - old_total, self.quantity - old_qty
+
+
+def line_content_hash(item_type: str, snapshot: dict, unit_price) -> str:
+    """Хэш канонического содержимого строки: тип, товар или нормализованная сборка, цена.
+
+    Количество в хэш не входит. Порядок ингредиентов входит: от него зависит,
+    какие соусы бесплатные.
+    """
+    snapshot = snapshot or {}
+    if item_type == CartItem.ItemType.BUILDER:
+        key = [
+            (snapshot.get("product") or {}).get("id"),
+            (snapshot.get("size") or {}).get("id"),
+            (snapshot.get("base") or {}).get("id"),
+            [[i.get("id"), i.get("qty")] for i in snapshot.get("items") or ()],
+        ]
+    else:
+        key = snapshot.get("product_id")
+    canonical = json.dumps([item_type, key, to_minor(unit_price)], separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
@@ -1,93 +1,234 @@
 # cart/services.py
 from __future__ import annotations
 
+import hashlib
+import threading
 from decimal import Decimal
+from django.conf import settings
 from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from cart.models import Cart, CartItem
+from cart.models import Cart, CartItem, line_content_hash
+from cart.stores import CART_TOTAL_FIELDS, CacheCartStore, DatabaseCartStore, SessionCart
 from catalog.models import Product
 from builder.services import calculate_build
 
+# Где живут корзины анонимов: "db" (по умолчанию) или "cache". Корзины
+# вошедших пользователей всегда в БД.
+_db_store = DatabaseCartStore()
+_cache_store = CacheCartStore(getattr(settings, "CART_CACHE_TIMEOUT", 7 * 24 * 3600))
 
 
-def get_or_create_cart(request) -> Cart:
-    # гарантируем наличие session_key
-    if not request.session.session_key:
-        request.session.save()
+def _anonymous_store():
+    return _cache_store if getattr(settings, "CART_STORE", "db") == "cache" else _db_store
 
-    session_key = request.session.session_key
-    user = request.user if getattr(request, "user", None) and request.user.is_authenticated else None
 
-    cart, _ = Cart.objects.get_or_create(
-        session_key=session_key,
-        defaults={"user": user},
-    )
+def _store_for(cart):
+    return _cache_store if isinstance(cart, SessionCart) else _db_store
+
+
+def _request_user(request):
+    user = getattr(request, "user", None)
+    return user if user is not None and user.is_authenticated else None
+
+
+# ответ для посетителя без корзины: ни сессии, ни строки Cart не создаем
+EMPTY_CART = {"ok": True, "cart_id": None, "subtotal": "0", "item_count": 0, "version": 0}
+
+_lazy_lock = threading.Lock()
+_lazy_stats = {"cartless_requests": 0, "avoided_writes": 0}
+
+
+def lazy_cart_info() -> dict:
+    """Сколько запросов без корзины обслужено без записи в БД (текущий процесс)."""
+    with _lazy_lock:
+        return dict(_lazy_stats)
+
+
+def _count_cartless(request) -> None:
+    # раньше такой запрос сохранял сессию (если ее не было) и вставлял Cart
+    avoided = 1 if request.session.session_key else 2
+    with _lazy_lock:
+        _lazy_stats["cartless_requests"] += 1
+        _lazy_stats["avoided_writes"] += avoided
 
-    # если юзер залогинился позже — привяжем
-    if user and cart.user_id is None:
-        cart.user = user
-        cart.save(update_fields=["user"])
 
+def get_cart(request) -> Cart | SessionCart | None:
+    """Корзина посетителя, если она уже есть. Ничего не пишет — для чтений."""
+    cart = None
+    if request.session.session_key:
+        if _anonymous_store() is _cache_store:
+            cart = _cache_store.load(request)
+        if cart is None:
+            cart = _db_store.load(request)
+    if cart is None:
+        _count_cartless(request)
     return cart
 
 
-def cart_to_dict(cart: Cart) -> dict:
-    items_qs = cart.items.order_by("id")
+def empty_cart_dict(with_items: bool = True) -> dict:
+    return {**EMPTY_CART, "items": []} if with_items else dict(EMPTY_CART)
+
+
+def get_or_create_cart(request) -> Cart | SessionCart:
+    """Корзина для изменения: при первом изменении создает сессию и корзину."""
+    user = _request_user(request)
+    if _anonymous_store() is _cache_store:
+        cart = _cache_store.load(request)
+        if cart is not None:
+            # аноним вошел, а корзина еще в кэше — переносим
+            return persist_session_cart(request, cart) if user else cart
+        if user is None:
+            return _db_store.load(request) or _cache_store.create(request)
+    return _db_store.create(request)
+
+
+@transaction.atomic
+def persist_session_cart(request, cart: SessionCart) -> Cart:
+    """Переносит корзину из кэша в БД (оформление заказа, вход) и возвращает Cart."""
+    db_cart = _db_store.create(request)
+    lines = [
+        CartItem(
+            item_type=it.item_type,
+            quantity=it.quantity,
+            title=it.title,
+            snapshot_json=it.snapshot_json,
+            unit_price=it.unit_price,
+            total_price=it.total_price,
+            content_hash=it.content_hash,
+        )
+        for it in cart.lines
+    ]
+    if db_cart.item_count == 0:
+        _db_store.commit(db_cart, lines, [], [], cart.subtotal, cart.item_count)
+    else:
+        # в БД уже была корзина этой сессии — сливаем построчно, с дедупликацией
+        for line in lines:
+            _db_store.add_line(db_cart, line)
+    _cache_store.clear(cart, request)
+    return db_cart
+
+
+def ensure_db_cart(request, cart):
+    """Для оформления заказа нужна корзина в БД."""
+    if isinstance(cart, SessionCart):
+        return persist_session_cart(request, cart)
+    return cart
+
+
+def compute_cart_totals(cart_ids=None):
+    """{cart_id: (subtotal, item_count)} по строкам корзины — эталон для сверки."""
+    qs = CartItem.objects.all()
+    if cart_ids is not None:
+        qs = qs.filter(cart_id__in=cart_ids)
+    return {
+        row["cart_id"]: (row["subtotal"], row["item_count"])
+        for row in qs.values("cart_id").annotate(subtotal=Sum("total_price"), item_count=Sum("quantity"))
+    }
+
+
+@transaction.atomic
+def recalc_cart_totals(cart: Cart) -> None:
+    """Пересчитывает итоги корзины по строкам (после правок в обход сервисов, например в админке)."""
+    totals = CartItem.objects.filter(cart=cart).aggregate(
+        subtotal=Coalesce(Sum("total_price"), Decimal("0")),
+        item_count=Coalesce(Sum("quantity"), 0),
+    )
+    Cart.objects.filter(pk=cart.pk).update(version=F("version") + 1, updated_at=timezone.now(), **totals)
+    cart.refresh_from_db(fields=CART_TOTAL_FIELDS)
+
+
+def cart_summary(cart: Cart | SessionCart) -> dict:
+    """Итоги корзины без чтения строк (бейдж в шапке и т.п.)."""
+    return {
+        "ok": True,
+        "cart_id": cart.id,
+        "subtotal": str(cart.subtotal),
+        "item_count": cart.item_count,
+        "version": cart.version,
+    }
+
+
+def cart_etag(cart: Cart | SessionCart | None, fields: str) -> str:
+    """Strong ETag ответа о корзине: корзина + ее version + вид ответа. Строк не читает.
+
+    version растет на каждое изменение строк и итогов; created_at отличает
+    корзину, пересозданную с тем же id после удаления старой.
+    """
+    if cart is None:
+        owner = "none"
+    elif isinstance(cart, SessionCart):
+        owner = "s" + hashlib.sha256(cart.token.encode()).hexdigest()[:16]
+    else:
+        owner = f"{cart.id}.{int(cart.created_at.timestamp() * 1_000_000)}"
+    version = cart.version if cart is not None else 0
+    return f'"cart-{owner}-{version}-{fields}"'
+
+
+def cart_to_dict(cart: Cart | SessionCart, with_snapshots: bool = True) -> dict:
+    """Корзина со строками; with_snapshots=False — без snapshot (они не читаются из БД)."""
+    items_qs = _store_for(cart).lines(cart, with_snapshots=with_snapshots)
     items = []
-    subtotal = Decimal("0")
 
     for it in items_qs:
-        subtotal += Decimal(str(it.total_price))
-        items.append(
-            {
-                "id": it.id,
-                "item_type": it.item_type,
-                "title": it.title,
-                "quantity": it.quantity,
-                "unit_price": str(it.unit_price),
-                "total_price": str(it.total_price),
-                "snapshot": it.snapshot_json or {},
-            }
-        )
+        item = {
+            "id": it.id,
+            "item_type": it.item_type,
+            "title": it.title,
+            "quantity": it.quantity,
+            "unit_price": str(it.unit_price),
+            "total_price": str(it.total_price),
+        }
+        if with_snapshots:
+            item["snapshot"] = it.snapshot_json or {}
+        items.append(item)
 
     return {
         "ok": True,
         "cart_id": cart.id,
-        "subtotal": str(subtotal),
+        "subtotal": str(cart.subtotal),
+        "item_count": cart.item_count,
+        "version": cart.version,
         "items": items,
     }
 
 
-@transaction.atomic
-def add_product_item(cart: Cart, product_id: int, quantity: int = 1) -> dict:
-    product = Product.objects.filter(id=product_id, is_available=True).first()
-    if not product:
-        return {"ok": False, "error": "Product not found/available"}
+MAX_LINE_QTY = CartItem.MAX_QTY
+MAX_ID = 2 ** 63 - 1  # больше не влезет в BIGINT — такой записи нет, а SQLite на нем падает
+MAX_BATCH_OPS = 50
+
+
+def _clamp_qty(quantity) -> int:
+    return max(1, min(int(quantity), MAX_LINE_QTY))
 
-    qty = max(1, min(int(quantity), 20))
-    unit_price = Decimal(str(product.price))
 
-    CartItem.objects.create(
-        cart=cart,
-        item_type=CartItem.ItemType.PRODUCT,
+def _new_line(item_type: str, qty: int, title: str, snapshot: dict, unit_price: Decimal) -> CartItem:
+    return CartItem(
+        item_type=item_type,
         quantity=qty,
-        title=product.name,
-        snapshot_json={
-            "product_id": product.id,
-            "category": product.category.name if product.category else None,
-        },
+        title=title,
+        snapshot_json=snapshot,
         unit_price=unit_price,
         total_price=unit_price * qty,
+        content_hash=line_content_hash(item_type, snapshot, unit_price),
     )
-    return cart_to_dict(cart)
 
 
+def _product_line(product: Product, qty: int) -> CartItem:
+    snapshot = {
+        "product_id": product.id,
+        "category": product.category.name if product.category else None,
+    }
+    return _new_line(CartItem.ItemType.PRODUCT, qty, product.name, snapshot, product.price)
 
-@transaction.atomic
-def add_builder_item(cart: CartItem, payload: dict, quantity: int = 1) -> dict:
+
+def _builder_line(payload: dict, qty: int) -> tuple:
+    """(несохраненная строка, None) или (None, ошибка)."""
     calc = calculate_build(payload)
     if not calc.get("ok"):
-        return {"ok": False, "error": "Invalid build", "details": calc}
+        return None, {"ok": False, "error": "Invalid build", "details": calc}
 
     unit_price = Decimal(calc["subtotal"])
 
@@ -107,17 +248,27 @@ def add_builder_item(cart: CartItem, payload: dict, quantity: int = 1) -> dict:
 
     title = f"{pname} ({snap['size']['code']}, {snap['base']['name']})"
 
-    qty = max(1, min(int(quantity), 20))
+    return _new_line(CartItem.ItemType.BUILDER, qty, title, snap, unit_price), None
 
-    CartItem.objects.create(
-        cart=cart,
-        item_type=CartItem.ItemType.BUILDER,
-        quantity=qty,
-        title=title,
-        snapshot_json=snap,
-        unit_price=unit_price,
-        total_price=unit_price * qty,
-    )
+
+@transaction.atomic
+def add_product_item(cart: Cart, product_id: int, quantity: int = 1) -> dict:
+    product = Product.objects.filter(id=product_id, is_available=True).first()
+    if not product:
+        return {"ok": False, "error": "Product not found/available"}
+
+    _store_for(cart).add_line(cart, _product_line(product, _clamp_qty(quantity)))
+    return cart_to_dict(cart)
+
+
+
+@transaction.atomic
+def add_builder_item(cart: CartItem, payload: dict, quantity: int = 1) -> dict:
+    line, error = _builder_line(payload, _clamp_qty(quantity))
+    if error:
+        return error
+
+    _store_for(cart).add_line(cart, line)
 
     return cart_to_dict(cart)
 
@@ -125,25 +276,145 @@ def add_builder_item(cart: CartItem, payload: dict, quantity: int = 1) -> dict:
 
 @transaction.atomic
 def update_item_qty(cart: Cart, item_id: int, quantity: int) -> dict:
-    it = cart.items.filter(id=item_id).first()
-    if not it:
+    if not _store_for(cart).set_quantity(cart, item_id, _clamp_qty(quantity)):
         return {"ok": False, "error": "Item not found"}
-
-    qty = max(1, min(int(quantity), 20))
-    it.quantity = qty
-    it.recalc()
-    it.save(update_fields=["quantity", "total_price"])
     return cart_to_dict(cart)
 
 
 @transaction.atomic
 def remove_item(cart: Cart, item_id: int) -> dict:
-    it = cart.items.filter(id=item_id).first()
-    if not it:
+    if not _store_for(cart).remove(cart, item_id):
         return {"ok": False, "error": "Item not found"}
-
-    it.delete()
     return cart_to_dict(cart)
 
 def clear_cart(cart):
-    cart.items.all().delete()
+    _store_for(cart).clear(cart)
+
+
+def _to_id(value):
+    # id строки или товара из JSON: список, объект, мусор или вне диапазона — None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if 0 < value <= MAX_ID else None
+
+
+def _batch_qty(op: dict):
+    try:
+        return _clamp_qty(op.get("quantity", 1))
+    except (TypeError, ValueError):
+        return None
+
+
+@transaction.atomic
+def apply_cart_batch(cart: Cart, ops: list) -> dict:
+    """Применяет по порядку операции add/update/remove одной транзакцией.
+
+    Строки корзины читаются один раз, изменения пишутся bulk_create /
+    bulk_update / одним DELETE, итоги корзины сдвигаются один раз.
+    Одинаковые добавления сливаются в одну строку, как и в add_*_item.
+    Ошибочная операция не отменяет остальные — ее ошибка будет в results.
+    """
+    store = _store_for(cart)
+    lines = {it.id: it for it in store.lines(cart, for_update=True)}
+    # hash → строка, в которую сливаются одинаковые добавления (в т.ч. созданные в этой же пачке)
+    by_hash = {}
+    for it in lines.values():
+        if it.content_hash:
+            by_hash.setdefault(it.content_hash, it)
+    # product_id приводим к int по каждой операции: кривой id — ошибка этой операции, а не всей пачки
+    product_ids = {
+        _to_id(op.get("product_id")) for op in ops
+        if isinstance(op, dict) and op.get("op") == "add" and op.get("item_type") == "PRODUCT"
+    } - {None}
+    products = {
+        p.id: p for p in Product.objects.filter(id__in=product_ids, is_available=True).select_related("category")
+    } if product_ids else {}
+
+    results, created, pending, dirty, removed = [], [], [], {}, []
+    subtotal_delta, count_delta = Decimal("0"), 0
+
+    for op in ops:
+        if not isinstance(op, dict):
+            results.append({"ok": False, "error": "operation must be an object"})
+            continue
+        kind = op.get("op")
+
+        if kind == "add":
+            qty = _batch_qty(op)
+            if qty is None:
+                results.append({"ok": False, "error": "quantity must be an integer"})
+                continue
+            item_type = op.get("item_type")
+            if item_type == "PRODUCT":
+                product_id = _to_id(op.get("product_id"))
+                if product_id is None:
+                    results.append({"ok": False, "error": "product_id must be a positive integer"})
+                    continue
+                product = products.get(product_id)
+                if not product:
+                    results.append({"ok": False, "error": "Product not found/available"})
+                    continue
+                line = _product_line(product, qty)
+            elif item_type == "BUILDER":
+                line, error = _builder_line(op, qty)
+                if error:
+                    results.append(error)
+                    continue
+            else:
+                results.append({"ok": False, "error": "Unknown item_type"})
+                continue
+            target = by_hash.get(line.content_hash)
+            if target is None:
+                by_hash[line.content_hash] = target = line
+                created.append(line)
+                subtotal_delta += line.total_price
+                count_delta += line.quantity
+            else:
+                delta_sum, delta_qty = target.add_quantity(line.quantity)
+                if target.pk is not None and delta_qty:
+                    dirty[target.pk] = target
+                subtotal_delta += delta_sum
+                count_delta += delta_qty
+            result = {"ok": True, "quantity": target.quantity}
+            if target.pk is None:
+                pending.append((result, target))
+            else:
+                result["item_id"] = target.pk
+            results.append(result)
+
+        elif kind in ("update", "remove"):
+            it = lines.get(_to_id(op.get("item_id")))
+            if not it:
+                results.append({"ok": False, "error": "Item not found"})
+                continue
+            if kind == "remove":
+                del lines[it.id]
+                dirty.pop(it.id, None)
+                if by_hash.get(it.content_hash) is it:
+                    del by_hash[it.content_hash]
+                removed.append(it.id)
+                subtotal_delta -= it.total_price
+                count_delta -= it.quantity
+            else:
+                qty = _batch_qty(op)
+                if qty is None:
+                    results.append({"ok": False, "error": "quantity must be an integer"})
+                    continue
+                old_qty, old_total = it.quantity, it.total_price
+                it.quantity = qty
+                it.recalc()
+                dirty[it.id] = it
+                subtotal_delta += it.total_price - old_total
+                count_delta += qty - old_qty
+            results.append({"ok": True, "item_id": it.id})
+
+        else:
+            results.append({"ok": False, "error": "op must be add, update or remove"})
+
+    store.commit(cart, created, list(dirty.values()), removed, subtotal_delta, count_delta)
+    for result, line in pending:
+        result["item_id"] = line.pk
+
+    return {**cart_to_dict(cart), "results": results}
@@ -0,0 +1,15 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .services import _cache_store, persist_session_cart
+from .stores import CacheCartStore
+
+
+@receiver(user_logged_in)
+def persist_cart_on_login(sender, request, user, **kwargs):
+    # после входа корзина живет в БД; токен переживает cycle_key вместе с данными сессии
+    if request is None or not request.session.get(CacheCartStore.SESSION_KEY):
+        return
+    cart = _cache_store.load(request)
+    if cart is not None:
+        persist_session_cart(request, cart)
@@ -0,0 +1,310 @@
+# cart/stores.py
+"""Хранилища корзины за API cart.services.
+
+DatabaseCartStore — Cart/CartItem в БД (по умолчанию). CacheCartStore держит
+корзины анонимов в кэше Django и ничего не пишет в БД, пока корзину не
+перенесут туда при оформлении заказа или входе (cart.services.persist_session_cart).
+
+Оба хранилища отдают строки как объекты CartItem с одинаково округленными
+суммами, поэтому cart_to_dict не зависит от хранилища.
+"""
+from __future__ import annotations
+
+import secrets
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+
+CART_TOTAL_FIELDS = ("subtotal", "item_count", "version")
+CENT = Decimal("0.01")
+
+
+class DatabaseCartStore:
+    name = "db"
+
+    def load(self, request) -> Cart | None:
+        session_key = request.session.session_key
+        return Cart.objects.filter(session_key=session_key).first() if session_key else None
+
+    def create(self, request) -> Cart:
+        # гарантируем наличие session_key
+        if not request.session.session_key:
+            request.session.save()
+
+        session_key = request.session.session_key
+        user = request.user if getattr(request, "user", None) and request.user.is_authenticated else None
+
+        cart, _ = Cart.objects.get_or_create(
+            session_key=session_key,
+            defaults={"user": user},
+        )
+
+        # если юзер залогинился позже — привяжем
+        if user and cart.user_id is None:
+            cart.user = user
+            cart.save(update_fields=["user"])
+
+        return cart
+
+    def lines(self, cart: Cart, for_update: bool = False, with_snapshots: bool = True) -> list:
+        qs = cart.items.order_by("id")
+        if not with_snapshots:
+            qs = qs.defer("snapshot_json")
+        if for_update:
+            qs = qs.select_for_update()
+        return list(qs)
+
+    def _shift_totals(self, cart: Cart, subtotal_delta, count_delta: int) -> None:
+        """Сдвигает денормализованные итоги корзины. Вызывать внутри той же транзакции,
+        что и изменение строк: F()-выражения не теряют параллельные изменения."""
+        Cart.objects.filter(pk=cart.pk).update(
+            subtotal=F("subtotal") + subtotal_delta,
+            item_count=F("item_count") + count_delta,
+            version=F("version") + 1,
+            updated_at=timezone.now(),
+        )
+        cart.refresh_from_db(fields=CART_TOTAL_FIELDS)
+
+    @transaction.atomic
+    def add_line(self, cart: Cart, line: CartItem) -> None:
+        """Сохраняет строку или, если такая уже есть в корзине, увеличивает ее количество."""
+        existing = (
+            cart.items.select_for_update()
+            .filter(content_hash=line.content_hash)
+            .order_by("id")
+            .first()
+        )
+        if existing is None:
+            line.cart = cart
+            line.save()
+            self._shift_totals(cart, line.total_price, line.quantity)
+            return
+
+        subtotal_delta, count_delta = existing.add_quantity(line.quantity)
+        if count_delta:
+            existing.save(update_fields=["quantity", "total_price"])
+            self._shift_totals(cart, subtotal_delta, count_delta)
+
+    @transaction.atomic
+    def set_quantity(self, cart: Cart, item_id, qty: int) -> bool:
+        it = cart.items.select_for_update().filter(id=item_id).first()
+        if not it:
+            return False
+
+        old_qty, old_total = it.quantity, it.total_price
+        it.quantity = qty
+        it.recalc()
+        it.save(update_fields=["quantity", "total_price"])
+        self._shift_totals(cart, it.total_price - old_total, qty - old_qty)
+        return True
+
+    @transaction.atomic
+    def remove(self, cart: Cart, item_id) -> bool:
+        it = cart.items.select_for_update().filter(id=item_id).first()
+        if not it:
+            return False
+
+        it.delete()
+        self._shift_totals(cart, -it.total_price, -it.quantity)
+        return True
+
+    def commit(self, cart: Cart, created: list, dirty: list, removed: list, subtotal_delta, count_delta: int) -> None:
+        """Пишет пачку изменений: bulk_create / bulk_update / один DELETE. Внутри транзакции."""
+        if created:
+            for line in created:
+                line.cart = cart
+            CartItem.objects.bulk_create(created)
+        if dirty:
+            CartItem.objects.bulk_update(dirty, ["quantity", "total_price"])
+        if removed:
+            CartItem.objects.filter(cart=cart, id__in=removed).delete()
+        if created or dirty or removed:
+            self._shift_totals(cart, subtotal_delta, count_delta)
+
+    def clear(self, cart: Cart) -> None:
+        # вызывается внутри транзакции оформления заказа
+        cart.items.all().delete()
+        Cart.objects.filter(pk=cart.pk).update(
+            subtotal=0, item_count=0, version=F("version") + 1, updated_at=timezone.now(),
+        )
+        cart.refresh_from_db(fields=CART_TOTAL_FIELDS)
+
+
+class SessionCart:
+    """Корзина анонима из кэша: те же поля итогов, что у Cart; строки — несохраняемые CartItem."""
+
+    id = None  # в БД корзины еще нет
+
+    def __init__(self, token: str, lines=(), subtotal=Decimal("0"), item_count=0, version=0, next_item_id=1):
+        self.token = token
+        self.lines = list(lines)
+        self.subtotal = subtotal
+        self.item_count = item_count
+        self.version = version
+        self.next_item_id = next_item_id
+
+
+class CacheCartStore:
+    """Анонимные корзины в кэше Django под случайным токеном из сессии.
+
+    Запись — read-modify-write всего состояния корзины: одновременные изменения
+    одной корзины из двух вкладок могут перетереть друг друга. Для черновика
+    анонима это приемлемо; в БД корзина попадает целиком при persist.
+    """
+
+    name = "cache"
+    SESSION_KEY = "cart_token"
+    KEY_PREFIX = "cart:session:"
+
+    def __init__(self, timeout: int):
+        self.timeout = timeout
+
+    def _key(self, token: str) -> str:
+        return f"{self.KEY_PREFIX}{token}"
+
+    def load(self, request) -> SessionCart | None:
+        if not request.session.session_key:
+            return None
+        token = request.session.get(self.SESSION_KEY)
+        if not token:
+            return None
+        state = cache.get(self._key(token))
+        if state is None:
+            return None
+        return SessionCart(
+            token=token,
+            lines=[self._line_from_state(row) for row in state["lines"]],
+            subtotal=Decimal(state["subtotal"]),
+            item_count=state["item_count"],
+            version=state["version"],
+            next_item_id=state["next_item_id"],
+        )
+
+    def create(self, request) -> SessionCart:
+        # сессия сохранится middleware'ом в конце запроса — это единственная запись в БД
+        token = secrets.token_urlsafe(16)
+        request.session[self.SESSION_KEY] = token
+        return SessionCart(token=token)
+
+    def lines(self, cart: SessionCart, for_update: bool = False, with_snapshots: bool = True) -> list:
+        return list(cart.lines)
+
+    def _line_from_state(self, row: dict) -> CartItem:
+        return CartItem(
+            id=row["id"],
+            item_type=row["item_type"],
+            quantity=row["quantity"],
+            title=row["title"],
+            snapshot_json=row["snapshot_json"],
+            unit_price=Decimal(row["unit_price"]),
+            total_price=Decimal(row["total_price"]),
+            content_hash=row["content_hash"],
+        )
+
+    def _save(self, cart: SessionCart) -> None:
+        cart.version += 1
+        state = {
+            "lines": [
+                {
+                    "id": it.id,
+                    "item_type": it.item_type,
+                    "quantity": it.quantity,
+                    "title": it.title,
+                    "snapshot_json": it.snapshot_json,
+                    "unit_price": str(it.unit_price),
+                    "total_price": str(it.total_price),
+                    "content_hash": it.content_hash,
+                }
+                for it in cart.lines
+            ],
+            "subtotal": str(cart.subtotal),
+            "item_count": cart.item_count,
+            "version": cart.version,
+            "next_item_id": cart.next_item_id,
+        }
+        cache.set(self._key(cart.token), state, timeout=self.timeout)
+
+    def _shift_totals(self, cart: SessionCart, subtotal_delta, count_delta: int) -> None:
+        # суммы в том же виде, в каком их вернула бы БД (DecimalField, 2 знака)
+        cart.subtotal = (cart.subtotal + subtotal_delta).quantize(CENT)
+        cart.item_count += count_delta
+
+    def _append(self, cart: SessionCart, line: CartItem) -> None:
+        line.id = cart.next_item_id
+        cart.next_item_id += 1
+        line.unit_price = line.unit_price.quantize(CENT)
+        line.recalc()
+        cart.lines.append(line)
+
+    def _find(self, cart: SessionCart, item_id):
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            return None
+        return next((it for it in cart.lines if it.id == item_id), None)
+
+    def add_line(self, cart: SessionCart, line: CartItem) -> None:
+        existing = next((it for it in cart.lines if it.content_hash == line.content_hash), None)
+        if existing is None:
+            self._append(cart, line)
+            self._shift_totals(cart, line.total_price, line.quantity)
+        else:
+            subtotal_delta, count_delta = existing.add_quantity(line.quantity)
+            if not count_delta:
+                return
+            self._shift_totals(cart, subtotal_delta, count_delta)
+        self._save(cart)
+
+    def set_quantity(self, cart: SessionCart, item_id, qty: int) -> bool:
+        it = self._find(cart, item_id)
+        if not it:
+            return False
+        old_qty, old_total = it.quantity, it.total_price
+        it.quantity = qty
+        it.recalc()
+        self._shift_totals(cart, it.total_price - old_total, qty - old_qty)
+        self._save(cart)
+        return True
+
+    def remove(self, cart: SessionCart, item_id) -> bool:
+        it = self._find(cart, item_id)
+        if not it:
+            return False
+        cart.lines.remove(it)
+        self._shift_totals(cart, -it.total_price, -it.quantity)
+        self._save(cart)
+        return True
+
+    def commit(self, cart: SessionCart, created: list, dirty: list, removed: list, subtotal_delta,
+               count_delta: int) -> None:
+        # dirty — те же объекты, что в cart.lines, они уже изменены
+        if not (created or dirty or removed):
+            return
+        if removed:
+            removed = set(removed)
+            cart.lines = [it for it in cart.lines if it.id not in removed]
+        for line in created:
+            self._append(cart, line)
+        self._shift_totals(cart, subtotal_delta, count_delta)
+        self._save(cart)
+
+    def clear(self, cart: SessionCart, request=None) -> None:
+        # persist_session_cart зовет это в своей транзакции: черновик убираем после коммита,
+        # при откате корзина остается в кэше и сессия по-прежнему на нее ссылается
+        key = self._key(cart.token)
+
+        def drop():
+            cache.delete(key)
+            if request is not None:
+                request.session.pop(self.SESSION_KEY, None)
+
+        transaction.on_commit(drop)
+        cart.lines = []
+        cart.subtotal = Decimal("0")
+        cart.item_count = 0
+        cart.version += 1
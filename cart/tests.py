@@ -0,0 +1,82 @@
+import io
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from cart import services as cart_services
+from cart.services import _cache_store
+from cart.stores import SessionCart
+from catalog.models import Product
+
+
+@override_settings(CART_STORE="cache")
+class PersistSessionCartTests(TestCase):
+    """Корзина из кэша уходит из кэша и сессии, только когда перенос в БД закоммичен."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("seed_demo", stdout=io.StringIO())
+        cls.product = Product.objects.order_by("id").first()
+
+    def _session_cart(self):
+        request = RequestFactory().post("/")
+        request.session = SessionStore()
+        request.session.save()
+        cart = cart_services.get_or_create_cart(request)
+        self.assertIsInstance(cart, SessionCart)
+        self.addCleanup(cache.delete, _cache_store._key(cart.token))
+        self.assertTrue(cart_services.add_product_item(cart, self.product.id, 2)["ok"])
+        return request, cart
+
+    def test_commit_drops_cached_cart(self):
+        request, cart = self._session_cart()
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart = cart_services.persist_session_cart(request, cart)
+            # до коммита черновик на месте
+            self.assertIsNotNone(_cache_store.load(request))
+        self.assertEqual(db_cart.item_count, 2)
+        self.assertIsNone(_cache_store.load(request))
+        self.assertNotIn(_cache_store.SESSION_KEY, request.session)
+
+    def test_rollback_keeps_cached_cart(self):
+        request, cart = self._session_cart()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                cart_services.persist_session_cart(request, cart)
+                raise RuntimeError("checkout failed")
+        self.assertEqual(callbacks, [])
+        cached = _cache_store.load(request)
+        self.assertIsNotNone(cached)
+        self.assertEqual(cached.item_count, 2)
+
+
+class CartBatchTests(TestCase):
+    """Кривая операция пачки получает свою ошибку в results, остальные применяются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("seed_demo", stdout=io.StringIO())
+        cls.product = Product.objects.order_by("id").first()
+
+    def test_malformed_product_id_fails_only_its_op(self):
+        ops = [
+            {"op": "add", "item_type": "PRODUCT", "product_id": [self.product.id]},
+            {"op": "add", "item_type": "PRODUCT", "product_id": {"id": self.product.id}},
+            {"op": "add", "item_type": "PRODUCT", "product_id": 10 ** 30},
+            {"op": "add", "item_type": "PRODUCT", "product_id": "abc"},
+            {"op": "add", "item_type": "PRODUCT", "product_id": str(self.product.id), "quantity": 2},
+            {"op": "remove", "item_id": [1]},
+        ]
+        response = self.client.post(reverse("api_cart_batch"), {"ops": ops}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        malformed = {"ok": False, "error": "product_id must be a positive integer"}
+        self.assertEqual(data["results"][:4], [malformed] * 4)
+        self.assertTrue(data["results"][4]["ok"])
+        self.assertEqual(data["results"][5], {"ok": False, "error": "Item not found"})
+        self.assertEqual(data["item_count"], 2)
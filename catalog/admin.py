@@ -9,7 +9,7 @@ class IngredientCategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Allergen)
 class AllergenAdmin(admin.ModelAdmin):
-    list_display = ("name", "code")
+    list_display = ("name", "code", "bit")
     search_fields = ("name", "code")
 
 @admin.register(Ingredient)
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:28
+
+from django.db import migrations, models
+
+
+def assign_bits_and_masks(apps, schema_editor):
+    Allergen = apps.get_model("catalog", "Allergen")
+    Ingredient = apps.get_model("catalog", "Ingredient")
+
+    bits = {}
+    for bit, allergen in enumerate(Allergen.objects.order_by("id")):
+        allergen.bit = bit
+        allergen.save(update_fields=["bit"])
+        bits[allergen.id] = bit
+
+    masks = {}
+    for ingredient_id, allergen_id in Ingredient.allergens.through.objects.values_list("ingredient_id", "allergen_id"):
+        masks[ingredient_id] = masks.get(ingredient_id, 0) | (1 << bits[allergen_id])
+    for ingredient_id, mask in masks.items():
+        Ingredient.objects.filter(id=ingredient_id).update(allergen_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0003_alter_ingredient_image_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='allergen',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='allergen_mask',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(assign_bits_and_masks, migrations.RunPython.noop),
+    ]
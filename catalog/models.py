@@ -1,4 +1,8 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+
+# allergen_mask хранится в BigIntegerField (signed 64 bit) → доступны биты 0..62
+MAX_ALLERGEN_BITS = 63
 
 class IngredientCategory(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -13,6 +17,39 @@ class IngredientCategory(models.Model):
 class Allergen(models.Model):
     name = models.CharField(max_length=100, unique=True)
     code = models.CharField(max_length=32, unique=True)
+    bit = models.PositiveSmallIntegerField(unique=True, null=True, editable=False)  # позиция в Ingredient.allergen_mask
+
+    def clean(self):
+        super().clean()
+        if self.bit is None and self._free_bit() is None:
+            raise ValidationError(f"Не больше {MAX_ALLERGEN_BITS} аллергенов: все биты маски заняты")
+
+    def save(self, *args, **kwargs):
+        if self.bit is not None:
+            super().save(*args, **kwargs)
+            return
+        # параллельное создание могло занять тот же бит — берем следующий свободный
+        for _ in range(MAX_ALLERGEN_BITS):
+            self.bit = self._free_bit()
+            if self.bit is None:
+                raise ValidationError(f"Не больше {MAX_ALLERGEN_BITS} аллергенов: все биты маски заняты")
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                taken = Allergen.objects.filter(bit=self.bit).exists()
+                self.bit = None
+                if not taken:
+                    raise  # конфликт по name / code, а не по биту
+        raise ValidationError("Не удалось выделить бит аллергена, повторите")
+
+    @classmethod
+    def _free_bit(cls):
+        # самый младший свободный бит; бит удаленного аллергена свободен — при удалении
+        # drop_deleted_allergen_bit в той же транзакции пересчитывает маски без него
+        used = set(cls.objects.exclude(bit=None).values_list("bit", flat=True))
+        return next((bit for bit in range(MAX_ALLERGEN_BITS) if bit not in used), None)
 
     def __str__(self):
         return self.name
@@ -33,6 +70,8 @@ class Ingredient(models.Model):
     is_spicy = models.BooleanField(default=False)
     is_available = models.BooleanField(default=True)
     allergens = models.ManyToManyField(Allergen, blank=True, related_name="ingredients")
+    # OR битов allergens; синхронизируется сигналами из catalog/signals.py
+    allergen_mask = models.BigIntegerField(default=0, editable=False)
     image_url = models.ImageField(upload_to="ingredients/", blank=True, null=True)
 
     class Meta:
@@ -66,3 +105,30 @@ class Product(models.Model):
 
     def __str__(self):
         return self.name
+
+
+def allergen_mask(bits) -> int:
+    mask = 0
+    for bit in bits:
+        if bit is not None:
+            mask |= 1 << bit
+    return mask
+
+
+def recompute_allergen_masks(ingredient_ids) -> None:
+    """Пересчитывает allergen_mask у ингредиентов по текущей M2M."""
+    ingredient_ids = set(ingredient_ids)
+    if not ingredient_ids:
+        return
+
+    bits = {}
+    rows = Ingredient.allergens.through.objects.filter(ingredient_id__in=ingredient_ids).values_list("ingredient_id", "allergen__bit")
+    for ingredient_id, bit in rows:
+        bits.setdefault(ingredient_id, []).append(bit)
+
+    # один UPDATE на каждое различное значение маски
+    by_mask = {}
+    for ingredient_id in ingredient_ids:
+        by_mask.setdefault(allergen_mask(bits.get(ingredient_id, ())), []).append(ingredient_id)
+    for mask, ids in by_mask.items():
+        Ingredient.objects.filter(id__in=ids).update(allergen_mask=mask)
@@ -0,0 +1,32 @@
+from django.db.models.signals import m2m_changed, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Allergen, Ingredient, recompute_allergen_masks
+
+
+@receiver(m2m_changed, sender=Ingredient.allergens.through)
+def sync_allergen_mask(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        # allergen.ingredients.clear(): после очистки pk_set не узнать — запомним заранее
+        instance._allergen_mask_ingredient_ids = list(instance.ingredients.values_list("id", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        recompute_allergen_masks([instance.pk])
+    elif action == "post_clear":
+        recompute_allergen_masks(getattr(instance, "_allergen_mask_ingredient_ids", ()))
+    else:
+        recompute_allergen_masks(pk_set or ())
+
+
+@receiver(pre_delete, sender=Allergen)
+def remember_allergen_ingredients(sender, instance, **kwargs):
+    # каскадное удаление связей m2m_changed не шлет
+    instance._allergen_mask_ingredient_ids = list(instance.ingredients.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Allergen)
+def drop_deleted_allergen_bit(sender, instance, **kwargs):
+    recompute_allergen_masks(getattr(instance, "_allergen_mask_ingredient_ids", ()))
@@ -0,0 +1,59 @@
+from unittest.mock import patch
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.test import TestCase
+
+from catalog.models import MAX_ALLERGEN_BITS, Allergen, Ingredient, IngredientCategory
+
+
+class AllergenBitTests(TestCase):
+    """Бит аллергена — младший свободный; биты удаленных переиспользуются без ложных срабатываний."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = IngredientCategory.objects.create(name="Соусы")
+        cls.first, cls.second = (
+            Ingredient.objects.create(name=name, category=category, type=Ingredient.Type.SAUCE)
+            for name in ("Сырный", "Чесночный")
+        )
+
+    def _allergen(self, n: int) -> Allergen:
+        return Allergen.objects.create(code=f"A{n}", name=f"Аллерген {n}")
+
+    def test_deleted_bit_is_reused_without_stale_masks(self):
+        a, b, c = (self._allergen(n) for n in range(3))
+        self.assertEqual([a.bit, b.bit, c.bit], [0, 1, 2])
+        self.first.allergens.add(b)
+        b.delete()
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.allergen_mask, 0)
+
+        reused = self._allergen(3)
+        self.assertEqual(reused.bit, 1)
+        self.second.allergens.add(reused)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.allergen_mask, self.second.allergen_mask), (0, 1 << 1))
+
+    def test_bit_taken_concurrently_is_retried(self):
+        self._allergen(0)
+        # как будто параллельный запрос успел занять бит 0 между выбором и INSERT
+        with patch.object(Allergen, "_free_bit", side_effect=[0, 1]):
+            allergen = self._allergen(1)
+        self.assertEqual(allergen.bit, 1)
+
+    def test_duplicate_code_is_not_retried(self):
+        self._allergen(0)
+        with self.assertRaises(IntegrityError):
+            Allergen.objects.create(code="A0", name="Другой")
+
+    def test_full_mask_is_a_validation_error(self):
+        Allergen.objects.bulk_create(
+            Allergen(code=f"A{n}", name=f"Аллерген {n}", bit=n) for n in range(MAX_ALLERGEN_BITS)
+        )
+        extra = Allergen(code="EXTRA", name="Лишний")
+        with self.assertRaises(ValidationError):
+            extra.full_clean()
+        with self.assertRaises(ValidationError):
+            extra.save()
@@ -6,16 +6,30 @@ urlpatterns = [
     # builder
     path("builder/options/", api_views.builder_options, name="api_builder_options"),
     path("builder/calculate/", api_views.builder_calculate, name="api_builder_calculate"),
+    path("builder/calculate-batch/", api_views.builder_calculate_batch, name="api_builder_calculate_batch"),
+    path("builder/suggest/", api_views.builder_suggest, name="api_builder_suggest"),
+    path("builder/cache-stats/", api_views.builder_cache_stats, name="api_builder_cache_stats"),
 
     # cart
     path("cart/", api_views.cart_get, name="api_cart_get"),
+    path("cart/summary/", api_views.cart_summary_get, name="api_cart_summary"),
     path("cart/add/", api_views.cart_add, name="api_cart_add"),
     path("cart/update/", api_views.cart_update, name="api_cart_update"),
     path("cart/remove/", api_views.cart_remove, name="api_cart_remove"),
+    path("cart/batch/", api_views.cart_batch, name="api_cart_batch"),
+    path("cart/stats/", api_views.cart_stats, name="api_cart_stats"),
 
     # checkout + orders
     path("checkout/", api_views.checkout, name="api_checkout"),
+    path("orders/", api_views.orders_list, name="api_orders_list"),
+    path("orders/export/", api_views.orders_export, name="api_orders_export"),
     path("orders/<int:order_id>/", api_views.order_get, name="api_order_get"),
+    path("orders/transition/", api_views.orders_transition, name="api_orders_transition"),
+    path("orders/events/", api_views.orders_events, name="api_orders_events"),
+
+    # reports
+    path("reports/sales/", api_views.reports_sales, name="api_reports_sales"),
+    path("reports/top-items/", api_views.reports_top_items, name="api_reports_top_items"),
 
     # payments (demo)
     path("payments/simulate-paid/", api_views.simulate_paid, name="api_simulate_paid"),
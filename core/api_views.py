@@ -1,14 +1,32 @@
+import asyncio
 import json
 from decimal import Decimal
-from django.http import JsonResponse, HttpRequest
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.cache import cache_control
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 
-from builder.services import calculate_build
-from cart.services import get_or_create_cart, cart_to_dict, add_builder_item, add_product_item, update_item_qty, remove_item
-from orders.services import create_order_from_cart, order_to_dict
-from orders.models import Order, PromoCode
+from builder.optimizer import suggest_builds
+from builder.services import calculate_build, calculate_builds, get_builder_options, price_cache_info, MAX_BATCH_BUILDS
+from cart.services import (
+    get_cart, get_or_create_cart, ensure_db_cart, empty_cart_dict, lazy_cart_info, cart_etag, cart_to_dict,
+    cart_summary,
+    add_builder_item, add_product_item, update_item_qty, remove_item,
+    apply_cart_batch, MAX_BATCH_OPS,
+)
+from orders.services import (
+    create_order_from_cart, order_to_dict, request_fingerprint, run_idempotent,
+    transition_orders, set_payment_status, MAX_TRANSITION_ORDERS,
+    list_orders, filter_orders, ORDER_LIST_LIMIT, MAX_ORDER_LIST_LIMIT,
+    sales_report, top_items_report, TOP_ITEMS_LIMIT, MAX_TOP_ITEMS_LIMIT,
+)
+from orders.archive import archived_order_to_dict, load_archived_order
+from orders.events import get_hub
+from orders.export import EXPORT_FORMATS, export_filename, export_orders
+from orders.models import IdempotencyKey, Order, PromoCode
 from catalog.models import Product  # добавь это
 
 @require_http_methods(["GET"])
@@ -32,10 +50,18 @@ def _json(request: HttpRequest):
     except json.JSONDecodeError:
         return {}
 
-@require_http_methods(["GET"])
+@require_http_methods(["GET", "HEAD"])
+@cache_control(public=True, max_age=60)
 def builder_options(request):
-    # options без выбора пользователя → считаем как пустой payload
-    return JsonResponse(calculate_build({}), safe=False)
+    # тело сериализовано заранее (одно на версию каталога) → 304 по If-None-Match
+    # ?exclude_allergens=LACTOSE,GLUTEN — убрать ингредиенты с этими аллергенами
+    exclude = [c.strip() for c in request.GET.get("exclude_allergens", "").split(",") if c.strip()]
+    body, etag = get_builder_options(exclude)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    return response
 
 
 @require_http_methods(["POST"])
@@ -44,26 +70,83 @@ def builder_calculate(request):
     result = calculate_build(payload)
     return JsonResponse(result, status=200 if result.get("ok") else 400)
 
+@require_http_methods(["POST"])
+def builder_calculate_batch(request):
+    payload = _json(request)
+    items = payload.get("items") if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return JsonResponse({"ok": False, "error": "items must be a non-empty list"}, status=400)
+    if len(items) > MAX_BATCH_BUILDS:
+        return JsonResponse({"ok": False, "error": f"too many items, max {MAX_BATCH_BUILDS}"}, status=400)
+
+    return JsonResponse({"ok": True, "results": calculate_builds(items)})
+
+@require_http_methods(["POST"])
+def builder_suggest(request):
+    payload = _json(request)
+    if not isinstance(payload, dict):
+        return JsonResponse({"ok": False, "error": "payload must be an object"}, status=400)
+    result = suggest_builds(payload)
+    return JsonResponse(result, status=200 if result.get("ok") else 400)
+
 @require_http_methods(["GET"])
+def builder_cache_stats(request):
+    # счетчики per-process — чтобы подобрать BUILD_PRICE_CACHE_SIZE
+    if not request.user.is_staff:
+        return JsonResponse({"ok": False, "error": "Forbidden"}, status=403)
+    return JsonResponse({"ok": True, "cache": price_cache_info()})
+
+CART_FIELDS = ("full", "summary")
+
+@require_http_methods(["GET", "HEAD"])
+@cache_control(private=True, no_cache=True)
 def cart_get(request):
-    cart = get_or_create_cart(request)
-    return JsonResponse(cart_to_dict(cart))
+    # ETag из version корзины: на If-None-Match отвечаем 304, не читая строки
+    # ?fields=summary — строки без snapshot (для шапки и страницы корзины)
+    fields = request.GET.get("fields") or "full"
+    if fields not in CART_FIELDS:
+        return JsonResponse({"ok": False, "error": f"fields must be one of {', '.join(CART_FIELDS)}"}, status=400)
+    cart = get_cart(request)
+    etag = cart_etag(cart, fields)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        with_snapshots = fields == "full"
+        body = empty_cart_dict() if cart is None else cart_to_dict(cart, with_snapshots=with_snapshots)
+        response = JsonResponse(body)
+    response["ETag"] = etag
+    return response
+
+@require_http_methods(["GET", "HEAD"])
+@cache_control(private=True, no_cache=True)
+def cart_summary_get(request):
+    cart = get_cart(request)
+    etag = cart_etag(cart, "totals")
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(empty_cart_dict(with_items=False) if cart is None else cart_summary(cart))
+    response["ETag"] = etag
+    return response
+
+@require_http_methods(["GET"])
+def cart_stats(request):
+    if not request.user.is_staff:
+        return JsonResponse({"ok": False, "error": "Forbidden"}, status=403)
+    return JsonResponse({"ok": True, "lazy_cart": lazy_cart_info()})
 
 @require_http_methods(["POST"])
 def cart_add(request):
     payload = _json(request)
-    cart = get_or_create_cart(request)
 
     item_type = payload.get("item_type")
     qty = int(payload.get("quantity", 1))
 
     if item_type == "BUILDER":
-        result = add_builder_item(cart, payload, qty)
+        result = add_builder_item(get_or_create_cart(request), payload, qty)
         return JsonResponse(result, status=200 if result.get("ok") else 400)
 
     if item_type == "PRODUCT":
         product_id = payload.get("product_id")
-        result = add_product_item(cart, product_id=product_id, quantity=qty)
+        result = add_product_item(get_or_create_cart(request), product_id=product_id, quantity=qty)
         return JsonResponse(result, status=200 if result.get("ok") else 400)
 
     return JsonResponse({"ok": False, "error": "Unknown item_type"}, status=400)
@@ -71,7 +154,9 @@ def cart_add(request):
 @require_http_methods(["POST"])
 def cart_update(request):
     payload = _json(request)
-    cart = get_or_create_cart(request)
+    cart = get_cart(request)
+    if cart is None:
+        return JsonResponse({"ok": False, "error": "Item not found"}, status=400)
     item_id = payload.get("item_id")
     qty = int(payload.get("quantity", 1))
     result = update_item_qty(cart, item_id=item_id, quantity=qty)
@@ -80,15 +165,54 @@ def cart_update(request):
 @require_http_methods(["POST"])
 def cart_remove(request):
     payload = _json(request)
-    cart = get_or_create_cart(request)
+    cart = get_cart(request)
+    if cart is None:
+        return JsonResponse({"ok": False, "error": "Item not found"}, status=400)
     item_id = payload.get("item_id")
     result = remove_item(cart, item_id=item_id)
     return JsonResponse(result, status=200 if result.get("ok") else 400)
 
 @require_http_methods(["POST"])
-def checkout(request):
+def cart_batch(request):
     payload = _json(request)
+    ops = payload.get("ops") if isinstance(payload, dict) else None
+    if not isinstance(ops, list) or not ops:
+        return JsonResponse({"ok": False, "error": "ops must be a non-empty list"}, status=400)
+    if len(ops) > MAX_BATCH_OPS:
+        return JsonResponse({"ok": False, "error": f"too many ops, max {MAX_BATCH_OPS}"}, status=400)
+
     cart = get_or_create_cart(request)
+    return JsonResponse(apply_cart_batch(cart, ops))
+
+@require_http_methods(["POST"])
+def checkout(request):
+    payload = _json(request)
+    # повтор с тем же Idempotency-Key получает ответ первой попытки, заказ не дублируется
+    key = (request.headers.get("Idempotency-Key") or "").strip()
+    owner = _idempotency_owner(request)
+    if not key or owner is None:
+        status, body = _checkout(request, payload)
+        return JsonResponse(body, status=status)
+    if len(key) > IdempotencyKey.MAX_KEY_LENGTH:
+        return JsonResponse({"ok": False, "error": "Idempotency-Key is too long"}, status=400)
+
+    status, body, replayed = run_idempotent(owner, key, request_fingerprint(payload), lambda: _checkout(request, payload))
+    response = JsonResponse(body, status=status)
+    if replayed:
+        response["Idempotent-Replayed"] = "true"
+    return response
+
+def _idempotency_owner(request):
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    # без сессии нет и корзины — оформлять нечего
+    return f"session:{request.session.session_key}" if request.session.session_key else None
+
+def _checkout(request, payload) -> tuple:
+    cart = get_cart(request)
+    if cart is None:
+        return 400, {"ok": False, "error": "Cart is empty"}
+    cart = ensure_db_cart(request, cart)
 
     promo_code = (payload.get("promo_code") or "").strip().upper()
     promo = None
@@ -96,13 +220,144 @@ def checkout(request):
         promo = PromoCode.objects.filter(code=promo_code, active=True).first()
 
     result = create_order_from_cart(cart, payload, promo=promo)
+    return (200 if result.get("ok") else 400), result
+
+@require_http_methods(["GET"])
+def orders_list(request):
+    # для панелей и экрана кухни; только staff
+    # ?status=NEW,CONFIRMED&payment_status=&delivery_type=&created_from=&created_to=
+    # &cursor=<next_cursor>&limit=50&include=items
+    if not request.user.is_staff:
+        return JsonResponse({"ok": False, "error": "Forbidden"}, status=403)
+    try:
+        limit = max(1, min(int(request.GET.get("limit", ORDER_LIST_LIMIT)), MAX_ORDER_LIST_LIMIT))
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "limit must be an integer"}, status=400)
+    result = list_orders(
+        request.GET,
+        cursor=request.GET.get("cursor") or None,
+        limit=limit,
+        with_items=request.GET.get("include") == "items",
+    )
+    return JsonResponse(result, status=200 if result.get("ok") else 400)
+
+@require_http_methods(["GET"])
+def orders_export(request):
+    # выгрузка для бухгалтерии потоком: ?format=csv|jsonl&gzip=1 + фильтры как у списка заказов
+    if not request.user.is_staff:
+        return JsonResponse({"ok": False, "error": "Forbidden"}, status=403)
+    fmt = request.GET.get("format") or "csv"
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({"ok": False, "error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}, status=400)
+    orders, error = filter_orders(request.GET)
+    if error:
+        return JsonResponse({"ok": False, "error": error}, status=400)
+
+    compress = request.GET.get("gzip") in ("1", "true")
+    content_type = "application/gzip" if compress else ("text/csv" if fmt == "csv" else "application/x-ndjson")
+    response = StreamingHttpResponse(export_orders(orders, fmt, compress), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{export_filename(fmt, compress)}"'
+    return response
+
+@require_http_methods(["GET"])
+def reports_sales(request):
+    # для дашбордов: ?grain=hour|day&from=&to=&group_by=status,payment_method + фильтры как у списка заказов
+    if not request.user.is_staff:
+        return JsonResponse({"ok": False, "error": "Forbidden"}, status=403)
+    result = sales_report(request.GET)
+    return JsonResponse(result, status=200 if result.get("ok") else 400)
+
+@require_http_methods(["GET"])
+def reports_top_items(request):
+    # ?grain=day&from=&to=&status=COMPLETED&order_by=revenue|quantity&limit=10; только staff
+    if not request.user.is_staff:
+        return JsonResponse({"ok": False, "error": "Forbidden"}, status=403)
+    try:
+        limit = max(1, min(int(request.GET.get("limit", TOP_ITEMS_LIMIT)), MAX_TOP_ITEMS_LIMIT))
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "limit must be an integer"}, status=400)
+    result = top_items_report(request.GET, limit=limit)
+    return JsonResponse(result, status=200 if result.get("ok") else 400)
+
+@require_http_methods(["POST"])
+def orders_transition(request):
+    # массовая смена статуса (кухня, курьеры): {"order_ids": [...], "status": "READY"}
+    # или {"order_ids": [...], "payment_status": "PAID"}; только staff
+    if not request.user.is_staff:
+        return JsonResponse({"ok": False, "error": "Forbidden"}, status=403)
+    payload = _json(request)
+
+    order_ids = payload.get("order_ids")
+    if not isinstance(order_ids, list) or not order_ids:
+        return JsonResponse({"ok": False, "error": "order_ids must be a non-empty list"}, status=400)
+    if len(order_ids) > MAX_TRANSITION_ORDERS:
+        return JsonResponse({"ok": False, "error": f"At most {MAX_TRANSITION_ORDERS} orders per request"}, status=400)
+    try:
+        order_ids = [int(i) for i in order_ids]
+    except (TypeError, ValueError):
+        return JsonResponse({"ok": False, "error": "order_ids must be integers"}, status=400)
+
+    if payload.get("status"):
+        result = transition_orders(order_ids, payload["status"], by_user=request.user)
+    elif payload.get("payment_status"):
+        result = set_payment_status(order_ids, payload["payment_status"], by_user=request.user)
+    else:
+        return JsonResponse({"ok": False, "error": "status or payment_status is required"}, status=400)
     return JsonResponse(result, status=200 if result.get("ok") else 400)
 
+ORDER_EVENTS_MAX_WAIT = 25  # сек, long-poll
+SSE_KEEPALIVE = 15
+SSE_MAX_AGE = 300  # потом клиент переподключается с Last-Event-ID
+
+async def _sse_events(hub, cursor: int):
+    yield "retry: 3000\n\n"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SSE_MAX_AGE
+    while loop.time() < deadline:
+        events = await hub.wait(cursor, timeout=SSE_KEEPALIVE)
+        if not events:
+            yield ": keepalive\n\n"
+            continue
+        for event in events:
+            cursor = event["id"]
+            yield f"id: {cursor}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@require_http_methods(["GET"])
+async def orders_events(request):
+    # живая лента для кухни/курьеров вместо обновления списка в админке; только staff
+    # Accept: text/event-stream — SSE (под ASGI), иначе long-poll: ждем до ?timeout= сек
+    # курсор — Last-Event-ID или ?cursor=; без него отдаем только новые события
+    user = await request.auser()
+    if not user.is_staff:
+        return JsonResponse({"ok": False, "error": "Forbidden"}, status=403)
+    hub = get_hub()
+
+    cursor = request.headers.get("Last-Event-ID") or request.GET.get("cursor")
+    try:
+        cursor = int(cursor) if cursor not in (None, "") else await hub.current_cursor()
+        timeout = min(max(float(request.GET.get("timeout", ORDER_EVENTS_MAX_WAIT)), 0), ORDER_EVENTS_MAX_WAIT)
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "cursor and timeout must be numbers"}, status=400)
+
+    # под WSGI асинхронный поток собрался бы в память целиком — там только long-poll
+    if "text/event-stream" in request.headers.get("Accept", "") and isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(_sse_events(hub, cursor), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    events = await hub.wait(cursor, timeout=timeout)
+    return JsonResponse({"ok": True, "events": events, "cursor": events[-1]["id"] if events else cursor})
+
 @require_http_methods(["GET"])
 def order_get(request, order_id: int):
     order = Order.objects.prefetch_related("items").filter(pk=order_id).first()
     if not order:
-        return JsonResponse({"ok": False, "error": "Order not found"}, status=404)
+        # старые заказы archive_orders переносит в архив — отдаем оттуда
+        record = load_archived_order(order_id)
+        if record is None:
+            return JsonResponse({"ok": False, "error": "Order not found"}, status=404)
+        return JsonResponse({"ok": True, "order": archived_order_to_dict(record)})
     return JsonResponse({"ok": True, "order": order_to_dict(order)})
 
 @require_http_methods(["POST"])
@@ -112,6 +367,6 @@ def simulate_paid(request):
     order = Order.objects.filter(pk=order_id).first()
     if not order:
         return JsonResponse({"ok": False, "error": "Order not found"}, status=404)
-    order.payment_status = Order.PaymentStatus.PAID
-    order.save(update_fields=["payment_status"])
-    return JsonResponse({"ok": True, "order_id": order.id, "payment_status": order.payment_status})
+    # через общий сервис — с записью в историю; уже оплаченный заказ просто пропускается
+    set_payment_status([order.id], Order.PaymentStatus.PAID)
+    return JsonResponse({"ok": True, "order_id": order.id, "payment_status": Order.PaymentStatus.PAID})
@@ -0,0 +1,135 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from core.money import MINOR_PER_UNIT, div_round_half_even, format_minor, from_minor, to_minor, to_scaled
+
+
+# --- прежняя Decimal-арифметика (как было в builder/cart/orders) ---
+
+def _legacy_build(product_price, mult, base_price, lines, free_sauces):
+    total = Decimal("0")
+    total += Decimal(str(product_price)) * mult
+    total += Decimal(str(base_price))
+    free_left = free_sauces
+    added_list = []
+    for price, qty, is_sauce in lines:
+        unit = Decimal(str(price))
+        added = Decimal("0")
+        if is_sauce:
+            free_now = min(free_left, qty)
+            paid_now = qty - free_now
+            free_left -= free_now
+            if paid_now > 0:
+                added = unit * Decimal(paid_now)
+        else:
+            added = unit * Decimal(qty)
+        total += added
+        added_list.append(str(added))
+    return str(total.quantize(Decimal("1"))), added_list
+
+
+def _legacy_cart(totals):
+    subtotal = Decimal("0")
+    for t in totals:
+        subtotal += Decimal(str(t))
+    return str(subtotal)
+
+
+# --- новый путь: сборка на целых тиынах (цены уже в тиынах, как в каталоге) ---
+
+def _minor_build(product_minor, mult_num, mult_exp, base_minor, lines, free_sauces):
+    rest = base_minor
+    free_left = free_sauces
+    added_list = []
+    for price_minor, qty, is_sauce in lines:
+        if is_sauce:
+            free_now = min(free_left, qty)
+            paid_now = qty - free_now
+            free_left -= free_now
+        else:
+            paid_now = qty
+        if paid_now > 0:
+            added = price_minor * paid_now
+            rest += added
+            added_list.append(format_minor(added))
+        else:
+            added_list.append("0")
+    scale = 10 ** mult_exp
+    units = div_round_half_even(product_minor * mult_num + rest * scale, MINOR_PER_UNIT * scale)
+    return str(units), added_list
+
+
+def _direct_cart(totals):
+    # строки корзины и так Decimal из БД — складываем без Decimal(str(x))
+    subtotal = Decimal("0")
+    for t in totals:
+        subtotal += t
+    return str(subtotal)
+
+
+def _money(rng, hi):
+    return from_minor(rng.randrange(0, hi * MINOR_PER_UNIT, 5))
+
+
+class Command(BaseCommand):
+    help = "Benchmark integer-minor build pricing and cart sums against the legacy Decimal path"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20000)
+        parser.add_argument("--lines", type=int, default=8, help="ингредиентов / строк корзины на операцию")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        n = options["iterations"]
+        n_lines = options["lines"]
+
+        cases = []
+        for _ in range(500):
+            mult = rng.choice([Decimal("1.0"), Decimal("1.5"), Decimal("2.0"), Decimal("1.25"), Decimal("0.75")])
+            lines = [(_money(rng, 500), rng.randint(1, 5), rng.random() < 0.3) for _ in range(n_lines)]
+            totals = [_money(rng, 5000) for _ in range(n_lines)]
+            cases.append({
+                "product": _money(rng, 3000), "mult": mult, "base": _money(rng, 300),
+                "lines": lines, "totals": totals,
+                "free": rng.randint(0, 3),
+            })
+
+        # сначала убеждаемся, что результаты совпадают бит в бит
+        for c in cases:
+            mult_num, mult_exp = to_scaled(c["mult"])
+            minor_lines = [(to_minor(p), q, s) for p, q, s in c["lines"]]
+            legacy = _legacy_build(c["product"], c["mult"], c["base"], c["lines"], c["free"])
+            fresh = _minor_build(to_minor(c["product"]), mult_num, mult_exp, to_minor(c["base"]), minor_lines, c["free"])
+            assert legacy == fresh, (c, legacy, fresh)
+            assert _legacy_cart(c["totals"]) == _direct_cart(c["totals"])
+
+        prepared = []
+        for c in cases:
+            mult_num, mult_exp = to_scaled(c["mult"])
+            prepared.append((to_minor(c["product"]), mult_num, mult_exp, to_minor(c["base"]),
+                             [(to_minor(p), q, s) for p, q, s in c["lines"]], c["free"]))
+
+        def bench(fn):
+            started = time.perf_counter()
+            for i in range(n):
+                fn(i % len(cases))
+            return (time.perf_counter() - started) / n * 1e6
+
+        rows = [
+            ("build",
+             bench(lambda i: _legacy_build(cases[i]["product"], cases[i]["mult"], cases[i]["base"], cases[i]["lines"], cases[i]["free"])),
+             bench(lambda i: _minor_build(*prepared[i]))),
+            ("cart",
+             bench(lambda i: _legacy_cart(cases[i]["totals"])),
+             bench(lambda i: _direct_cart(cases[i]["totals"]))),
+        ]
+
+        self.stdout.write(f"{'workload':<10}{'legacy, us':>14}{'new, us':>12}{'saved':>9}")
+        for name, legacy_us, minor_us in rows:
+            saved = (1 - minor_us / legacy_us) * 100 if legacy_us else 0
+            self.stdout.write(f"{name:<10}{legacy_us:>14.2f}{minor_us:>12.2f}{saved:>8.1f}%")
+        self.stdout.write(self.style.SUCCESS(f"Results identical on {len(cases)} random cases."))
@@ -0,0 +1,320 @@
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from builder.models import BaseOption, RuleSet, SizeOption
+from builder.pricing import bump_catalog_version, get_catalog
+from builder.services import _result_cache, calculate_build, price_cache_info
+from cart import services as cart_services
+from cart.models import Cart
+from catalog.models import Allergen, Ingredient, IngredientCategory, Product, ProductCategory, recompute_allergen_masks
+from orders.services import create_order_from_cart
+
+WORKLOADS = ("build", "cart", "checkout")
+
+# доли операций в cart-нагрузке
+CART_MIX = (("add_builder", 40), ("add_product", 20), ("update_qty", 25), ("remove", 15))
+CART_OPS_PER_SESSION = 20
+
+CHECKOUT_PAYLOAD = {"delivery_type": "PICKUP", "phone": "+77000000000", "name": "Bench"}
+
+
+class QueryCounter:
+    """execute_wrapper: считает запросы, не включая debug-курсор."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                             cwd=settings.BASE_DIR)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _percentile(sorted_values, q):
+    # ближайший ранг; на малых выборках честнее интерполяции
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+class Command(BaseCommand):
+    help = "Benchmark calculate_build, cart and checkout services on synthetic catalogs in a throwaway test DB"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ingredients", default="10,200,2000",
+                            help="размеры синтетических каталогов через запятую")
+        parser.add_argument("--allergens", type=int, default=40)
+        parser.add_argument("--products", type=int, default=30)
+        parser.add_argument("--workloads", default=",".join(WORKLOADS))
+        parser.add_argument("--ops", type=int, default=2000, help="замеряемых операций на нагрузку")
+        parser.add_argument("--warmup", type=int, default=100)
+        parser.add_argument("--distinct-builds", type=int, default=500,
+                            help="сколько разных сборок в пуле (влияет на попадания в LRU)")
+        parser.add_argument("--checkout-lines", type=int, default=5)
+        parser.add_argument("--no-result-cache", action="store_true", help="выключить LRU результатов сборки")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--output", help="куда записать JSON с результатами")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(x) for x in options["ingredients"].split(",") if x.strip()]
+        except ValueError:
+            raise CommandError("--ingredients: ожидается список чисел, например 10,200,2000")
+        workloads = [w.strip() for w in options["workloads"].split(",") if w.strip()]
+        unknown = set(workloads) - set(WORKLOADS)
+        if unknown:
+            raise CommandError(f"Неизвестные нагрузки: {', '.join(sorted(unknown))}")
+        if not 0 < options["allergens"] <= 62:
+            raise CommandError("--allergens: от 1 до 62")
+
+        results = []
+        # свой LocMem-кэш: версия каталога бенчмарка не должна задевать общий кэш сервера
+        bench_caches = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                    "LOCATION": "bench-pricing"}}
+        with override_settings(CACHES=bench_caches, PRICING_CATALOG_CHECK_INTERVAL=0), self._test_db(), \
+                self._result_cache(not options["no_result_cache"]):
+            for n_ingredients in sizes:
+                rng = random.Random(options["seed"])
+                call_command("flush", interactive=False, verbosity=0)
+                self._make_catalog(rng, n_ingredients, options["allergens"], options["products"])
+                builds = self._make_builds(rng, options["distinct_builds"])
+                for workload in workloads:
+                    row = getattr(self, f"_bench_{workload}")(rng, builds, options)
+                    row = {"ingredients": n_ingredients, "workload": workload, **row}
+                    results.append(row)
+                    self._print_row(row)
+
+        report = {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "db_vendor": connection.vendor,
+            "options": {k: options[k] for k in ("allergens", "products", "ops", "warmup", "distinct_builds",
+                                                "checkout_lines", "no_result_cache", "seed")},
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as fh:
+                json.dump(report, fh, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    # --- окружение ---
+
+    @contextmanager
+    def _test_db(self):
+        # отдельная тестовая БД (для SQLite — в памяти), рабочая БД не трогается
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    @contextmanager
+    def _result_cache(self, enabled):
+        maxsize = _result_cache.maxsize
+        if not enabled:
+            _result_cache.maxsize = 0
+        _result_cache.clear()
+        try:
+            yield
+        finally:
+            _result_cache.maxsize = maxsize
+            _result_cache.clear()
+
+    # --- синтетический каталог ---
+
+    def _make_catalog(self, rng, n_ingredients, n_allergens, n_products):
+        RuleSet.objects.create(name="Bench", free_sauces=2, max_sauces_total=4, max_meat_items=2)
+        SizeOption.objects.bulk_create([
+            SizeOption(code="1.0", name="Small", base_price=990),
+            SizeOption(code="1.5", name="Medium", base_price=1290),
+            SizeOption(code="2.0", name="Large", base_price=1590),
+        ])
+        BaseOption.objects.bulk_create([
+            BaseOption(name="Лаваш", price=0),
+            BaseOption(name="Пита", price=100),
+            BaseOption(name="Сырный лаваш", price="150.50"),
+        ])
+        allergens = Allergen.objects.bulk_create([
+            Allergen(code=f"A{i:02d}", name=f"Аллерген {i}", bit=i) for i in range(n_allergens)
+        ])
+
+        types = [Ingredient.Type.MEAT, Ingredient.Type.VEG, Ingredient.Type.SAUCE, Ingredient.Type.EXTRA]
+        categories = IngredientCategory.objects.bulk_create([
+            IngredientCategory(name=f"Категория {t.label}", sort_order=10 * (i + 1)) for i, t in enumerate(types)
+        ])
+        ingredients = Ingredient.objects.bulk_create([
+            Ingredient(
+                name=f"Ингредиент {i}",
+                category=categories[i % len(types)],
+                type=types[i % len(types)],
+                price=f"{rng.randrange(0, 500)}.{rng.choice(['00', '50', '90'])}",
+                grams=rng.randrange(10, 150),
+                calories=rng.randrange(0, 400),
+                is_spicy=rng.random() < 0.1,
+            )
+            for i in range(n_ingredients)
+        ])
+        through = Ingredient.allergens.through
+        through.objects.bulk_create([
+            through(ingredient_id=ing.id, allergen_id=a.id)
+            for ing in ingredients
+            for a in rng.sample(allergens, rng.choice((0, 0, 1, 1, 2, 3)))
+        ])
+        recompute_allergen_masks(ing.id for ing in ingredients)
+
+        product_category = ProductCategory.objects.create(name="Bench")
+        Product.objects.bulk_create([
+            Product(name=f"Товар {i}", category=product_category, price=f"{rng.randrange(200, 3000)}.00")
+            for i in range(n_products)
+        ])
+        # bulk_create сигналов не шлет
+        bump_catalog_version()
+
+    def _make_builds(self, rng, count):
+        cat = get_catalog()
+        by_type = {}
+        for ing in cat.ingredients.values():
+            by_type.setdefault(ing.type, []).append(ing.id)
+        products, sizes, bases = list(cat.products), list(cat.sizes), list(cat.bases)
+
+        def pick(type_, hi):
+            pool = by_type.get(type_, [])
+            return rng.sample(pool, min(len(pool), rng.randint(0, hi)))
+
+        builds = []
+        for _ in range(count):
+            # мясо и соусы по одной порции — сборка укладывается в правила
+            extras = pick(Ingredient.Type.VEG, 4) + pick(Ingredient.Type.EXTRA, 2)
+            ids = pick(Ingredient.Type.MEAT, 2) + pick(Ingredient.Type.SAUCE, 3) + extras
+            rng.shuffle(ids)
+            builds.append({
+                "product_id": rng.choice(products),
+                "size_id": rng.choice(sizes),
+                "base_id": rng.choice(bases),
+                "ingredient_ids": ids,
+                "quantities": {str(i): rng.randint(1, 3) for i in extras if rng.random() < 0.3},
+            })
+        return builds
+
+    # --- нагрузки ---
+
+    def _measure(self, n_ops, warmup, op, prepare=None):
+        """Гоняет op() n_ops раз; prepare() (если есть) не попадает в замер."""
+        for _ in range(warmup):
+            if prepare:
+                prepare()
+            op()
+
+        counter = QueryCounter()
+        timings = []
+        for _ in range(n_ops):
+            if prepare:
+                prepare()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                op()
+                timings.append(time.perf_counter() - started)
+
+        total = sum(timings)
+        timings.sort()
+        return {
+            "ops": n_ops,
+            "ops_per_sec": round(n_ops / total, 1) if total else None,
+            "mean_ms": round(statistics.fmean(timings) * 1000, 4),
+            "p50_ms": round(_percentile(timings, 50) * 1000, 4),
+            "p95_ms": round(_percentile(timings, 95) * 1000, 4),
+            "p99_ms": round(_percentile(timings, 99) * 1000, 4),
+            "queries_per_op": round(counter.count / n_ops, 2),
+        }
+
+    def _bench_build(self, rng, builds, options):
+        before = price_cache_info()
+        row = self._measure(options["ops"], options["warmup"], lambda: calculate_build(rng.choice(builds)))
+        after = price_cache_info()
+        lookups = (after["hits"] - before["hits"]) + (after["misses"] - before["misses"])
+        row["result_cache_hit_rate"] = round((after["hits"] - before["hits"]) / lookups, 4) if lookups else None
+        return row
+
+    def _bench_cart(self, rng, builds, options):
+        product_ids = list(get_catalog().products)
+        actions = [name for name, _ in CART_MIX]
+        weights = [w for _, w in CART_MIX]
+        state = {"cart": None, "ops": 0}
+
+        def prepare():
+            if state["cart"] is None or state["ops"] >= CART_OPS_PER_SESSION:
+                state["cart"] = Cart.objects.create(session_key=f"bench-{rng.random()}")
+                state["ops"] = 0
+            state["ops"] += 1
+            cart = state["cart"]
+            action = rng.choices(actions, weights)[0]
+            item_id = None
+            if action in ("update_qty", "remove"):
+                item_id = cart.items.values_list("id", flat=True).order_by("?").first()
+                if item_id is None:
+                    action = "add_builder"
+            state["next"] = (cart, action, item_id)
+
+        def op():
+            cart, action, item_id = state["next"]
+            if action == "add_builder":
+                cart_services.add_builder_item(cart, rng.choice(builds), rng.randint(1, 3))
+            elif action == "add_product":
+                cart_services.add_product_item(cart, rng.choice(product_ids), rng.randint(1, 3))
+            elif action == "update_qty":
+                cart_services.update_item_qty(cart, item_id, rng.randint(1, 5))
+            else:
+                cart_services.remove_item(cart, item_id)
+
+        return self._measure(options["ops"], options["warmup"], op, prepare)
+
+    def _bench_checkout(self, rng, builds, options):
+        state = {}
+
+        def prepare():
+            cart = Cart.objects.create(session_key=f"bench-{rng.random()}")
+            added = 0
+            while added < options["checkout_lines"]:
+                if cart_services.add_builder_item(cart, rng.choice(builds)).get("ok"):
+                    added += 1
+            state["cart"] = cart
+
+        def op():
+            result = create_order_from_cart(state["cart"], CHECKOUT_PAYLOAD)
+            if not result.get("ok"):
+                raise CommandError(f"checkout failed: {result}")
+
+        # оформление дороже остального — меньше операций, чтобы прогон не растягивался
+        n_ops = max(1, options["ops"] // 10)
+        return self._measure(n_ops, max(1, options["warmup"] // 10), op, prepare)
+
+    def _print_row(self, row):
+        self.stdout.write(
+            f"{row['ingredients']:>6} ingr  {row['workload']:<9}"
+            f"{row['ops_per_sec'] or 0:>11.1f} ops/s"
+            f"  p50 {row['p50_ms']:>8.3f} ms  p95 {row['p95_ms']:>8.3f} ms  p99 {row['p99_ms']:>8.3f} ms"
+            f"  {row['queries_per_op']:>6.2f} q/op"
+        )
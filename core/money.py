@@ -0,0 +1,62 @@
+# core/money.py
+"""Деньги в целых тиынах (1 тенге = 100 тиын).
+
+Цены каталога переводятся в тиыны один раз при компиляции (builder.pricing),
+поэтому расчет сборки идет на int, а в str переводится только при
+сериализации. Округление повторяет Decimal-вариант бит в бит: quantize()
+в контексте по умолчанию использует ROUND_HALF_EVEN.
+
+Для значений, которые и так приходят из БД как Decimal (строки корзины и
+заказа), перевод в int дороже самого сложения — там суммируем Decimal
+напрямую, без Decimal(str(x)). См. manage.py bench_money.
+"""
+from __future__ import annotations
+
+from decimal import Decimal
+
+MINOR_PER_UNIT = 100
+
+
+def to_minor(value) -> int:
+    """Decimal/int/str с точностью до тиына → целые тиыны."""
+    if isinstance(value, int):
+        return value * MINOR_PER_UNIT
+    d = value if isinstance(value, Decimal) else Decimal(str(value))
+    scaled = d * MINOR_PER_UNIT
+    minor = int(scaled)
+    if minor != scaled:
+        raise ValueError(f"{value!r} точнее одного тиына")
+    return minor
+
+
+def from_minor(minor: int) -> Decimal:
+    """Целые тиыны → Decimal с двумя знаками (как у DecimalField(decimal_places=2))."""
+    return Decimal(minor).scaleb(-2)
+
+
+def format_minor(minor: int) -> str:
+    """То же, что str(from_minor(minor)), но без создания Decimal."""
+    sign = "-" if minor < 0 else ""
+    units, cents = divmod(abs(minor), MINOR_PER_UNIT)
+    return f"{sign}{units}.{cents:02d}"
+
+
+def to_scaled(value: Decimal) -> tuple:
+    """Decimal → (num, exp), где value == num * 10**-exp и exp >= 0."""
+    sign, digits, exponent = value.as_tuple()
+    num = int("".join(map(str, digits)) or "0")
+    if sign:
+        num = -num
+    if exponent >= 0:
+        return num * 10 ** exponent, 0
+    return num, -exponent
+
+
+def div_round_half_even(numerator: int, denominator: int) -> int:
+    """numerator / denominator с банковским округлением до целого (denominator > 0)."""
+    q, r = divmod(numerator, denominator)
+    twice = 2 * r
+    if twice > denominator or (twice == denominator and q % 2):
+        q += 1
+    return q
+
@@ -65,6 +65,37 @@ DATABASES = {
     }
 }
 
+# Общий кэш между воркерами: версия каталога цен и т.п.
+# Локально — файловый, в проде можно указать redis/memcached через env.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("DJANGO_CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": os.getenv("DJANGO_CACHE_LOCATION", str(BASE_DIR / ".cache")),
+    }
+}
+
+# Как часто (сек) воркер сверяет свою копию каталога цен с общей версией
+PRICING_CATALOG_CHECK_INTERVAL = float(os.getenv("PRICING_CATALOG_CHECK_INTERVAL", "1.0"))
+
+# Сколько результатов calculate_build держать в LRU на процесс (0 — выключить)
+BUILD_PRICE_CACHE_SIZE = int(os.getenv("BUILD_PRICE_CACHE_SIZE", "2048"))
+
+# Корзины анонимов: "db" — Cart/CartItem, "cache" — в CACHES до оформления заказа или входа
+CART_STORE = os.getenv("CART_STORE", "db")
+CART_CACHE_TIMEOUT = int(os.getenv("CART_CACHE_TIMEOUT", str(7 * 24 * 3600)))
+
+# Сколько секунд помнить ответ на checkout с Idempotency-Key (чистит purge_idempotency_keys)
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 3600)))
+
+# Лента событий заказов: откуда воркеры дочитывают события, как часто опрашивают источник
+# и сколько секунд ждать id, закоммиченный не по порядку
+ORDER_EVENTS_BACKEND = os.getenv("ORDER_EVENTS_BACKEND", "orders.events.DatabaseEventBackend")
+ORDER_EVENTS_POLL_INTERVAL = float(os.getenv("ORDER_EVENTS_POLL_INTERVAL", "1.0"))
+ORDER_EVENTS_GAP_WAIT = float(os.getenv("ORDER_EVENTS_GAP_WAIT", "2.0"))
+
+# Куда archive_orders складывает сегменты архива заказов (*.jsonl.gz)
+ORDER_ARCHIVE_DIR = os.getenv("ORDER_ARCHIVE_DIR", str(BASE_DIR / "archive" / "orders"))
+
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
     {"NAME": "django.contrib.auth.password_validation.MinimumLengthValidator"},
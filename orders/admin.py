@@ -1,5 +1,14 @@
-from django.contrib import admin
-from .models import Order, OrderItem, OrderStatusHistory, PromoCode
+import json
+
+from django.contrib import admin, messages
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.http import HttpResponseRedirect
+from django.shortcuts import redirect
+from django.utils.html import format_html, format_html_join
+from .archive import load_archived_order
+from .models import ArchivedOrder, IdempotencyKey, Order, OrderItem, OrderStatusHistory, PromoCode
+from .services import fold_promo_counters, save_order_fields, set_payment_status, transition_orders
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -9,7 +18,7 @@ class OrderItemInline(admin.TabularInline):
 class OrderHistoryInline(admin.TabularInline):
     model = OrderStatusHistory
     extra = 0
-    readonly_fields = ("from_status", "to_status", "by_user", "created_at")
+    readonly_fields = ("kind", "from_status", "to_status", "by_user", "created_at")
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
@@ -19,12 +28,53 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderItemInline, OrderHistoryInline]
     actions = ["mark_confirmed", "mark_cooking", "mark_ready", "mark_out_for_delivery", "mark_completed", "mark_canceled", "mark_paid"]
 
+    def change_view(self, request, object_id, form_url="", extra_context=None):
+        # заказ мог уехать в архив (archive_orders) — показываем его оттуда
+        if (
+            object_id.isdigit()
+            and not Order.objects.filter(pk=object_id).exists()
+            and ArchivedOrder.objects.filter(pk=object_id).exists()
+        ):
+            return redirect("admin:orders_archivedorder_change", object_id)
+        return super().change_view(request, object_id, form_url, extra_context)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            return
+        # статусы переводим сервисами, как и действия ниже: с проверкой перехода, историей и сводками;
+        # остальное — только измененные поля, чтобы не затереть статус, который успели сменить параллельно
+        moves = {field: getattr(obj, field) for field in ("status", "payment_status") if field in form.changed_data}
+        fields = [field for field in form.changed_data if field not in moves]
+        if fields:
+            save_order_fields(obj, fields)
+        applied = True
+        if "status" in moves:
+            applied &= self._report(request, transition_orders([obj.pk], moves["status"], by_user=request.user))
+        if "payment_status" in moves:
+            applied &= self._report(request, set_payment_status([obj.pk], moves["payment_status"], by_user=request.user))
+        obj._status_rejected = not applied
+
+    def response_change(self, request, obj):
+        # сервис отказал в переходе — причину уже показали, «изменен успешно» не пишем
+        if getattr(obj, "_status_rejected", False):
+            return HttpResponseRedirect(request.path)
+        return super().response_change(request, obj)
+
+    def _report(self, request, result) -> bool:
+        """Сообщения по итогу сервиса; True — применено ко всем заказам."""
+        if not result["ok"]:
+            self.message_user(request, result["error"], level=messages.ERROR)
+            return False
+        self.message_user(request, f"Обновлено заказов: {len(result['updated'])}.")
+        if result["skipped"]:
+            details = ", ".join(f"#{s['id']}: {s['error']}" for s in result["skipped"][:10])
+            self.message_user(request, f"Пропущено {len(result['skipped'])}: {details}", level=messages.WARNING)
+        return not result["skipped"]
+
     def _set_status(self, request, queryset, status):
-        for order in queryset:
-            old = order.status
-            order.status = status
-            order.save(update_fields=["status"])
-            OrderStatusHistory.objects.create(order=order, from_status=old, to_status=status, by_user=request.user)
+        ids = list(queryset.values_list("id", flat=True))
+        self._report(request, transition_orders(ids, status, by_user=request.user))
 
     def mark_confirmed(self, request, queryset):
         self._set_status(request, queryset, Order.Status.CONFIRMED)
@@ -45,10 +95,73 @@ class OrderAdmin(admin.ModelAdmin):
         self._set_status(request, queryset, Order.Status.CANCELED)
 
     def mark_paid(self, request, queryset):
-        queryset.update(payment_status=Order.PaymentStatus.PAID)
+        ids = list(queryset.values_list("id", flat=True))
+        self._report(request, set_payment_status(ids, Order.PaymentStatus.PAID, by_user=request.user))
 
 @admin.register(PromoCode)
 class PromoCodeAdmin(admin.ModelAdmin):
-    list_display = ("code", "discount_type", "value", "active", "valid_from", "valid_to", "usage_limit", "used_count", "min_order_total")
+    list_display = ("code", "discount_type", "value", "active", "valid_from", "valid_to", "usage_limit", "used_total", "min_order_total")
     list_filter = ("active", "discount_type")
     search_fields = ("code",)
+    readonly_fields = ("used_count",)
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        return qs.annotate(used_total_value=F("used_count") + Coalesce(Sum("counter_shards__count"), 0))
+
+    @admin.display(description="Использован", ordering="used_total_value")
+    def used_total(self, obj):
+        return obj.used_total_value
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if obj.usage_limit is not None:
+            # лимит проверяется только по used_count — сворачиваем накопленные полосы
+            fold_promo_counters([obj.pk])
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ("key", "owner", "status_code", "created_at", "expires_at")
+    search_fields = ("key", "owner")
+    readonly_fields = ("owner", "key", "fingerprint", "status_code", "response_json", "created_at", "expires_at")
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ("id", "created_at", "status", "payment_status", "phone", "total", "segment")
+    list_filter = ("status", "payment_status")
+    search_fields = ("id", "phone")
+    date_hierarchy = "created_at"
+    fields = ("id", "created_at", "status", "payment_status", "phone", "total",
+              "details", "items", "history", "segment", "offset", "length", "archived_at")
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None:
+            obj.record = load_archived_order(obj.pk) or {"order": {}, "items": [], "history": []}
+        return obj
+
+    @admin.display(description="Заказ")
+    def details(self, obj):
+        order = obj.record["order"]
+        return format_html("<pre>{}</pre>", json.dumps(order, ensure_ascii=False, indent=2))
+
+    @admin.display(description="Строки")
+    def items(self, obj):
+        return format_html_join(
+            "\n", "<div>{} × {} = {}</div>",
+            ((i["title"], i["quantity"], i["total_price"]) for i in obj.record["items"]),
+        )
+
+    @admin.display(description="История")
+    def history(self, obj):
+        return format_html_join(
+            "\n", "<div>{}: {} {} → {}</div>",
+            ((h["created_at"], h["kind"], h["from_status"] or "—", h["to_status"]) for h in obj.record["history"]),
+        )
@@ -0,0 +1,167 @@
+# orders/archive.py
+"""Холодный архив заказов: сжатые JSONL-сегменты + индекс ArchivedOrder.
+
+archive_orders переносит завершенные и отмененные заказы пачками. Пачка —
+одна строка JSON на заказ (поля заказа, строки, история), сжатая отдельным
+gzip-блоком и дописанная в конец текущего сегмента; сегмент целиком остается
+обычным gzip-файлом (zcat читает все блоки подряд). Дописанное не меняется,
+новый сегмент начинается, когда текущий дорос до SEGMENT_MAX_BYTES.
+
+Чтобы прочитать заказ, по индексу находим блок и распаковываем только его.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ArchivedOrder, Order, OrderEvent, OrderItem, OrderStatusHistory
+
+ARCHIVE_STATUSES = (Order.Status.COMPLETED, Order.Status.CANCELED)
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+SEGMENT_PREFIX = "orders-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+LOCK_NAME = ".archive.lock"
+
+
+def archive_dir() -> Path:
+    return Path(settings.ORDER_ARCHIVE_DIR)
+
+
+def _json_default(value):
+    # без округления микросекунд, как у DjangoJSONEncoder: архив должен хранить значения как есть
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _current_segment(directory: Path) -> Path:
+    segments = sorted(directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))
+    if segments and segments[-1].stat().st_size < SEGMENT_MAX_BYTES:
+        return segments[-1]
+    number = int(segments[-1].name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1 if segments else 1
+    return directory / f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}"
+
+
+def append_block(records: list) -> tuple:
+    """Дописывает records одним gzip-блоком; (сегмент, смещение, длина)."""
+    directory = archive_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    lines = "".join(json.dumps(r, ensure_ascii=False, default=_json_default) + "\n" for r in records)
+    block = gzip.compress(lines.encode("utf-8"))
+    path = _current_segment(directory)
+    with open(path, "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(block)
+        f.flush()
+        os.fsync(f.fileno())  # индекс в БД коммитится после того, как блок уже на диске
+    return path.name, offset, len(block)
+
+
+def read_block(segment: str, offset: int, length: int) -> list:
+    with open(archive_dir() / segment, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return [json.loads(line) for line in gzip.decompress(data).decode("utf-8").splitlines()]
+
+
+class ArchiveLocked(Exception):
+    pass
+
+
+class ArchiveLock:
+    """Один archive_orders за раз: два писателя перепутали бы смещения в сегменте."""
+
+    def __init__(self):
+        self.path = archive_dir() / LOCK_NAME
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise ArchiveLocked(f"{self.path} exists: another archive_orders is running (or crashed — remove it)")
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return self
+
+    def __exit__(self, *exc):
+        self.path.unlink(missing_ok=True)
+
+
+@transaction.atomic
+def archive_chunk(order_ids) -> tuple:
+    """Переносит заказы в архив и удаляет их из горячих таблиц; (заказов, строк, записей истории).
+
+    Заказы блокируются и перепроверяются: статус успел смениться — заказ остается.
+    Если транзакция откатится после записи блока, в сегменте останется блок без
+    ссылок из индекса — место, но не данные.
+    """
+    orders = list(
+        Order.objects.select_for_update().filter(id__in=order_ids, status__in=ARCHIVE_STATUSES).order_by("id").values()
+    )
+    if not orders:
+        return 0, 0, 0
+    ids = [o["id"] for o in orders]
+    items, history = {}, {}
+    for row in OrderItem.objects.filter(order_id__in=ids).order_by("id").values():
+        items.setdefault(row["order_id"], []).append(row)
+    for row in OrderStatusHistory.objects.filter(order_id__in=ids).order_by("id").values():
+        history.setdefault(row["order_id"], []).append(row)
+
+    records = [{"order": o, "items": items.get(o["id"], []), "history": history.get(o["id"], [])} for o in orders]
+    segment, offset, length = append_block(records)
+    ArchivedOrder.objects.bulk_create([
+        ArchivedOrder(
+            id=o["id"], created_at=o["created_at"], status=o["status"], payment_status=o["payment_status"],
+            phone=o["phone"], total=o["total"], segment=segment, offset=offset, length=length,
+        )
+        for o in orders
+    ])
+
+    # зависимые строки отдельными DELETE, чтобы каскад у Order был пустым
+    OrderEvent.objects.filter(order_id__in=ids).delete()
+    deleted_history, _ = OrderStatusHistory.objects.filter(order_id__in=ids).delete()
+    deleted_items, _ = OrderItem.objects.filter(order_id__in=ids).delete()
+    Order.objects.filter(id__in=ids).delete()
+    return len(ids), deleted_items, deleted_history
+
+
+def load_archived_order(order_id) -> dict | None:
+    """Запись архива {"order", "items", "history"} или None, если заказа в архиве нет."""
+    entry = ArchivedOrder.objects.filter(pk=order_id).first()
+    if entry is None:
+        return None
+    records = read_block(entry.segment, entry.offset, entry.length)
+    return next((r for r in records if r["order"]["id"] == entry.id), None)
+
+
+def archived_order_to_dict(record: dict, with_items: bool = True) -> dict:
+    """То же, что orders.services.order_to_dict, но из записи архива; с "archived": True."""
+    order = record["order"]
+    data = {
+        field: order[field]
+        for field in ("id", "status", "payment_method", "payment_status", "delivery_type", "address", "phone",
+                      "subtotal", "discount_total", "delivery_fee", "total")
+    }
+    if with_items:
+        data["items"] = [
+            {
+                "title": i["title"],
+                "quantity": i["quantity"],
+                "unit_price": i["unit_price"],
+                "total_price": i["total_price"],
+                "snapshot": i["snapshot_json"],
+            } for i in record["items"]
+        ]
+    data["created_at"] = order["created_at"]
+    data["archived"] = True
+    return data
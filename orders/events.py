@@ -0,0 +1,181 @@
+# orders/events.py
+"""События заказов для живой ленты кухни (GET /api/orders/events/).
+
+Сервисы заказов пишут события через backend в той же транзакции, что и
+изменение, — это и есть межпроцессный канал: любой воркер дочитывает их
+по курсору. Backend по умолчанию — таблица OrderEvent (работает и на SQLite),
+подменяется настройкой ORDER_EVENTS_BACKEND.
+
+EventHub — один на процесс. Сколько бы клиентов ни ждало, backend опрашивает
+не больше одного из них раз в ORDER_EVENTS_POLL_INTERVAL; свежие события
+держатся в кольцевом буфере. Коммит в этом же процессе будит ожидающих сразу,
+не дожидаясь опроса.
+
+Курсор — id события, а id из последовательности (PostgreSQL) могут
+закоммититься не по порядку: пока транзакция с id 10 не закоммичена, 11 уже
+видно. Поэтому хаб не сдвигает курсор через дыру сразу: события за ней
+перечитываются, пока дыра не заполнится или не простоит
+ORDER_EVENTS_GAP_WAIT секунд (id из откаченной транзакции не появится никогда).
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import OrderEvent
+
+READ_LIMIT = 200  # событий за одно чтение
+
+
+class DatabaseEventBackend:
+    def publish(self, events: list) -> None:
+        OrderEvent.objects.bulk_create(events)
+
+    def last_id(self) -> int:
+        return OrderEvent.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+    def read_after(self, cursor: int, limit: int = READ_LIMIT) -> list:
+        # порядок коммитов тут не гарантирован — дыры в id разбирает EventHub
+        return [e.to_dict() for e in OrderEvent.objects.filter(id__gt=cursor).order_by("id")[:limit]]
+
+
+class EventHub:
+    def __init__(self, backend, poll_interval: float, buffer_size: int = 1000, gap_wait: float = 2.0):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.gap_wait = gap_wait
+        self._gap = None    # (первый недостающий id, с какого момента ждем)
+        self._buffer = deque(maxlen=buffer_size)
+        self._floor = None  # с этого курсора буфер полон; None — хаб еще не инициализирован
+        self._head = 0      # id последнего события, которое видел хаб
+        self._polled_at = 0.0
+        self._poll_lock = threading.Lock()
+        self._waiters = set()  # (loop, asyncio.Event)
+        self._waiters_lock = threading.Lock()
+
+    def notify(self) -> None:
+        """Разбудить ожидающих (можно из любого потока, например из on_commit)."""
+        self._polled_at = 0.0  # следующий ожидающий опросит backend сразу
+        self._wake()
+
+    def _wake(self) -> None:
+        with self._waiters_lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # цикл уже закрыт
+
+    def _refresh(self) -> None:
+        if time.monotonic() - self._polled_at < self.poll_interval or not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            if self._floor is None:
+                self._head = self._floor = self.backend.last_id()
+            events = self._settled(self.backend.read_after(self._head))
+            self._polled_at = time.monotonic()
+            if events:
+                self._buffer.extend(events)
+                self._head = events[-1]["id"]
+                if len(self._buffer) == self._buffer.maxlen:
+                    # старые события вытеснены — то, что раньше первого в буфере, читаем из backend
+                    self._floor = max(self._floor, self._buffer[0]["id"] - 1)
+        finally:
+            self._poll_lock.release()
+        if events:
+            self._wake()
+
+    def _settled(self, events: list) -> list:
+        """События после _head до первой дыры в id, которая ждет меньше gap_wait."""
+        expected = self._head + 1
+        for n, event in enumerate(events):
+            if event["id"] != expected:
+                now = time.monotonic()
+                if self._gap is None or self._gap[0] != expected:
+                    self._gap = (expected, now)
+                if now - self._gap[1] < self.gap_wait:
+                    # за дырой может быть незакоммиченная транзакция — отдаем только то, что до нее
+                    return events[:n]
+                self._gap = None
+            expected = event["id"] + 1
+        return events
+
+    def _buffered_after(self, cursor: int):
+        """События после cursor из буфера; None — буфер их уже не покрывает."""
+        if self._floor is None or cursor < self._floor:
+            return None
+        return [e for e in list(self._buffer) if e["id"] > cursor][:READ_LIMIT]
+
+    async def current_cursor(self) -> int:
+        await sync_to_async(self._refresh)()
+        return self._head
+
+    async def wait(self, cursor: int, timeout: float) -> list:
+        """События после cursor; если их нет — ждет до timeout секунд, потом []."""
+        deadline = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        while True:
+            await sync_to_async(self._refresh)()
+            events = self._buffered_after(cursor)
+            if events is None:
+                # клиент вернулся после долгого перерыва — дочитываем прямо из backend,
+                # но не дальше _head: за ним могут быть неразобранные дыры
+                events = await sync_to_async(self.backend.read_after)(cursor)
+                return [e for e in events if e["id"] <= self._head]
+            if events:
+                return events
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+
+            waiter = (loop, asyncio.Event())
+            with self._waiters_lock:
+                self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout=min(remaining, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._waiters_lock:
+                    self._waiters.discard(waiter)
+
+
+_hub_lock = threading.Lock()
+_hub: EventHub | None = None
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(getattr(settings, "ORDER_EVENTS_BACKEND", "orders.events.DatabaseEventBackend"))()
+    return _backend
+
+
+def get_hub() -> EventHub:
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = EventHub(
+                    get_backend(),
+                    float(getattr(settings, "ORDER_EVENTS_POLL_INTERVAL", 1.0)),
+                    gap_wait=float(getattr(settings, "ORDER_EVENTS_GAP_WAIT", 2.0)),
+                )
+    return _hub
+
+
+def record_events(events: list) -> None:
+    """Публикует события в текущей транзакции; ожидающих будим после коммита."""
+    if not events:
+        return
+    get_backend().publish(events)
+    transaction.on_commit(get_hub().notify)
@@ -0,0 +1,117 @@
+# orders/export.py
+"""Потоковая выгрузка заказов со строками (CSV / JSONL, по желанию gzip).
+
+Заказы и строки читаются двумя курсорами QuerySet.iterator(): заказы по id,
+строки по (order_id, id) — и склеиваются за один проход, как merge join.
+В памяти одновременно только текущий заказ и буфер вывода, поэтому расход
+памяти не зависит от размера выгрузки.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import zlib
+
+from .models import OrderItem
+
+EXPORT_FORMATS = ("csv", "jsonl")
+CHUNK_SIZE = 2000  # строк за один fetch из БД
+FLUSH_BYTES = 64 * 1024  # копим вывод до такого размера, потом отдаем
+
+ORDER_COLUMNS = (
+    "order_id", "created_at", "status", "payment_method", "payment_status", "delivery_type",
+    "subtotal", "discount_total", "delivery_fee", "total", "promo_code",
+)
+ITEM_COLUMNS = ("item_title", "item_quantity", "item_unit_price", "item_total_price")
+
+
+def iter_orders_with_items(orders, chunk_size: int = CHUNK_SIZE):
+    """(заказ, [строки]) для каждого заказа из orders, по возрастанию id."""
+    order_iter = orders.select_related("promo_code").order_by("id").iterator(chunk_size=chunk_size)
+    items = (
+        OrderItem.objects.filter(order__in=orders.values("id"))
+        .order_by("order_id", "id")
+        .iterator(chunk_size=chunk_size)
+    )
+    pending = next(items, None)
+    for order in order_iter:
+        # строки заказов, которых нет в первом курсоре (созданы во время выгрузки), пропускаем
+        while pending is not None and pending.order_id < order.id:
+            pending = next(items, None)
+        lines = []
+        while pending is not None and pending.order_id == order.id:
+            lines.append(pending)
+            pending = next(items, None)
+        yield order, lines
+
+
+def _order_values(order) -> dict:
+    return {
+        "order_id": order.id,
+        "created_at": order.created_at.isoformat(),
+        "status": order.status,
+        "payment_method": order.payment_method,
+        "payment_status": order.payment_status,
+        "delivery_type": order.delivery_type,
+        "subtotal": str(order.subtotal),
+        "discount_total": str(order.discount_total),
+        "delivery_fee": str(order.delivery_fee),
+        "total": str(order.total),
+        "promo_code": order.promo_code.code if order.promo_code else "",
+    }
+
+
+def _csv_chunks(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(ORDER_COLUMNS + ITEM_COLUMNS)
+    for order, lines in rows:
+        head = list(_order_values(order).values())
+        # одна строка CSV на строку заказа; заказ без строк — одна строка с пустыми колонками
+        for it in lines or (None,):
+            tail = [it.title, it.quantity, str(it.unit_price), str(it.total_price)] if it else [""] * len(ITEM_COLUMNS)
+            writer.writerow(head + tail)
+        if out.tell() >= FLUSH_BYTES:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+
+def _jsonl_chunks(rows):
+    buf, size = [], 0
+    for order, lines in rows:
+        record = _order_values(order)
+        record["items"] = [
+            {"title": it.title, "quantity": it.quantity, "unit_price": str(it.unit_price),
+             "total_price": str(it.total_price)}
+            for it in lines
+        ]
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        buf.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield "".join(buf)
+            buf, size = [], 0
+    yield "".join(buf)
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 — формат gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_orders(orders, fmt: str, compress: bool = False, chunk_size: int = CHUNK_SIZE):
+    """Итератор байтов выгрузки orders в формате fmt (см. EXPORT_FORMATS)."""
+    rows = iter_orders_with_items(orders, chunk_size=chunk_size)
+    chunks = (c.encode("utf-8") for c in (_csv_chunks(rows) if fmt == "csv" else _jsonl_chunks(rows)) if c)
+    return _gzip(chunks) if compress else chunks
+
+
+def export_filename(fmt: str, compress: bool) -> str:
+    return f"orders.{fmt}" + (".gz" if compress else "")
@@ -0,0 +1,63 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.archive import ARCHIVE_STATUSES, ArchiveLock, ArchiveLocked, archive_chunk, archive_dir
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = "Move completed/canceled orders older than N days (with items and history) to compressed JSONL segments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=180, help="архивировать заказы старше стольких дней")
+        parser.add_argument("--chunk-size", type=int, default=500, help="заказов на транзакцию и gzip-блок")
+        parser.add_argument("--sleep", type=float, default=0.0, help="пауза между пачками, сек")
+        parser.add_argument("--dry-run", action="store_true", help="только посчитать, ничего не переносить")
+
+    def handle(self, *args, **options):
+        if options["days"] < 1:
+            raise CommandError("--days must be >= 1")
+        chunk_size = max(1, options["chunk_size"])
+        pause = max(0.0, options["sleep"])
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        old = Order.objects.filter(status__in=ARCHIVE_STATUSES, created_at__lt=cutoff)
+
+        if options["dry_run"]:
+            self.stdout.write(f"Would archive {old.count()} orders created before {cutoff:%Y-%m-%d %H:%M}.")
+            return
+
+        try:
+            with ArchiveLock():
+                totals = self._archive(old, chunk_size, pause)
+        except ArchiveLocked as exc:
+            raise CommandError(str(exc))
+
+        orders, items, history, elapsed = totals
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {orders} orders, {items} lines, {history} history rows to {archive_dir()} in {elapsed:.2f}s."
+        ))
+
+    def _archive(self, old, chunk_size: int, pause: float) -> tuple:
+        # keyset по id: каждая пачка — один gzip-блок и одна короткая транзакция
+        total_orders = total_items = total_history = chunk = 0
+        last_id = 0
+        run_started = time.perf_counter()
+        while True:
+            ids = list(old.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            chunk += 1
+            started = time.perf_counter()
+            orders, items, history = archive_chunk(ids)
+            total_orders += orders
+            total_items += items
+            total_history += history
+            took = time.perf_counter() - started
+            self.stdout.write(f"  chunk {chunk}: {orders} orders, {items} lines, {history} history in {took * 1000:.1f} ms")
+            if pause:
+                time.sleep(pause)
+        return total_orders, total_items, total_history, time.perf_counter() - run_started
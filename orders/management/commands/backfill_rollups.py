@@ -0,0 +1,77 @@
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from orders.models import ArchivedOrder, Order
+from orders.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild hourly/daily sales rollups from orders, one short transaction per chunk of days"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="первый день, YYYY-MM-DD; по умолчанию день первого заказа")
+        parser.add_argument("--to", dest="date_to", help="последний день включительно; по умолчанию сегодня")
+        parser.add_argument("--chunk-days", type=int, default=1, help="суток на транзакцию")
+        parser.add_argument("--sleep", type=float, default=0.0, help="пауза между пачками, сек")
+
+    def handle(self, *args, **options):
+        first = self._date(options["date_from"], "--from")
+        if first is None:
+            created = Order.objects.order_by("created_at").values_list("created_at", flat=True).first()
+            if created is None:
+                self.stdout.write("No orders, nothing to rebuild.")
+                return
+            first = timezone.localtime(created).date()
+        last = self._date(options["date_to"], "--to") or timezone.localdate()
+        if last < first:
+            raise CommandError("--to must not be before --from")
+        # заказов из архива в Order уже нет: пересчет стер бы их из сводок, эти сутки не трогаем
+        archived = ArchivedOrder.objects.order_by("-created_at").values_list("created_at", flat=True).first()
+        if archived is not None and first <= timezone.localtime(archived).date():
+            first = timezone.localtime(archived).date() + timedelta(days=1)
+            self.stdout.write(f"Rollups up to {first - timedelta(days=1)} include archived orders, kept as is.")
+            if last < first:
+                return
+        chunk_days = max(1, options["chunk_days"])
+        pause = max(0.0, options["sleep"])
+
+        total_orders = total_rows = chunk = 0
+        run_started = time.perf_counter()
+        day = first
+        while day <= last:
+            # границы — локальные полуночи, как у суточных корзин
+            next_day = min(day + timedelta(days=chunk_days), last + timedelta(days=1))
+            chunk += 1
+            started = time.perf_counter()
+            orders, rows = rebuild_rollups(_midnight(day), _midnight(next_day))
+            total_orders += orders
+            total_rows += rows
+            took = time.perf_counter() - started
+            self.stdout.write(
+                f"  chunk {chunk} {day}..{next_day - timedelta(days=1)}: "
+                f"{orders} orders -> {rows} rollup rows in {took * 1000:.1f} ms"
+            )
+            day = next_day
+            if pause:
+                time.sleep(pause)
+
+        elapsed = time.perf_counter() - run_started
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt rollups for {total_orders} orders ({total_rows} rows) in {elapsed:.2f}s."
+        ))
+
+    def _date(self, raw, flag):
+        if not raw:
+            return None
+        day = parse_date(raw)
+        if day is None:
+            raise CommandError(f"{flag} must be a date YYYY-MM-DD")
+        return day
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
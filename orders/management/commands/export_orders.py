@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.export import CHUNK_SIZE, EXPORT_FORMATS, export_orders
+from orders.services import filter_orders
+
+
+class Command(BaseCommand):
+    help = "Stream orders with their items to CSV or JSONL (optionally gzip) without loading them into memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+        parser.add_argument("--from", dest="created_from", help="дата/время ISO, включительно")
+        parser.add_argument("--to", dest="created_to", help="дата/время ISO, не включительно")
+        parser.add_argument("--status", help="статусы через запятую")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--output", "-o", help="файл; по умолчанию stdout")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        orders, error = filter_orders({
+            "created_from": options["created_from"],
+            "created_to": options["created_to"],
+            "status": options["status"],
+        })
+        if error:
+            raise CommandError(error)
+
+        chunks = export_orders(orders, options["format"], options["gzip"], max(1, options["chunk_size"]))
+        out = open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+        try:
+            written = 0
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if options["output"]:
+                out.close()
+            else:
+                out.flush()
+        if options["output"]:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
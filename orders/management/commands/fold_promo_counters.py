@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from orders.services import fold_promo_counters
+
+
+class Command(BaseCommand):
+    help = "Fold sharded promo usage counters into PromoCode.used_count (run from cron)"
+
+    def handle(self, *args, **options):
+        moved = fold_promo_counters()
+        self.stdout.write(self.style.SUCCESS(f"Folded {moved} promo redemptions into used_count."))
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete expired checkout idempotency keys in short chunked transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--sleep", type=float, default=0.0, help="пауза между пачками, сек")
+        parser.add_argument("--dry-run", action="store_true", help="только посчитать, ничего не удалять")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options["chunk_size"])
+        expired = IdempotencyKey.objects.filter(expires_at__lt=timezone.now())
+        total = chunk = 0
+        last_id = 0
+        run_started = time.perf_counter()
+
+        while True:
+            ids = list(expired.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            chunk += 1
+            started = time.perf_counter()
+
+            if options["dry_run"]:
+                deleted = len(ids)
+            else:
+                with transaction.atomic():
+                    # expires_at проверяется еще раз: истекший ключ могли переиспользовать
+                    deleted, _ = expired.filter(id__in=ids).delete()
+
+            total += deleted
+            took = time.perf_counter() - started
+            self.stdout.write(f"  chunk {chunk}: {deleted} keys in {took * 1000:.1f} ms")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        elapsed = time.perf_counter() - run_started
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} expired idempotency keys in {elapsed:.2f}s."))
@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import OrderEvent
+
+
+class Command(BaseCommand):
+    help = "Delete order feed events older than N days in short chunked transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="клиенты с курсором старше не дочитают пропущенное")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="только посчитать, ничего не удалять")
+
+    def handle(self, *args, **options):
+        if options["days"] < 1:
+            raise CommandError("--days must be >= 1")
+        chunk_size = max(1, options["chunk_size"])
+        old = OrderEvent.objects.filter(created_at__lt=timezone.now() - timedelta(days=options["days"]))
+        total = last_id = 0
+        run_started = time.perf_counter()
+
+        while True:
+            ids = list(old.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            if options["dry_run"]:
+                deleted = len(ids)
+            else:
+                with transaction.atomic():
+                    deleted, _ = OrderEvent.objects.filter(id__in=ids).delete()
+            total += deleted
+            self.stdout.write(f"  {total} events so far")
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        elapsed = time.perf_counter() - run_started
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} order events in {elapsed:.2f}s."))
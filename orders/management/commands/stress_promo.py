@@ -0,0 +1,127 @@
+import os
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from cart import services as cart_services
+from cart.models import Cart
+from catalog.models import Product, ProductCategory
+from orders.models import Order, PromoCode, PromoCounterShard
+from orders.services import create_order_from_cart, fold_promo_counters, promo_usage
+
+CHECKOUT_PAYLOAD = {"phone": "+70000000000", "delivery_type": "PICKUP"}
+
+
+class Command(BaseCommand):
+    help = "Concurrent checkouts against a limited and an unlimited promo code in a throwaway test DB; fails on over-redemption"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--orders-per-thread", type=int, default=20)
+        parser.add_argument("--limit", type=int, default=37, help="usage_limit ограниченного промокода")
+
+    def handle(self, *args, **options):
+        threads = max(2, options["threads"])
+        per_thread = max(1, options["orders_per_thread"])
+        limit = max(1, options["limit"])
+
+        with self._test_db():
+            category = ProductCategory.objects.create(name="Stress")
+            product = Product.objects.create(name="Stress doner", category=category, price=Decimal("1990.00"))
+            PromoCode.objects.create(code="LIMITED", discount_type="PERCENT", value=Decimal("10"), usage_limit=limit)
+            PromoCode.objects.create(code="UNLIMITED", discount_type="FIXED", value=Decimal("100"))
+
+            failures = []
+            for code in ("LIMITED", "UNLIMITED"):
+                outcomes = self._run(code, product.id, threads, per_thread)
+                failures += self._verify(code, outcomes, threads * per_thread, limit)
+
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("No over-redemptions, counters match orders."))
+
+    @contextmanager
+    def _test_db(self):
+        # потокам нужна общая БД: для SQLite — временный файл вместо памяти,
+        # BEGIN IMMEDIATE и ожидание блокировки вместо мгновенного "database is locked"
+        settings_dict = connection.settings_dict
+        tmp_path = None
+        if connection.vendor == "sqlite":
+            fd, tmp_path = tempfile.mkstemp(suffix=".sqlite3")
+            os.close(fd)
+            settings_dict.setdefault("TEST", {})["NAME"] = tmp_path
+            settings_dict.setdefault("OPTIONS", {}).update(timeout=30, transaction_mode="IMMEDIATE")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _run(self, code: str, product_id: int, threads: int, per_thread: int) -> Counter:
+        outcomes = Counter()
+        lock = threading.Lock()
+        start = threading.Barrier(threads)
+
+        def worker(n):
+            local = Counter()
+            try:
+                # промокод читаем один раз до старта: used_count в нем устаревает, и лимит
+                # держит только условный UPDATE в reserve_promo — его и проверяем
+                promo = PromoCode.objects.get(code=code)
+                start.wait()
+                for i in range(per_thread):
+                    cart = Cart.objects.create(session_key=f"stress-{code}-{n}-{i}")
+                    cart_services.add_product_item(cart, product_id)
+                    try:
+                        result = create_order_from_cart(cart, CHECKOUT_PAYLOAD, promo=promo)
+                    except OperationalError as exc:
+                        local[f"db error: {exc}"] += 1
+                        continue
+                    if result.get("ok"):
+                        local["discounted" if result["order"]["discount_total"] != "0.00" else "full price"] += 1
+                    else:
+                        local[result["error"]] += 1
+            finally:
+                connection.close()
+                with lock:
+                    outcomes.update(local)
+
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        return outcomes
+
+    def _verify(self, code: str, outcomes: Counter, attempts: int, limit: int) -> list:
+        promo = PromoCode.objects.get(code=code)
+        orders = Order.objects.filter(promo_code=promo).count()
+        used = promo_usage(promo)
+        self.stdout.write(f"{code}: {attempts} checkouts, {dict(outcomes)}; orders with promo {orders}, used {used}")
+
+        failures = []
+        if used != orders:
+            failures.append(f"{code}: used {used} != orders with promo {orders}")
+        if outcomes["discounted"] != orders:
+            failures.append(f"{code}: {outcomes['discounted']} discounted responses, {orders} orders")
+        if promo.usage_limit is not None:
+            expected = min(limit, attempts)
+            if orders > promo.usage_limit:
+                failures.append(f"{code}: over-redeemed, {orders} orders for limit {promo.usage_limit}")
+            elif orders != expected:
+                failures.append(f"{code}: {orders} redemptions, expected {expected}")
+            if PromoCounterShard.objects.filter(promo=promo).exists():
+                failures.append(f"{code}: limited code must not use counter shards")
+        else:
+            fold_promo_counters([promo.pk])
+            promo.refresh_from_db()
+            if promo.used_count != orders:
+                failures.append(f"{code}: after fold used_count {promo.used_count} != {orders}")
+        return failures
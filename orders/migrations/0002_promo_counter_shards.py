@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromoCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('promo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='orders.promocode')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('promo', 'shard'), name='promo_counter_shard_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderstatushistory',
+            name='kind',
+            field=models.CharField(choices=[('STATUS', 'Статус заказа'), ('PAYMENT', 'Оплата')], default='STATUS', max_length=12),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grain', models.CharField(choices=[('HOUR', 'Час'), ('DAY', 'Сутки')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('title', models.CharField(max_length=200)),
+                ('status', models.CharField(max_length=24)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('grain', 'bucket', 'status', 'title'), name='item_rollup_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grain', models.CharField(choices=[('HOUR', 'Час'), ('DAY', 'Сутки')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('status', models.CharField(max_length=24)),
+                ('payment_status', models.CharField(max_length=12)),
+                ('payment_method', models.CharField(max_length=12)),
+                ('delivery_type', models.CharField(max_length=12)),
+                ('orders', models.IntegerField(default=0)),
+                ('subtotal', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('discount_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('delivery_fee', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('grain', 'bucket', 'status', 'payment_status', 'payment_method', 'delivery_type'), name='order_rollup_uniq')],
+            },
+        ),
+    ]
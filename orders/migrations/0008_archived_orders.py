@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('status', models.CharField(choices=[('NEW', 'Новый'), ('CONFIRMED', 'Подтвержден'), ('COOKING', 'Готовится'), ('READY', 'Готов'), ('OUT_FOR_DELIVERY', 'В доставке'), ('COMPLETED', 'Завершен'), ('CANCELED', 'Отменен')], max_length=24)),
+                ('payment_status', models.CharField(choices=[('UNPAID', 'Не оплачено'), ('PENDING', 'Ожидание'), ('PAID', 'Оплачено'), ('FAILED', 'Ошибка')], max_length=12)),
+                ('phone', models.CharField(max_length=32)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('segment', models.CharField(max_length=64)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
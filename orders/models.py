@@ -34,6 +34,25 @@ class PromoCode(models.Model):
     def __str__(self):
         return self.code
 
+class PromoCounterShard(models.Model):
+    """Полоса счетчика использований безлимитного промокода.
+
+    Заказы инкрементят случайную из SHARDS строк, а не PromoCode.used_count,
+    чтобы не выстраиваться в очередь за одной строкой. В used_count полосы
+    сворачивает orders.services.fold_promo_counters.
+    """
+    SHARDS = 8
+
+    promo = models.ForeignKey(PromoCode, on_delete=models.CASCADE, related_name="counter_shards")
+    shard = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["promo", "shard"], name="promo_counter_shard_uniq")]
+
+    def __str__(self):
+        return f"{self.promo_id}#{self.shard}"
+
 class Order(models.Model):
     class DeliveryType(models.TextChoices):
         DELIVERY = "DELIVERY", "Доставка"
@@ -84,6 +103,15 @@ class Order(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # GET /api/orders/: фильтр + keyset-пагинация по (created_at, id)
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="order_created_idx"),
+            models.Index(fields=["status", "created_at", "id"], name="order_status_created_idx"),
+            models.Index(fields=["payment_status", "created_at", "id"], name="order_payment_created_idx"),
+            models.Index(fields=["delivery_type", "created_at", "id"], name="order_delivery_created_idx"),
+        ]
+
     def __str__(self):
         return f"Order #{self.id}"
 
@@ -99,7 +127,12 @@ class OrderItem(models.Model):
         return self.title
 
 class OrderStatusHistory(models.Model):
+    class Kind(models.TextChoices):
+        STATUS = "STATUS", "Статус заказа"
+        PAYMENT = "PAYMENT", "Оплата"
+
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="status_history")
+    kind = models.CharField(max_length=12, choices=Kind.choices, default=Kind.STATUS)
     from_status = models.CharField(max_length=24)
     to_status = models.CharField(max_length=24)
     by_user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
@@ -107,3 +140,125 @@ class OrderStatusHistory(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+
+class OrderEvent(models.Model):
+    """Лента изменений заказов для кухни и курьеров (GET /api/orders/events/).
+
+    Пишется в одной транзакции с самим изменением; id служит курсором
+    (Last-Event-ID), по нему переподключившийся клиент дочитывает пропущенное.
+    """
+    class Kind(models.TextChoices):
+        CREATED = "order.created", "Новый заказ"
+        STATUS = "order.status", "Смена статуса"
+        PAYMENT = "order.payment", "Смена оплаты"
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="events")
+    kind = models.CharField(max_length=24, choices=Kind.choices)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "type": self.kind,
+            "order_id": self.order_id,
+            **self.data,
+            "created_at": self.created_at.isoformat(),
+        }
+
+class IdempotencyKey(models.Model):
+    """Ответ на запрос с заголовком Idempotency-Key: повтор с тем же ключом получает его же.
+
+    Ключ уникален в пределах владельца (пользователь или сессия). Строка
+    вставляется в одной транзакции с заказом, поэтому параллельный дубль ждет
+    на уникальном индексе, пока первый запрос не закончится.
+    """
+    MAX_KEY_LENGTH = 128
+
+    owner = models.CharField(max_length=64)  # "user:<id>" / "session:<key>"
+    key = models.CharField(max_length=MAX_KEY_LENGTH)
+    fingerprint = models.CharField(max_length=64)  # sha256 тела запроса
+    status_code = models.PositiveSmallIntegerField(default=0)
+    response_json = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["owner", "key"], name="idempotency_owner_key_uniq")]
+
+    def __str__(self):
+        return f"{self.owner} {self.key}"
+
+class OrderRollup(models.Model):
+    """Итоги заказов за час / сутки в разрезе статуса, оплаты и способа доставки.
+
+    Ведется сервисами заказов в той же транзакции, что и сам заказ (orders.rollups);
+    отчеты читают только эти строки, не трогая Order. Заказ относится к корзине
+    своего created_at (начало часа / суток по TIME_ZONE).
+    """
+    class Grain(models.TextChoices):
+        HOUR = "HOUR", "Час"
+        DAY = "DAY", "Сутки"
+
+    grain = models.CharField(max_length=4, choices=Grain.choices)
+    bucket = models.DateTimeField()
+    status = models.CharField(max_length=24)
+    payment_status = models.CharField(max_length=12)
+    payment_method = models.CharField(max_length=12)
+    delivery_type = models.CharField(max_length=12)
+
+    orders = models.IntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discount_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    delivery_fee = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["grain", "bucket", "status", "payment_status", "payment_method", "delivery_type"],
+                name="order_rollup_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.grain} {self.bucket:%Y-%m-%d %H:%M} {self.status}"
+
+class ItemRollup(models.Model):
+    """Проданные позиции за час / сутки по названию и статусу заказа (см. OrderRollup)."""
+    grain = models.CharField(max_length=4, choices=OrderRollup.Grain.choices)
+    bucket = models.DateTimeField()
+    title = models.CharField(max_length=200)
+    status = models.CharField(max_length=24)
+
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["grain", "bucket", "status", "title"], name="item_rollup_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.grain} {self.bucket:%Y-%m-%d %H:%M} {self.title}"
+
+class ArchivedOrder(models.Model):
+    """Индекс архива заказов: где лежит заказ, перенесенный archive_orders.
+
+    Заказ со строками и историей хранится в сжатом JSONL-сегменте (orders.archive);
+    здесь — поля для поиска и адрес gzip-блока с ним: segment, offset, length.
+    """
+    id = models.BigIntegerField(primary_key=True)  # id заказа
+    created_at = models.DateTimeField(db_index=True)
+    status = models.CharField(max_length=24, choices=Order.Status.choices)
+    payment_status = models.CharField(max_length=12, choices=Order.PaymentStatus.choices)
+    phone = models.CharField(max_length=32)
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    segment = models.CharField(max_length=64)
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Order #{self.id} (архив)"
@@ -0,0 +1,207 @@
+# orders/rollups.py
+"""Сводки продаж по часам и суткам (OrderRollup, ItemRollup).
+
+Сервисы заказов вызывают rollup_* в той же транзакции, что и изменение заказа:
+новый заказ прибавляется к корзинам своего created_at, смена статуса или
+оплаты переносит его между строками тех же корзин. Счетчики сдвигаются
+сложением в UPSERT, поэтому параллельные заказы не теряют друг друга.
+
+rebuild_rollups пересчитывает сводки за интервал из Order / OrderItem —
+для первого заполнения и если данные меняли в обход сервисов
+(manage.py backfill_rollups).
+"""
+from __future__ import annotations
+
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import ItemRollup, Order, OrderItem, OrderRollup
+
+ORDER_DIMS = ("status", "payment_status", "payment_method", "delivery_type")
+ORDER_MEASURES = ("subtotal", "discount_total", "delivery_fee", "total")
+ITEM_DIMS = ("status", "title")
+# поля заказа, которые нужны, чтобы перенести его между строками сводки
+ROLLUP_ORDER_FIELDS = ("created_at",) + ORDER_DIMS + ORDER_MEASURES
+
+ROLLUP_MEASURES = {
+    OrderRollup: ("orders",) + ORDER_MEASURES,
+    ItemRollup: ("quantity", "revenue"),
+}
+
+_G = OrderRollup.Grain
+
+
+def hour_start(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(moment):
+    return timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _buckets(moment) -> tuple:
+    return (_G.HOUR, hour_start(moment)), (_G.DAY, day_start(moment))
+
+
+def _add_order(deltas, row: dict, sign: int) -> None:
+    for key in _buckets(row["created_at"]):
+        delta = deltas[key + tuple(row[f] for f in ORDER_DIMS)]
+        delta["orders"] += sign
+        for f in ORDER_MEASURES:
+            delta[f] += sign * row[f]
+
+
+def _add_item(deltas, created_at, status: str, title: str, quantity: int, revenue, sign: int) -> None:
+    for key in _buckets(created_at):
+        delta = deltas[key + (status, title)]
+        delta["quantity"] += sign * quantity
+        delta["revenue"] += sign * revenue
+
+
+def _apply(model, dims: tuple, deltas: dict) -> None:
+    """Прибавляет deltas {(grain, bucket, *dims): {поле: приращение}} к строкам model.
+
+    Один INSERT ... ON CONFLICT DO UPDATE на пачку: число запросов не зависит от
+    числа строк заказа, а сложение в самом UPDATE не теряет параллельные заказы.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+    if connection.vendor not in ("sqlite", "postgresql"):
+        _apply_each(model, dims, deltas)
+        return
+
+    keys = ("grain", "bucket") + dims
+    measures = ROLLUP_MEASURES[model]
+    fields = [model._meta.get_field(name) for name in keys + measures]
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    updates = ", ".join(f"{qn(m)} = {table}.{qn(m)} + EXCLUDED.{qn(m)}" for m in measures)
+    rows = [key + tuple(delta[m] for m in measures) for key, delta in deltas.items()]
+    batch = connection.ops.bulk_batch_size(fields, rows) or len(rows)
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch):
+            chunk = rows[start:start + batch]
+            placeholders = ", ".join("(" + ", ".join(["%s"] * len(fields)) + ")" for _ in chunk)
+            params = [f.get_db_prep_save(value, connection) for row in chunk for f, value in zip(fields, row)]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(qn(f.column) for f in fields)}) VALUES {placeholders} "
+                f"ON CONFLICT ({', '.join(qn(k) for k in keys)}) DO UPDATE SET {updates}",
+                params,
+            )
+
+
+def _apply_each(model, dims: tuple, deltas: dict) -> None:
+    # для БД без ON CONFLICT: UPDATE на ключ, нет строки — создаем
+    for key, delta in deltas.items():
+        lookup = dict(zip(("grain", "bucket") + dims, key))
+        changes = {f: F(f) + v for f, v in delta.items()}
+        if model.objects.filter(**lookup).update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.create(**lookup, **delta)
+        except IntegrityError:
+            # строку только что создал параллельный заказ
+            model.objects.filter(**lookup).update(**changes)
+
+
+def rollup_order_created(order: Order, items) -> None:
+    """Добавляет новый заказ со строками в сводки. Вызывать в транзакции заказа."""
+    row = {f: getattr(order, f) for f in ROLLUP_ORDER_FIELDS}
+    order_deltas = defaultdict(Counter)
+    _add_order(order_deltas, row, 1)
+
+    item_deltas = defaultdict(Counter)
+    for it in items:
+        _add_item(item_deltas, order.created_at, order.status, it.title, it.quantity, it.total_price, 1)
+
+    _apply(OrderRollup, ORDER_DIMS, order_deltas)
+    _apply(ItemRollup, ITEM_DIMS, item_deltas)
+
+
+def rollup_orders_moved(field: str, rows: list, to_value: str) -> None:
+    """Переносит заказы (rows — значения ROLLUP_ORDER_FIELDS до изменения) в field=to_value."""
+    if not rows:
+        return
+    order_deltas = defaultdict(Counter)
+    for row in rows:
+        _add_order(order_deltas, row, -1)
+        _add_order(order_deltas, {**row, field: to_value}, 1)
+    _apply(OrderRollup, ORDER_DIMS, order_deltas)
+
+    if field != "status":
+        return  # в сводке позиций только статус заказа
+    by_id = {row["id"]: row for row in rows}
+    item_deltas = defaultdict(Counter)
+    lines = (
+        OrderItem.objects.filter(order_id__in=by_id)
+        .values("order_id", "title")
+        .annotate(qty=Sum("quantity"), amount=Sum("total_price"))
+    )
+    for line in lines:
+        row = by_id[line["order_id"]]
+        _add_item(item_deltas, row["created_at"], row["status"], line["title"], line["qty"], line["amount"], -1)
+        _add_item(item_deltas, row["created_at"], to_value, line["title"], line["qty"], line["amount"], 1)
+    _apply(ItemRollup, ITEM_DIMS, item_deltas)
+
+
+def rollup_order_changed(before: dict, after: dict) -> None:
+    """Переносит заказ из строк сводки по before в строки по after (значения ROLLUP_ORDER_FIELDS) —
+    для правок полей заказа мимо переходов статуса, например в админке."""
+    order_deltas = defaultdict(Counter)
+    _add_order(order_deltas, before, -1)
+    _add_order(order_deltas, after, 1)
+    _apply(OrderRollup, ORDER_DIMS, order_deltas)
+
+
+@transaction.atomic
+def rebuild_rollups(start, end) -> tuple:
+    """Пересчитывает сводки за [start, end) с нуля; start и end — начала суток.
+
+    Заказы интервала блокируются, чтобы смена статуса не проскочила между
+    подсчетом и записью. Возвращает (заказов, строк сводок).
+    """
+    orders = Order.objects.filter(created_at__gte=start, created_at__lt=end)
+    locked = len(orders.select_for_update().values_list("id", flat=True))
+    OrderRollup.objects.filter(bucket__gte=start, bucket__lt=end).delete()
+    ItemRollup.objects.filter(bucket__gte=start, bucket__lt=end).delete()
+
+    # группируем в БД по часам, суточные строки складываем из часовых
+    order_deltas = defaultdict(Counter)
+    hourly = (
+        orders.annotate(hour=TruncHour("created_at"))
+        .values("hour", *ORDER_DIMS)
+        .annotate(n=Count("id"), **{f"sum_{f}": Sum(f) for f in ORDER_MEASURES})
+    )
+    for row in hourly:
+        for key in ((_G.HOUR, row["hour"]), (_G.DAY, day_start(row["hour"]))):
+            delta = order_deltas[key + tuple(row[f] for f in ORDER_DIMS)]
+            delta["orders"] += row["n"]
+            for f in ORDER_MEASURES:
+                delta[f] += row[f"sum_{f}"]
+
+    item_deltas = defaultdict(Counter)
+    lines = (
+        OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+        .annotate(hour=TruncHour("order__created_at"))
+        .values("hour", "title", order_status=F("order__status"))
+        .annotate(qty=Sum("quantity"), amount=Sum("total_price"))
+    )
+    for line in lines:
+        _add_item(item_deltas, line["hour"], line["order_status"], line["title"], line["qty"], line["amount"], 1)
+
+    OrderRollup.objects.bulk_create([
+        OrderRollup(**dict(zip(("grain", "bucket") + ORDER_DIMS, key)), **delta)
+        for key, delta in order_deltas.items()
+    ], batch_size=500)
+    ItemRollup.objects.bulk_create([
+        ItemRollup(**dict(zip(("grain", "bucket") + ITEM_DIMS, key)), **delta)
+        for key, delta in item_deltas.items()
+    ], batch_size=500)
+    return locked, len(order_deltas) + len(item_deltas)
@@ -1,10 +1,30 @@
+import base64
+import binascii
+import hashlib
+import json
+import random
+from collections import defaultdict
+from datetime import datetime, time, timedelta
 from decimal import Decimal
-from django.db import transaction
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from cart.models import Cart
 from cart.services import clear_cart
-from .models import Order, OrderItem, PromoCode, OrderStatusHistory
+from .events import record_events
+from .models import (
+    IdempotencyKey, ItemRollup, Order, OrderEvent, OrderItem, OrderRollup, PromoCode, PromoCounterShard,
+    OrderStatusHistory,
+)
+from .rollups import (
+    ORDER_DIMS, ORDER_MEASURES, ROLLUP_ORDER_FIELDS, day_start, hour_start, rollup_order_changed, rollup_order_created,
+    rollup_orders_moved,
+)
+
+_shard_random = random.Random()  # свой генератор: не сдвигаем общий random
 
 def _dec(x) -> Decimal:
     return Decimal(str(x))
@@ -16,8 +36,52 @@ def _promo_discount(promo: PromoCode, subtotal: Decimal) -> Decimal:
         return (subtotal * promo.value / Decimal("100")).quantize(Decimal("0.01"))
     return min(subtotal, promo.value)
 
-def order_to_dict(order: Order) -> dict:
-    return {
+def reserve_promo(promo: PromoCode) -> bool:
+    """Списывает одно использование промокода. Вызывать в транзакции заказа:
+    при откате использование вернется вместе с заказом.
+
+    С лимитом — условный UPDATE (проверка и инкремент одной операцией в БД),
+    без лимита — инкремент случайной полосы счетчика.
+    """
+    if promo.usage_limit is not None:
+        updated = PromoCode.objects.filter(pk=promo.pk, used_count__lt=F("usage_limit")).update(
+            used_count=F("used_count") + 1,
+        )
+        return updated == 1
+
+    shard = _shard_random.randrange(PromoCounterShard.SHARDS)
+    if PromoCounterShard.objects.filter(promo=promo, shard=shard).update(count=F("count") + 1):
+        return True
+    try:
+        with transaction.atomic():
+            PromoCounterShard.objects.create(promo=promo, shard=shard, count=1)
+    except IntegrityError:
+        # полосу только что создал параллельный заказ
+        PromoCounterShard.objects.filter(promo=promo, shard=shard).update(count=F("count") + 1)
+    return True
+
+def fold_promo_counters(promo_ids=None) -> int:
+    """Переносит полосы счетчиков в PromoCode.used_count; возвращает, сколько перенесено."""
+    shards = PromoCounterShard.objects.filter(count__gt=0)
+    if promo_ids is not None:
+        shards = shards.filter(promo_id__in=promo_ids)
+    moved = 0
+    for shard_id, promo_id, count in shards.values_list("id", "promo_id", "count"):
+        with transaction.atomic():
+            # вычитаем прочитанное, а не обнуляем: инкременты после чтения не теряются
+            PromoCounterShard.objects.filter(pk=shard_id).update(count=F("count") - count)
+            PromoCode.objects.filter(pk=promo_id).update(used_count=F("used_count") + count)
+        moved += count
+    return moved
+
+def promo_usage(promo: PromoCode) -> int:
+    """Сколько раз использован промокод, включая еще не свернутые полосы."""
+    pending = promo.counter_shards.aggregate(n=Sum("count"))["n"] or 0
+    return promo.used_count + pending
+
+def order_to_dict(order: Order, items=None, with_items: bool = True) -> dict:
+    """items — уже загруженные/созданные строки заказа; без них читаются из БД."""
+    data = {
         "id": order.id,
         "status": order.status,
         "payment_method": order.payment_method,
@@ -29,21 +93,227 @@ def order_to_dict(order: Order) -> dict:
         "discount_total": str(order.discount_total),
         "delivery_fee": str(order.delivery_fee),
         "total": str(order.total),
-        "items": [
+    }
+    if with_items:
+        data["items"] = [
             {
                 "title": i.title,
                 "quantity": i.quantity,
                 "unit_price": str(i.unit_price),
                 "total_price": str(i.total_price),
                 "snapshot": i.snapshot_json,
-            } for i in order.items.all()
-        ],
-        "created_at": order.created_at.isoformat(),
+            } for i in (order.items.all() if items is None else items)
+        ]
+    data["created_at"] = order.created_at.isoformat()
+    return data
+
+ORDER_LIST_LIMIT = 50
+MAX_ORDER_LIST_LIMIT = 200
+ORDER_LIST_FILTERS = {
+    "status": Order.Status.values,
+    "payment_status": Order.PaymentStatus.values,
+    "delivery_type": Order.DeliveryType.values,
+}
+
+def _parse_moment(raw: str):
+    moment = parse_datetime(raw)
+    if moment is None:
+        day = parse_date(raw)
+        if day is None:
+            return None
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+def _filter_choices(qs, params, filters: dict) -> tuple:
+    """Фильтры вида ?status=NEW,CONFIRMED по полям из filters {поле: допустимые значения}."""
+    for field, choices in filters.items():
+        values = [v.strip().upper() for v in (params.get(field) or "").split(",") if v.strip()]
+        unknown = [v for v in values if v not in choices]
+        if unknown:
+            return None, f"unknown {field}: {', '.join(unknown)}"
+        if len(values) == 1:
+            qs = qs.filter(**{field: values[0]})
+        elif values:
+            qs = qs.filter(**{f"{field}__in": values})
+    return qs, None
+
+def filter_orders(params) -> tuple:
+    """(queryset, None) или (None, ошибка) по фильтрам списка заказов.
+
+    status / payment_status / delivery_type — значение или несколько через запятую,
+    created_from (включительно) / created_to (не включительно) — дата или дата-время ISO.
+    """
+    qs, error = _filter_choices(Order.objects.all(), params, ORDER_LIST_FILTERS)
+    if error:
+        return None, error
+    for param, lookup in (("created_from", "created_at__gte"), ("created_to", "created_at__lt")):
+        raw = params.get(param)
+        if raw:
+            moment = _parse_moment(raw)
+            if moment is None:
+                return None, f"{param} must be an ISO date or datetime"
+            qs = qs.filter(**{lookup: moment})
+    return qs, None
+
+def encode_order_cursor(order: Order) -> str:
+    raw = json.dumps([order.created_at.isoformat(), order.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_order_cursor(cursor: str):
+    """(created_at, id) из курсора или None, если он испорчен."""
+    try:
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        moment = parse_datetime(created_at)
+        return (moment, int(order_id)) if moment else None
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+def keyset_after(qs, created_at, order_id):
+    """Заказы строго после (created_at, id) в порядке -created_at, -id — без OFFSET.
+
+    Отдельное created_at <= ... дает планировщику диапазон по индексу: с одним
+    OR он читал бы индекс с самого начала.
+    """
+    return qs.filter(created_at__lte=created_at).filter(Q(created_at__lt=created_at) | Q(id__lt=order_id))
+
+def list_orders(params, cursor: str = None, limit: int = ORDER_LIST_LIMIT, with_items: bool = False) -> dict:
+    """Страница заказов, новые первыми; next_cursor — для следующей страницы. COUNT(*) не считаем."""
+    qs, error = filter_orders(params)
+    if error:
+        return {"ok": False, "error": error}
+    if cursor:
+        position = decode_order_cursor(cursor)
+        if position is None:
+            return {"ok": False, "error": "cursor is invalid"}
+        qs = keyset_after(qs, *position)
+
+    qs = qs.order_by("-created_at", "-id")
+    if with_items:
+        qs = qs.prefetch_related("items")
+    page = list(qs[:limit + 1])
+    next_cursor = encode_order_cursor(page[limit - 1]) if len(page) > limit else None
+    return {
+        "ok": True,
+        "orders": [order_to_dict(o, with_items=with_items) for o in page[:limit]],
+        "next_cursor": next_cursor,
+    }
+
+REPORT_FILTERS = {**ORDER_LIST_FILTERS, "payment_method": Order.PaymentMethod.values}
+REPORT_GRAINS = {"hour": OrderRollup.Grain.HOUR, "day": OrderRollup.Grain.DAY}
+# сколько корзин можно запросить за раз — ответ ограничен и не растет с историей заказов
+MAX_REPORT_BUCKETS = {OrderRollup.Grain.HOUR: 24 * 31, OrderRollup.Grain.DAY: 366}
+TOP_ITEMS_LIMIT = 10
+MAX_TOP_ITEMS_LIMIT = 100
+
+def _money(value) -> str:
+    return str(_dec(value or 0).quantize(Decimal("0.01")))
+
+def _report_range(params) -> tuple:
+    """(grain, from, to, None) или (None, None, None, ошибка).
+
+    По умолчанию — последние 24 часа или 7 суток, включая текущие.
+    """
+    grain = REPORT_GRAINS.get((params.get("grain") or "day").lower())
+    if grain is None:
+        return None, None, None, "grain must be hour or day"
+    bounds = {}
+    for param in ("from", "to"):
+        raw = params.get(param)
+        if raw:
+            moment = _parse_moment(raw)
+            if moment is None:
+                return None, None, None, f"{param} must be an ISO date or datetime"
+            bounds[param] = moment
+
+    step = timedelta(hours=1) if grain == OrderRollup.Grain.HOUR else timedelta(days=1)
+    end = bounds.get("to") or timezone.now()
+    if "from" in bounds:
+        start = bounds["from"]
+    elif grain == OrderRollup.Grain.HOUR:
+        start = hour_start(end) - 23 * step
+    else:
+        start = day_start(end) - 6 * step
+    if start >= end:
+        return None, None, None, "from must be before to"
+    if (end - start) / step > MAX_REPORT_BUCKETS[grain]:
+        return None, None, None, f"at most {MAX_REPORT_BUCKETS[grain]} {grain.lower()}s per request"
+    return grain, start, end, None
+
+def sales_report(params) -> dict:
+    """Итоги заказов по часам / суткам за [from, to) из OrderRollup, без чтения Order.
+
+    group_by — измерения через запятую (status, payment_status, payment_method, delivery_type);
+    фильтры — как у списка заказов, плюс payment_method.
+    """
+    grain, start, end, error = _report_range(params)
+    if error:
+        return {"ok": False, "error": error}
+    rows, error = _filter_choices(
+        OrderRollup.objects.filter(grain=grain, bucket__gte=start, bucket__lt=end), params, REPORT_FILTERS,
+    )
+    if error:
+        return {"ok": False, "error": error}
+    group_by = list(dict.fromkeys(g.strip() for g in (params.get("group_by") or "").split(",") if g.strip()))
+    unknown = [g for g in group_by if g not in ORDER_DIMS]
+    if unknown:
+        return {"ok": False, "error": f"unknown group_by: {', '.join(unknown)}"}
+
+    sums = {"n": Sum("orders"), **{f"sum_{f}": Sum(f) for f in ORDER_MEASURES}}
+
+    def as_dict(row) -> dict:
+        return {"orders": row["n"] or 0, **{f: _money(row[f"sum_{f}"]) for f in ORDER_MEASURES}}
+
+    buckets = [
+        {"bucket": timezone.localtime(row["bucket"]).isoformat(), **{g: row[g] for g in group_by}, **as_dict(row)}
+        for row in rows.values("bucket", *group_by).annotate(**sums).order_by("bucket", *group_by)
+        if row["n"]  # все заказы строки ушли в другой статус
+    ]
+    return {
+        "ok": True,
+        "grain": grain.lower(),
+        "from": timezone.localtime(start).isoformat(),
+        "to": timezone.localtime(end).isoformat(),
+        "group_by": group_by,
+        "buckets": buckets,
+        "totals": as_dict(rows.aggregate(**sums)),
+    }
+
+def top_items_report(params, limit: int = TOP_ITEMS_LIMIT) -> dict:
+    """Самые продаваемые позиции за [from, to) из ItemRollup; ?order_by=revenue|quantity, ?status=."""
+    grain, start, end, error = _report_range(params)
+    if error:
+        return {"ok": False, "error": error}
+    rows, error = _filter_choices(
+        ItemRollup.objects.filter(grain=grain, bucket__gte=start, bucket__lt=end),
+        params, {"status": Order.Status.values},
+    )
+    if error:
+        return {"ok": False, "error": error}
+    order_by = params.get("order_by") or "revenue"
+    if order_by not in ("revenue", "quantity"):
+        return {"ok": False, "error": "order_by must be revenue or quantity"}
+
+    top = (
+        rows.values("title")
+        .annotate(qty=Sum("quantity"), amount=Sum("revenue"))
+        .filter(qty__gt=0)
+        .order_by("-amount" if order_by == "revenue" else "-qty", "title")[:limit]
+    )
+    return {
+        "ok": True,
+        "grain": grain.lower(),
+        "from": timezone.localtime(start).isoformat(),
+        "to": timezone.localtime(end).isoformat(),
+        "items": [{"title": row["title"], "quantity": row["qty"], "revenue": _money(row["amount"])} for row in top],
     }
 
 @transaction.atomic
 def create_order_from_cart(cart: Cart, payload: dict, promo: PromoCode = None) -> dict:
-    if cart.items.count() == 0:
+    # итоги корзины денормализованы (cart.services) — читаем одну строку под блокировкой
+    totals = Cart.objects.select_for_update().only("subtotal", "item_count").get(pk=cart.pk)
+    if totals.item_count == 0:
         return {"ok": False, "error": "Cart is empty"}
 
     delivery_type = payload.get("delivery_type")
@@ -61,11 +331,12 @@ def create_order_from_cart(cart: Cart, payload: dict, promo: PromoCode = None) -
     if delivery_type == Order.DeliveryType.DELIVERY and not address:
         return {"ok": False, "error": "address is required for delivery"}
 
-    subtotal = Decimal("0")
-    for it in cart.items.all():
-        subtotal += it.total_price
+    subtotal = totals.subtotal
+    # строки корзины читаем один раз: из них и строки заказа, и ответ
+    lines = list(cart.items.all())
 
-    discount = _promo_discount(promo, subtotal) if promo else Decimal("0")
+    promo_applies = promo is not None and promo.is_valid_now(subtotal)
+    discount = _promo_discount(promo, subtotal) if promo_applies else Decimal("0")
     delivery_fee = Decimal("0")  # можно позже добавить расчет зоны доставки
     total = (subtotal - discount + delivery_fee).quantize(Decimal("0.01"))
 
@@ -83,11 +354,11 @@ def create_order_from_cart(cart: Cart, payload: dict, promo: PromoCode = None) -
         discount_total=discount.quantize(Decimal("0.01")),
         delivery_fee=delivery_fee.quantize(Decimal("0.01")),
         total=total,
-        promo_code=(promo if promo and promo.is_valid_now(subtotal) else None),
+        promo_code=(promo if promo_applies else None),
     )
 
-    for it in cart.items.all():
-        OrderItem.objects.create(
+    order_items = OrderItem.objects.bulk_create([
+        OrderItem(
             order=order,
             title=it.title,
             quantity=it.quantity,
@@ -95,14 +366,149 @@ def create_order_from_cart(cart: Cart, payload: dict, promo: PromoCode = None) -
             total_price=it.total_price,
             snapshot_json=it.snapshot_json,
         )
+        for it in lines
+    ])
 
     OrderStatusHistory.objects.create(order=order, from_status="", to_status=order.status, by_user=None)
+    record_events([OrderEvent(order=order, kind=OrderEvent.Kind.CREATED, data={
+        "status": order.status,
+        "payment_status": order.payment_status,
+        "delivery_type": order.delivery_type,
+        "total": str(order.total),
+        "item_count": sum(it.quantity for it in order_items),
+    })])
+    rollup_order_created(order, order_items)
 
-    # increment promo usage
-    if order.promo_code_id and promo:
-        promo.used_count = promo.used_count + 1
-        promo.save(update_fields=["used_count"])
+    # is_valid_now смотрел на used_count из прочитанной ранее строки; решает условный UPDATE
+    if promo_applies and not reserve_promo(promo):
+        transaction.set_rollback(True)
+        return {"ok": False, "error": "Promo code usage limit reached"}
 
     clear_cart(cart)
 
-    return {"ok": True, "order": order_to_dict(order), "redirect": f"/orders/{order.id}/success/"}
+    return {"ok": True, "order": order_to_dict(order, order_items), "redirect": f"/orders/{order.id}/success/"}
+
+_S = Order.Status
+_P = Order.PaymentStatus
+
+# из какого статуса в какие можно перевести заказ: только вперед по цепочке
+# (шаги можно пропускать — у самовывоза нет доставки) или отмена
+ORDER_TRANSITIONS = {
+    _S.NEW: {_S.CONFIRMED, _S.COOKING, _S.READY, _S.OUT_FOR_DELIVERY, _S.COMPLETED, _S.CANCELED},
+    _S.CONFIRMED: {_S.COOKING, _S.READY, _S.OUT_FOR_DELIVERY, _S.COMPLETED, _S.CANCELED},
+    _S.COOKING: {_S.READY, _S.OUT_FOR_DELIVERY, _S.COMPLETED, _S.CANCELED},
+    _S.READY: {_S.OUT_FOR_DELIVERY, _S.COMPLETED, _S.CANCELED},
+    _S.OUT_FOR_DELIVERY: {_S.COMPLETED, _S.CANCELED},
+    _S.COMPLETED: set(),
+    _S.CANCELED: set(),
+}
+
+PAYMENT_TRANSITIONS = {
+    _P.UNPAID: {_P.PENDING, _P.PAID, _P.FAILED},
+    _P.PENDING: {_P.PAID, _P.FAILED},
+    _P.FAILED: {_P.PENDING, _P.PAID},
+    _P.PAID: set(),
+}
+
+MAX_TRANSITION_ORDERS = 500
+
+def _transition(field: str, kind: str, event_kind: str, table: dict, order_ids, to_value: str, by_user) -> dict:
+    ids = list(dict.fromkeys(int(i) for i in order_ids))
+    # заодно читаем поля для сводок: заказ переносится из строки со старым значением в новую
+    current = {
+        row["id"]: row
+        for row in Order.objects.select_for_update().filter(id__in=ids).values("id", *ROLLUP_ORDER_FIELDS)
+    }
+
+    by_source, skipped = defaultdict(list), []
+    for order_id in ids:
+        source = current[order_id][field] if order_id in current else None
+        if source is None:
+            skipped.append({"id": order_id, "error": "Order not found"})
+        elif to_value in table.get(source, ()):
+            by_source[source].append(order_id)
+        else:
+            skipped.append({"id": order_id, "error": f"{source} -> {to_value} is not allowed"})
+
+    updated, history, events = [], [], []
+    for source, source_ids in by_source.items():
+        # один UPDATE на исходный статус; он же в WHERE — на случай гонки с другим переводом
+        changed = Order.objects.filter(id__in=source_ids, **{field: source}).update(**{field: to_value})
+        if changed != len(source_ids):
+            # часть заказов успел перевести параллельный запрос — какие именно, по счетчику не понять;
+            # откатываем всю пачку, чтобы не записать в историю и сводки переходы, которых не было
+            transaction.set_rollback(True)
+            return {"ok": False, "error": "Orders were changed concurrently, retry"}
+        updated += source_ids
+        history += [
+            OrderStatusHistory(order_id=i, kind=kind, from_status=source, to_status=to_value, by_user=by_user)
+            for i in source_ids
+        ]
+        events += [
+            OrderEvent(order_id=i, kind=event_kind, data={field: to_value, "from": source}) for i in source_ids
+        ]
+    OrderStatusHistory.objects.bulk_create(history)
+    record_events(events)
+    rollup_orders_moved(field, [current[i] for i in updated], to_value)
+    return {"ok": True, "updated": updated, "skipped": skipped}
+
+@transaction.atomic
+def transition_orders(order_ids, to_status: str, by_user=None) -> dict:
+    """Переводит заказы в to_status по ORDER_TRANSITIONS; недопустимые переходы пропускаются."""
+    if to_status not in Order.Status.values:
+        return {"ok": False, "error": f"Unknown status {to_status}"}
+    return _transition(
+        "status", OrderStatusHistory.Kind.STATUS, OrderEvent.Kind.STATUS, ORDER_TRANSITIONS, order_ids, to_status, by_user,
+    )
+
+@transaction.atomic
+def set_payment_status(order_ids, to_status: str, by_user=None) -> dict:
+    """То же для статуса оплаты (PAYMENT_TRANSITIONS), с записью в историю."""
+    if to_status not in Order.PaymentStatus.values:
+        return {"ok": False, "error": f"Unknown payment status {to_status}"}
+    return _transition(
+        "payment_status", OrderStatusHistory.Kind.PAYMENT, OrderEvent.Kind.PAYMENT, PAYMENT_TRANSITIONS,
+        order_ids, to_status, by_user,
+    )
+
+@transaction.atomic
+def save_order_fields(order: Order, fields) -> None:
+    """Сохраняет поля fields заказа (кроме статусов — для них transition_orders и
+    set_payment_status) и переносит заказ между строками сводок, если они поменялись."""
+    fields = list(fields)
+    before = Order.objects.select_for_update().values(*ROLLUP_ORDER_FIELDS).get(pk=order.pk)
+    order.save(update_fields=fields)
+    if before.keys() & fields:
+        rollup_order_changed(before, {**before, **{f: getattr(order, f) for f in fields if f in before}})
+
+def request_fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def run_idempotent(owner: str, key: str, fingerprint: str, handler) -> tuple:
+    """(status, body, replayed). handler() -> (status, body) выполняется не больше раза на ключ.
+
+    Ключ вставляется в той же транзакции, что и работа handler: дубль, пришедший
+    параллельно, блокируется на уникальном индексе и потом получает сохраненный
+    ответ. Если handler упал, откатывается и ключ — повтор выполнится заново.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 24 * 3600))
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    owner=owner, key=key, fingerprint=fingerprint, expires_at=expires_at,
+                )
+        except IntegrityError:
+            record = IdempotencyKey.objects.select_for_update().get(owner=owner, key=key)
+            if record.expires_at > now:
+                if record.fingerprint != fingerprint:
+                    return 422, {"ok": False, "error": "Idempotency-Key was used with a different request"}, False
+                return record.status_code, record.response_json, True
+            # ключ истек, но purge до него еще не дошел — выполняем как новый
+            record.fingerprint, record.created_at, record.expires_at = fingerprint, now, expires_at
+
+        status, body = handler()
+        record.status_code, record.response_json = status, body
+        record.save()
+        return status, body, False
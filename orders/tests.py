@@ -0,0 +1,328 @@
+import io
+from datetime import timedelta
+from decimal import Decimal
+from itertools import combinations, product
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.contrib import messages
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from builder.models import BaseOption, SizeOption
+from cart import services as cart_services
+from cart.models import Cart
+from catalog.models import Ingredient, Product
+from orders.events import EventHub
+from orders.models import Order, OrderEvent, OrderRollup, OrderStatusHistory, PromoCode
+from orders.rollups import day_start, rebuild_rollups
+from orders.services import create_order_from_cart, filter_orders, keyset_after, promo_usage, transition_orders
+
+CHECKOUT_PAYLOAD = {"phone": "+70000000000", "delivery_type": "PICKUP"}
+
+
+class CheckoutQueryBudgetTests(TestCase):
+    """Оформление заказа — постоянное число запросов, сколько бы строк ни было в корзине."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("seed_demo", stdout=io.StringIO())
+        cls.products = list(Product.objects.filter(is_available=True).order_by("id"))
+        cls.builds = [
+            {"product_id": cls.products[0].id, "size_id": size, "base_id": base, "ingredient_ids": list(ingredients)}
+            for size, base, ingredients in product(
+                SizeOption.objects.values_list("id", flat=True),
+                BaseOption.objects.values_list("id", flat=True),
+                combinations(Ingredient.objects.order_by("id").values_list("id", flat=True)[:4], 2),
+            )
+        ]
+
+    def _cart(self, builder_lines: int, product_lines: int) -> Cart:
+        cart = Cart.objects.create(session_key=f"budget-{builder_lines}-{product_lines}")
+        for build in self.builds[:builder_lines]:
+            self.assertTrue(cart_services.add_builder_item(cart, build).get("ok"))
+        for p in self.products[:product_lines]:
+            self.assertTrue(cart_services.add_product_item(cart, p.id, 2).get("ok"))
+        self.assertEqual(cart.items.count(), builder_lines + product_lines)
+        return cart
+
+    def _checkout(self, cart: Cart) -> None:
+        result = create_order_from_cart(cart, CHECKOUT_PAYLOAD)
+        self.assertTrue(result["ok"], result)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.assertGreaterEqual(len(self.builds), 30)
+        one_builder = self._cart(builder_lines=1, product_lines=0)
+        one_product = self._cart(builder_lines=0, product_lines=1)
+        many_lines = self._cart(builder_lines=30, product_lines=2)
+
+        with CaptureQueriesContext(connection) as one_line:
+            self._checkout(one_builder)
+        with self.assertNumQueries(len(one_line)):
+            self._checkout(one_product)
+        with self.assertNumQueries(len(one_line)):
+            self._checkout(many_lines)
+
+
+class TransitionRaceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command("seed_demo", stdout=io.StringIO())
+
+    def _order(self, n: int) -> Order:
+        cart = Cart.objects.create(session_key=f"race-{n}")
+        cart_services.add_product_item(cart, Product.objects.order_by("id").first().id)
+        return Order.objects.get(pk=create_order_from_cart(cart, CHECKOUT_PAYLOAD)["order"]["id"])
+
+    def test_concurrent_move_rolls_back_whole_batch(self):
+        first, second = self._order(1), self._order(2)
+        rollups = list(OrderRollup.objects.order_by("id").values())
+        history = OrderStatusHistory.objects.count()
+        events = OrderEvent.objects.count()
+        real_update = QuerySet.update
+        raced = []
+
+        def racing_update(qs, **kwargs):
+            # между чтением под блокировкой и UPDATE второй заказ успевает отменить другой запрос
+            if qs.model is Order and kwargs.get("status") == Order.Status.CONFIRMED and not raced:
+                raced.append(True)
+                real_update(Order.objects.filter(pk=second.pk), status=Order.Status.CANCELED)
+            return real_update(qs, **kwargs)
+
+        with patch.object(QuerySet, "update", racing_update):
+            result = transition_orders([first.pk, second.pk], Order.Status.CONFIRMED)
+
+        self.assertTrue(raced)
+        self.assertFalse(result["ok"])
+        first.refresh_from_db()
+        self.assertEqual(first.status, Order.Status.NEW)
+        self.assertEqual(OrderStatusHistory.objects.count(), history)
+        self.assertEqual(OrderEvent.objects.count(), events)
+        self.assertEqual(list(OrderRollup.objects.order_by("id").values()), rollups)
+
+    def test_transition_records_history_and_rollups(self):
+        first, second = self._order(1), self._order(2)
+        result = transition_orders([first.pk, second.pk], Order.Status.CONFIRMED)
+        self.assertEqual(result["updated"], [first.pk, second.pk])
+        self.assertEqual(OrderStatusHistory.objects.filter(to_status=Order.Status.CONFIRMED).count(), 2)
+        confirmed = OrderRollup.objects.filter(grain=OrderRollup.Grain.DAY, status=Order.Status.CONFIRMED)
+        self.assertEqual(sum(confirmed.values_list("orders", flat=True)), 2)
+
+
+class PromoRaceTests(TestCase):
+    """Промокод прочитан до того, как параллельный заказ израсходовал лимит (устаревший used_count)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("seed_demo", stdout=io.StringIO())
+        cls.product = Product.objects.order_by("id").first()
+
+    def _cart(self, n: int) -> Cart:
+        cart = Cart.objects.create(session_key=f"promo-{n}")
+        cart_services.add_product_item(cart, self.product.id, 3)
+        return cart
+
+    def test_limit_holds_when_reservations_interleave(self):
+        PromoCode.objects.create(code="ONCE", discount_type="FIXED", value=Decimal("100"), usage_limit=1)
+        # оба оформления прочитали промокод, пока used_count == 0
+        stale_first, stale_second = PromoCode.objects.get(code="ONCE"), PromoCode.objects.get(code="ONCE")
+        winner_cart, loser_cart = self._cart(1), self._cart(2)
+
+        winner = create_order_from_cart(winner_cart, CHECKOUT_PAYLOAD, promo=stale_first)
+        self.assertTrue(winner["ok"])
+        self.assertEqual(winner["order"]["discount_total"], "100.00")
+
+        orders, events, rollups = Order.objects.count(), OrderEvent.objects.count(), OrderRollup.objects.count()
+        self.assertTrue(stale_second.is_valid_now(loser_cart.subtotal))  # по устаревшей строке скидка еще положена
+        loser = create_order_from_cart(loser_cart, CHECKOUT_PAYLOAD, promo=stale_second)
+
+        self.assertEqual(loser, {"ok": False, "error": "Promo code usage limit reached"})
+        self.assertEqual(PromoCode.objects.get(code="ONCE").used_count, 1)
+        # заказ проигравшего откатился целиком, корзина на месте
+        self.assertEqual(Order.objects.count(), orders)
+        self.assertEqual(OrderEvent.objects.count(), events)
+        self.assertEqual(OrderRollup.objects.count(), rollups)
+        self.assertEqual(loser_cart.items.count(), 1)
+
+        # повторное оформление с актуальным промокодом проходит по полной цене
+        retry = create_order_from_cart(loser_cart, CHECKOUT_PAYLOAD, promo=PromoCode.objects.get(code="ONCE"))
+        self.assertTrue(retry["ok"])
+        self.assertEqual(retry["order"]["discount_total"], "0.00")
+
+    def test_unlimited_code_counts_every_order(self):
+        promo = PromoCode.objects.create(code="ALWAYS", discount_type="FIXED", value=Decimal("50"))
+        for n in range(12):
+            self.assertTrue(create_order_from_cart(self._cart(n), CHECKOUT_PAYLOAD, promo=promo)["ok"])
+        self.assertEqual(promo_usage(promo), 12)
+        self.assertEqual(Order.objects.filter(promo_code=promo).count(), 12)
+
+
+class OrderListIndexTests(TestCase):
+    """Запросы GET /api/orders/ идут по составным индексам (created_at, id), а не перебором таблицы."""
+
+    # (фильтры списка, со страницей по курсору, индекс, который должен выбрать планировщик)
+    CASES = [
+        ({}, False, "order_created_idx"),
+        ({}, True, "order_created_idx"),
+        ({"status": "NEW"}, False, "order_status_created_idx"),
+        ({"status": "READY"}, True, "order_status_created_idx"),
+        ({"payment_status": "PENDING"}, False, "order_payment_created_idx"),
+        ({"delivery_type": "DELIVERY"}, True, "order_delivery_created_idx"),
+    ]
+
+    def test_list_queries_use_composite_indexes(self):
+        now = timezone.now()
+        for params, with_cursor, index in self.CASES:
+            with self.subTest(params=params, cursor=with_cursor):
+                qs, error = filter_orders(params)
+                self.assertIsNone(error)
+                if with_cursor:
+                    qs = keyset_after(qs, now, 2 ** 62)
+                plan = qs.order_by("-created_at", "-id")[:51].explain()
+                self.assertIn(index, plan)
+                if connection.vendor == "sqlite":
+                    # ни полного перебора, ни сортировки во временном B-дереве
+                    self.assertNotIn("SCAN orders_order\n", plan + "\n")
+                    self.assertNotIn("TEMP B-TREE", plan)
+
+
+class OrderAdminTests(TestCase):
+    """Правка заказа в админке: статусы переводят сервисы, сводки сходятся с пересчетом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("seed_demo", stdout=io.StringIO())
+        cls.admin = get_user_model().objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _order(self) -> Order:
+        cart = Cart.objects.create(session_key="admin-edit")
+        cart_services.add_product_item(cart, Product.objects.order_by("id").first().id)
+        return Order.objects.get(pk=create_order_from_cart(cart, CHECKOUT_PAYLOAD)["order"]["id"])
+
+    def _save(self, order: Order, **changes):
+        data = {
+            field: getattr(order, field)
+            for field in ("guest_name", "phone", "email", "delivery_type", "address", "comment", "status",
+                          "payment_method", "payment_status", "subtotal", "discount_total", "delivery_fee", "total")
+        }
+        data.update({"user": "", "promo_code": "", "scheduled_for_0": "", "scheduled_for_1": ""})
+        for prefix in ("items", "status_history"):
+            data.update({f"{prefix}-TOTAL_FORMS": 0, f"{prefix}-INITIAL_FORMS": 0})
+        data.update(changes)
+        response = self.client.post(reverse("admin:orders_order_change", args=[order.pk]), data)
+        self.assertEqual(response.status_code, 302)
+        order.refresh_from_db()
+        return response
+
+    def _rollups(self) -> list:
+        rows = OrderRollup.objects.filter(orders__gt=0).values("grain", "bucket", "status", "payment_status",
+                                                                "payment_method", "delivery_type", "orders", "total")
+        return sorted(tuple(row.values()) for row in rows)
+
+    def _assert_rollups_match_rebuild(self) -> None:
+        incremental = self._rollups()
+        start = day_start(timezone.now())
+        rebuild_rollups(start, start + timedelta(days=1))
+        self.assertEqual(incremental, self._rollups())
+
+    def test_status_and_payment_edits_go_through_services(self):
+        order = self._order()
+        response = self._save(order, status=Order.Status.CONFIRMED, payment_status=Order.PaymentStatus.PAID,
+                              delivery_type=Order.DeliveryType.DELIVERY, delivery_fee="300.00", total=order.total + 300)
+
+        self.assertEqual(response.url, reverse("admin:orders_order_changelist"))
+        self.assertIn(messages.SUCCESS, {m.level for m in get_messages(response.wsgi_request)})
+
+        self.assertEqual((order.status, order.payment_status), (Order.Status.CONFIRMED, Order.PaymentStatus.PAID))
+        self.assertEqual(order.delivery_fee, Decimal("300.00"))
+        history = order.status_history.filter(by_user=self.admin).values_list("kind", "from_status", "to_status")
+        self.assertCountEqual(history, [
+            (OrderStatusHistory.Kind.STATUS, Order.Status.NEW, Order.Status.CONFIRMED),
+            (OrderStatusHistory.Kind.PAYMENT, Order.PaymentStatus.UNPAID, Order.PaymentStatus.PAID),
+        ])
+        self.assertEqual(order.events.filter(kind=OrderEvent.Kind.STATUS).count(), 1)
+        self._assert_rollups_match_rebuild()
+
+    def test_disallowed_transition_keeps_status(self):
+        order = self._order()
+        transition_orders([order.pk], Order.Status.COMPLETED)
+        order.refresh_from_db()
+        history = order.status_history.count()
+
+        response = self._save(order, status=Order.Status.CANCELED, comment="Клиент звонил")
+
+        # остаемся на форме, и об успешном изменении не сообщаем
+        self.assertEqual(response.url, reverse("admin:orders_order_change", args=[order.pk]))
+        levels = [m.level for m in get_messages(response.wsgi_request)]
+        self.assertNotIn(messages.SUCCESS, levels)
+        self.assertIn(messages.WARNING, levels)
+        self.assertEqual(order.status, Order.Status.COMPLETED)
+        self.assertEqual(order.comment, "Клиент звонил")
+        self.assertEqual(order.status_history.count(), history)
+        self._assert_rollups_match_rebuild()
+
+
+class ListEventBackend:
+    """Backend ленты поверх списка: коммиты не по порядку id задаются вручную."""
+
+    def __init__(self):
+        self.events = []
+
+    def commit(self, *ids):
+        self.events = sorted(self.events + [{"id": i, "type": "order.status"} for i in ids], key=lambda e: e["id"])
+
+    def last_id(self):
+        return self.events[-1]["id"] if self.events else 0
+
+    def read_after(self, cursor, limit=200):
+        return [e for e in self.events if e["id"] > cursor][:limit]
+
+
+class EventHubGapTests(SimpleTestCase):
+    """id, закоммиченный позже большего, не теряется: курсор не перескакивает дыру, пока она свежая."""
+
+    def setUp(self):
+        self.backend = ListEventBackend()
+        self.backend.commit(1)
+        self.hub = EventHub(self.backend, poll_interval=0, gap_wait=2.0)
+        self.now = 100.0
+        clock = patch("orders.events.time.monotonic", side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.cursor = async_to_sync(self.hub.current_cursor)()
+
+    def _ids(self, cursor):
+        return [e["id"] for e in async_to_sync(self.hub.wait)(cursor, timeout=0)]
+
+    def test_late_commit_is_delivered(self):
+        self.backend.commit(3)  # транзакция с id 2 еще не закоммичена
+        self.assertEqual(self._ids(self.cursor), [])
+        self.assertEqual(async_to_sync(self.hub.current_cursor)(), 1)
+        self.now += 1
+        self.backend.commit(2)
+        self.assertEqual(self._ids(self.cursor), [2, 3])
+
+    def test_rolled_back_id_is_skipped_after_wait(self):
+        self.backend.commit(2, 4)  # id 3 откатился и не появится
+        self.assertEqual(self._ids(self.cursor), [2])
+        self.now += 1
+        self.assertEqual(self._ids(2), [])
+        self.now += 1.5
+        self.assertEqual(self._ids(2), [4])
+
+    def test_backend_catch_up_stops_at_gap(self):
+        self.backend.commit(2, 3)
+        self.assertEqual(self._ids(0), [1, 2, 3])
+        self.backend.commit(5)
+        # курсор ниже буфера — читаем из backend, но не за свежую дыру
+        self.assertEqual(self._ids(0), [1, 2, 3])